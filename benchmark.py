@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Микробенчмарк конвейера анализа Pocket Option Analyzer Bot
+Прогоняет синтетические OHLCV разного размера через нормализацию данных,
+расчёт индикаторов и скоринг, измеряет время и пиковую память каждого этапа.
+
+Примеры:
+    python benchmark.py                          # вывести результаты
+    python benchmark.py --save                   # сохранить базовую линию
+    python benchmark.py --compare                # сравнить с базовой линией
+    python benchmark.py --sizes 200 2000 --repeat 5
+"""
+
+import sys
+import json
+import time
+import logging
+import argparse
+import platform
+import statistics
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# Добавляем текущую директорию в путь
+sys.path.insert(0, str(Path(__file__).parent))
+
+from main import TechnicalAnalyzer, _normalize_yahoo_frame
+
+DEFAULT_SIZES = [200, 2_000, 20_000, 200_000]
+DEFAULT_BASELINE = Path(__file__).parent / 'benchmark_baseline.json'
+
+def make_raw_frame(rows: int, seed: int = 42) -> pd.DataFrame:
+    """Синтетический ответ yfinance: MultiIndex колонки и время с часовым поясом"""
+    rng = np.random.default_rng(seed)
+    close = 1.1 * np.exp(np.cumsum(rng.normal(0, 0.0005, rows)))
+    open_ = np.r_[close[0], close[:-1]]
+    high = np.maximum(open_, close) * (1 + np.abs(rng.normal(0, 0.0002, rows)))
+    low = np.minimum(open_, close) * (1 - np.abs(rng.normal(0, 0.0002, rows)))
+    index = pd.date_range('2020-01-01', periods=rows, freq='1min', tz='Europe/London')
+    columns = pd.MultiIndex.from_product([['Open', 'High', 'Low', 'Close', 'Volume'], ['EURUSD=X']])
+    data = np.column_stack([open_, high, low, close, np.zeros(rows)])
+    return pd.DataFrame(data, index=index, columns=columns)
+
+def measure(func, repeat: int) -> dict:
+    """Медианное время выполнения и пиковая память (отдельным прогоном под tracemalloc)"""
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {
+        'time_ms': round(statistics.median(timings) * 1000, 3),
+        'peak_kb': round(peak / 1024, 1)
+    }
+
+def run_benchmarks(sizes, repeat: int) -> dict:
+    """Прогон всех этапов для каждого размера кадра"""
+    analyzer = TechnicalAnalyzer()
+    results = {}
+    for rows in sizes:
+        raw = make_raw_frame(rows)
+        df = _normalize_yahoo_frame(raw.copy())
+        indicators = analyzer.calculate_indicators(df).evaluate()
+        stages = {
+            # Нормализация мутирует колонки, поэтому каждый прогон получает свою копию
+            'normalize': lambda: _normalize_yahoo_frame(raw.copy()),
+            'indicators': lambda: analyzer.calculate_indicators(df).evaluate(),
+            'signals': lambda: analyzer.analyze_signals(df, indicators),
+            'analyze_latest': lambda: analyzer.analyze_latest(df),
+            'score_history': lambda: analyzer.score_history(df),
+        }
+        results[str(rows)] = {}
+        for stage, func in stages.items():
+            results[str(rows)][stage] = measure(func, repeat)
+            print(f"{rows:>8} {stage:<16} {results[str(rows)][stage]['time_ms']:>10.2f} ms "
+                  f"{results[str(rows)][stage]['peak_kb']:>12.1f} KB")
+    return results
+
+def compare(current: dict, baseline: dict, threshold: float) -> bool:
+    """Сравнение с базовой линией; True, если регрессий по времени нет"""
+    ok = True
+    print(f"\n{'rows':>8} {'stage':<16} {'base ms':>10} {'now ms':>10} {'ratio':>7}")
+    for rows, stages in current.items():
+        for stage, now in stages.items():
+            base = baseline.get(rows, {}).get(stage)
+            if not base:
+                continue
+            ratio = now['time_ms'] / base['time_ms'] if base['time_ms'] else float('inf')
+            mark = ""
+            if ratio > threshold:
+                mark = "  ⚠️ регрессия"
+                ok = False
+            print(f"{rows:>8} {stage:<16} {base['time_ms']:>10.2f} {now['time_ms']:>10.2f} {ratio:>7.2f}{mark}")
+    return ok
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк конвейера анализа")
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help="Размеры кадров (свечей)")
+    parser.add_argument('--repeat', type=int, default=3, help="Повторов на этап (берётся медиана)")
+    parser.add_argument('--save', nargs='?', const=str(DEFAULT_BASELINE), help="Сохранить результаты как базовую линию")
+    parser.add_argument('--compare', nargs='?', const=str(DEFAULT_BASELINE), help="Сравнить с базовой линией")
+    parser.add_argument('--threshold', type=float, default=1.25, help="Допустимое замедление относительно базы")
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    print(f"{'rows':>8} {'stage':<16} {'time':>13} {'peak memory':>15}")
+    results = run_benchmarks(args.sizes, args.repeat)
+
+    if args.save:
+        payload = {
+            'meta': {
+                'timestamp': datetime.now().isoformat(timespec='seconds'),
+                'python': platform.python_version(),
+                'numpy': np.__version__,
+                'pandas': pd.__version__,
+                'machine': platform.machine(),
+                'repeat': args.repeat
+            },
+            'results': results
+        }
+        Path(args.save).write_text(json.dumps(payload, indent=2, ensure_ascii=False), encoding='utf-8')
+        print(f"\n💾 Базовая линия сохранена: {args.save}")
+
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text(encoding='utf-8'))
+        if not compare(results, baseline['results'], args.threshold):
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
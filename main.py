@@ -1,12 +1,28 @@
 import os
+import re
+import heapq
+import copy
+import json
+import pickle
+import sqlite3
+import hashlib
+import time
 import logging
 import asyncio
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Dict, List, Tuple, Optional
+from typing import Dict, List, Tuple, Optional, Callable, Awaitable
 
 import pandas as pd
 import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
 import ccxt
+import ccxt.async_support as ccxt_async
+import aiohttp
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InputFile
 from telegram.ext import (
     Application, CommandHandler, CallbackQueryHandler, 
@@ -57,9 +73,358 @@ SIGNAL_THRESHOLDS = {
     'strong_bear': -3
 }
 
-class TechnicalAnalyzer:
-    """Класс для технического анализа"""
-    
+# Настройки анализа
+# Режим расчёта индикаторов для одиночного анализа (ровно один путь, без приоритетов флагов):
+#   'streaming' — инкрементальное состояние на пару/таймфрейм; если последняя свеча
+#                 не даёт валидных значений, этот анализ пересчитывается по хвосту ('tail')
+#   'tail'      — без состояния, индикаторы только по хвосту истории, нужному последней свече
+#   'full'      — полный пересчёт индикаторов по всей истории (эталон для сверки)
+ANALYSIS_CONFIG = {
+    'mode': 'streaming',
+    'max_streams': 512  # Сколько пар/таймфреймов держать в потоковом состоянии
+}
+
+# Настройки поиска лучшего прогноза (/search)
+SCAN_CONFIG = {
+    'timeframes': ['1m', '5m', '15m', '30m', '1h', '4h', '1d'],
+    'concurrency': 16,  # Сколько загрузок свечей пар выполняется одновременно
+    'deadline': 20.0    # Общий лимит времени на поиск (сек)
+}
+
+# Настройки получения и кэширования рыночных данных
+DATA_CONFIG = {
+    'cache_max_entries': 256,  # Максимум записей в LRU-кэше OHLCV
+    'cache_max_age': 60,       # Верхняя граница жизни записи (сек) для длинных таймфреймов
+    'incremental': True,       # Докачивать только новые свечи вместо полной загрузки
+    'ring_buffer_size': 1000,  # Сколько последних свечей хранить на пару/таймфрейм
+    'markets_refresh_interval': 3600,  # Период фонового обновления списка рынков Binance (сек)
+    'markets_retry_interval': 60,      # Повтор загрузки рынков после ошибки (сек)
+    'http_pool_size': 100,     # Размер общего пула keep-alive соединений
+    'http_timeout': 30,        # Таймаут одного HTTP-запроса (сек)
+    'route_memo_ttl': 3600,    # Сколько помнить, что пара строится только синтетически (сек)
+    'candle_store_dir': os.getenv('CANDLE_STORE_DIR', ''),  # Каталог постоянного хранилища свечей ('' — выключено)
+    'gap_fill_limit': 1000,    # Размер страницы докачки разрыва Binance после простоя (свечей)
+    'warmup_chunk_size': 9,    # Сколько пар проверять за один шаг фонового прогрева
+    'availability_ttl': 1800,  # Сколько доверять успешной проверке пары (сек)
+    'availability_retry': 60,  # Первая повторная проверка недоступной пары (сек), далее ×2
+    'availability_max_backoff': 3600  # Предел backoff для недоступной пары (сек)
+}
+
+# Настройки журнала прогнозов
+FORECAST_CONFIG = {
+    'db_path': os.getenv('FORECAST_DB', 'forecasts.db'),  # Файл SQLite журнала прогнозов ('' — только в памяти)
+    'flush_interval': 2.0,     # Период сброса накопленных записей в журнал (сек)
+    'flush_batch': 200,        # Сброс без ожидания, если накопилось столько операций
+    'retention_days': 30,      # Сколько хранить закрытые прогнозы в журнале
+    'purge_interval': 3600,    # Период очистки старых записей (сек)
+    'stats_window': 50,        # Эффективное окно скользящей точности (прогнозов)
+    'stats_max_bucket': 5      # Баллы |score| от этого значения попадают в одну корзину
+}
+
+YAHOO_CHART_URL = "https://query1.finance.yahoo.com/v8/finance/chart/{ticker}"
+
+def _timeframe_seconds(timeframe: str) -> int:
+    """Длительность свечи таймфрейма (1m, 15m, 1h, 4h, 1d ...) в секундах"""
+    units = {'m': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+    try:
+        return int(timeframe[:-1]) * units[timeframe[-1]]
+    except (KeyError, ValueError, IndexError):
+        return 60
+
+def _ohlcv_to_frame(ohlcv: List) -> pd.DataFrame:
+    """Преобразование ответа ccxt fetch_ohlcv в DataFrame с DatetimeIndex"""
+    df = pd.DataFrame(ohlcv, columns=['timestamp', 'open', 'high', 'low', 'close', 'volume'])
+    df['timestamp'] = pd.to_datetime(df['timestamp'], unit='ms')
+    df.set_index('timestamp', inplace=True)
+    return df
+
+def _normalize_yahoo_frame(data: pd.DataFrame) -> pd.DataFrame:
+    """Приведение ответа yfinance к колонкам open/high/low/close/volume"""
+    if data.empty:
+        return pd.DataFrame(columns=['open', 'high', 'low', 'close', 'volume'])
+    # Исправление для MultiIndex (yfinance для форекс)
+    if isinstance(data.columns, pd.MultiIndex):
+        # Берём только значения для тикера (обычно первый уровень)
+        data.columns = [col[0] for col in data.columns]
+    data = data.rename(columns={
+        'Open': 'open', 'High': 'high', 'Low': 'low', 'Close': 'close', 'Volume': 'volume'
+    })
+    # Исправление: если столбцы имеют shape (N, 1), преобразуем их в Series
+    for col in ['open', 'high', 'low', 'close', 'volume']:
+        if col in data.columns and hasattr(data[col], 'values') and len(data[col].values.shape) > 1:
+            data[col] = data[col].values.reshape(-1)
+    for col in ['open', 'high', 'low', 'close']:
+        if col in data.columns:
+            data[col] = pd.to_numeric(data[col], errors='coerce')
+    if 'volume' not in data.columns:
+        data['volume'] = 0
+    data['volume'] = pd.to_numeric(data['volume'], errors='coerce').fillna(0)
+    # Единая временная зона для данных из yfinance и chart API
+    if isinstance(data.index, pd.DatetimeIndex) and data.index.tz is not None:
+        data.index = data.index.tz_convert('UTC')
+    # Очистка NaN
+    return data[['open', 'high', 'low', 'close', 'volume']].dropna()
+
+def _invert_ohlc(df: pd.DataFrame) -> pd.DataFrame:
+    """Инвертирование котировки (QUOTE/BASE → BASE/QUOTE): high и low меняются местами"""
+    if df.empty:
+        return df
+    inv = pd.DataFrame(index=df.index)
+    inv['open'] = 1.0 / df['open']
+    inv['high'] = 1.0 / df['low']
+    inv['low'] = 1.0 / df['high']
+    inv['close'] = 1.0 / df['close']
+    inv['volume'] = df['volume']
+    return inv
+
+def _chart_to_frame(payload: Dict) -> pd.DataFrame:
+    """Преобразование ответа chart API Yahoo Finance в OHLCV DataFrame"""
+    result = (payload.get('chart') or {}).get('result') or []
+    if not result or not result[0].get('timestamp'):
+        return _normalize_yahoo_frame(pd.DataFrame())
+    quote = result[0]['indicators']['quote'][0]
+    data = pd.DataFrame(
+        {col: quote.get(col) for col in ['open', 'high', 'low', 'close', 'volume']},
+        index=pd.to_datetime(result[0]['timestamp'], unit='s', utc=True)
+    )
+    return _normalize_yahoo_frame(data)
+
+def _split_yf_download(raw: pd.DataFrame, tickers: List[str]) -> Dict[str, pd.DataFrame]:
+    """Разбиение multi-ticker ответа yf.download (group_by='ticker') по тикерам.
+    yfinance до 0.2.48 для списка из одного тикера возвращает плоские колонки"""
+    frames = {}
+    has_tickers = isinstance(raw.columns, pd.MultiIndex)
+    if not has_tickers and len(tickers) == 1:
+        return {tickers[0]: raw.dropna(how='all')}
+    level0 = set(raw.columns.get_level_values(0)) if has_tickers else set()
+    for ticker in tickers:
+        if ticker in level0:
+            # Общий индекс всех тикеров: строки чужих торговых часов пустые
+            frames[ticker] = raw[ticker].dropna(how='all')
+        else:
+            frames[ticker] = pd.DataFrame()
+    return frames
+
+def _drive_plan(plan, load):
+    """Выполнение плана загрузки: каждый запрошенный тикер загружается через load"""
+    try:
+        ticker = next(plan)
+        while True:
+            ticker = plan.send(load(ticker))
+    except StopIteration as stop:
+        return stop.value
+
+async def _drive_plan_async(plan, load):
+    """Асинхронный вариант _drive_plan: load — корутина"""
+    try:
+        ticker = next(plan)
+        while True:
+            ticker = plan.send(await load(ticker))
+    except StopIteration as stop:
+        return stop.value
+
+def _merge_candles(old: Optional[pd.DataFrame], new: pd.DataFrame) -> pd.DataFrame:
+    """Дописывание новых свечей к буферу; свежая версия свечи заменяет сохранённую"""
+    if old is None or old.empty:
+        return new
+    if new.empty:
+        return old
+    merged = pd.concat([old, new])
+    return merged[~merged.index.duplicated(keep='last')].sort_index()
+
+def _rolling_mean_abs_dev(values: np.ndarray, window: int) -> np.ndarray:
+    """Скользящее среднее абсолютное отклонение от среднего окна (для CCI).
+    Эквивалент rolling(window).apply(lambda x: np.mean(np.abs(x - x.mean()))) без Python-колбэка"""
+    result = np.full(len(values), np.nan)
+    if window <= 0 or len(values) < window:
+        return result
+    windows = sliding_window_view(values, window)
+    deviations = np.abs(windows - windows.mean(axis=1, keepdims=True))
+    result[window - 1:] = deviations.mean(axis=1)
+    return result
+
+def _panel_shift(x: np.ndarray) -> np.ndarray:
+    """Сдвиг панели (пары × время) на одну свечу вправо, как Series.shift(1)"""
+    out = np.full_like(x, np.nan)
+    out[:, 1:] = x[:, :-1]
+    return out
+
+def _panel_windows(x: np.ndarray, window: int) -> np.ndarray:
+    """Окна длины window для каждой свечи (слева дополнено NaN): форма (пары × время × окно)"""
+    padded = np.concatenate([np.full((x.shape[0], window - 1), np.nan), x], axis=1)
+    return sliding_window_view(padded, window, axis=1)
+
+def _panel_rolling_mean(x: np.ndarray, window: int, min_periods: Optional[int] = None) -> np.ndarray:
+    """Скользящее среднее по оси времени через кумулятивные суммы (NaN не учитываются)"""
+    min_periods = window if min_periods is None else min_periods
+    valid = ~np.isnan(x)
+    sums = np.cumsum(np.where(valid, x, 0.0), axis=1)
+    counts = np.cumsum(valid, axis=1)
+    sums[:, window:] = sums[:, window:] - sums[:, :-window]
+    counts[:, window:] = counts[:, window:] - counts[:, :-window]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(counts >= max(min_periods, 1), sums / counts, np.nan)
+
+def _panel_ewm(x: np.ndarray, span: int, adjust: bool = True) -> np.ndarray:
+    """EMA по оси времени в семантике pandas ewm(span).mean(); ведущие NaN пропускаются"""
+    alpha = 2.0 / (span + 1)
+    decay = 1.0 - alpha
+    new_weight = 1.0 if adjust else alpha
+    out = np.full_like(x, np.nan)
+    value = np.full(x.shape[0], np.nan)
+    weight = np.zeros(x.shape[0])
+    for t in range(x.shape[1]):
+        cur = x[:, t]
+        started = ~np.isnan(value)
+        cont = started & ~np.isnan(cur)
+        first = ~started & ~np.isnan(cur)
+        w = weight * decay
+        updated = np.where(value != cur, (w * value + new_weight * cur) / (w + new_weight), value)
+        value = np.where(cont, updated, np.where(first, cur, value))
+        weight = np.where(cont, w + new_weight if adjust else 1.0, np.where(first, 1.0, weight))
+        out[:, t] = value
+    return out
+
+def _panel_div(a, b) -> np.ndarray:
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.divide(a, b)
+
+class OHLCVCache:
+    """Общий LRU-кэш OHLCV данных, записи истекают при закрытии текущей свечи"""
+
+    def __init__(self, max_entries: int = 256, max_age: Optional[float] = None):
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Tuple) -> Optional[pd.DataFrame]:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now >= entry[0]:
+                # Свеча закрылась — данные устарели
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: Tuple, df: pd.DataFrame, period_seconds: int):
+        now = time.time()
+        # Конец текущей свечи (свечи выровнены по эпохе UTC)
+        expires_at = (now // period_seconds + 1) * period_seconds
+        if self.max_age:
+            expires_at = min(expires_at, now + self.max_age)
+        with self._lock:
+            self._entries[key] = (expires_at, df)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / total, 3) if total else 0.0
+            }
+
+class CrossRateEngine:
+    """Синтетические кросс-курсы через USD: каждая USD-нога загружается один раз
+    за свечу интервала, кроссы получаются векторным делением выровненных ног"""
+
+    PRICE_COLUMNS = ['open', 'high', 'low', 'close']
+
+    def __init__(self, max_entries: int = 256, max_age: Optional[float] = None):
+        # (валюта, интервал) → свечи «USD за единицу валюты»
+        self.legs = OHLCVCache(max_entries, max_age)
+
+    def usd_per_plan(self, code: str, interval: str):
+        """План получения USD/CODE: USDCODE=X, иначе инвертированный CODEUSD=X.
+        Для USD возвращает None (единичная нога)"""
+        if code == 'USD':
+            return None
+        leg = self.legs.get((code, interval))
+        if leg is not None:
+            return leg
+        leg = yield f"USD{code}=X"
+        if leg.empty:
+            leg = _invert_ohlc((yield f"{code}USD=X"))
+        if not leg.empty:
+            self.legs.put((code, interval), leg, _timeframe_seconds(interval))
+        return leg
+
+    def cross_plan(self, base: str, quote: str, interval: str):
+        """План построения BASE/QUOTE из USD-ног (подходит и для инвертированных пар)"""
+        usd_per_base = yield from self.usd_per_plan(base, interval)
+        usd_per_quote = yield from self.usd_per_plan(quote, interval)
+        if quote == 'CNH' and usd_per_quote is not None and usd_per_quote.empty:
+            usd_per_quote = yield from self.usd_per_plan('CNY', interval)
+        return self.derive(usd_per_base, usd_per_quote)
+
+    @classmethod
+    def derive(cls, usd_per_base: Optional[pd.DataFrame], usd_per_quote: Optional[pd.DataFrame]) -> pd.DataFrame:
+        """BASE/QUOTE = (USD/QUOTE) × (BASE/USD) на общих свечах; None — нога USD (= 1).
+        Нога базы инвертируется через _invert_ohlc (high и low меняются местами), поэтому
+        high произведения — произведение high ног, и high ≥ open, close ≥ low сохраняется"""
+        empty = pd.DataFrame(columns=cls.PRICE_COLUMNS + ['volume'])
+        legs = [leg for leg in (usd_per_base, usd_per_quote) if leg is not None]
+        if not legs or any(leg.empty for leg in legs):
+            return empty
+        idx = legs[0].index
+        for leg in legs[1:]:
+            idx = idx.intersection(leg.index)
+        if len(idx) == 0:
+            return empty
+        quote_leg = usd_per_quote.loc[idx, cls.PRICE_COLUMNS].to_numpy() if usd_per_quote is not None else 1.0
+        base_leg = _invert_ohlc(usd_per_base.loc[idx])[cls.PRICE_COLUMNS].to_numpy() if usd_per_base is not None else 1.0
+        # Хотя бы одна из ног — не USD, поэтому результат всегда формы (свечи × 4)
+        syn = pd.DataFrame(quote_leg * base_leg, index=idx, columns=cls.PRICE_COLUMNS)
+        syn['volume'] = 0
+        return syn.dropna()
+
+class MarketDataProvider(ABC):
+    """Источник рыночных данных: все сетевые вызовы TechnicalAnalyzer идут через него.
+    Неполная реализация не создаётся (TypeError при конструировании)"""
+
+    @abstractmethod
+    def load_markets(self, reload: bool = False) -> Dict:
+        ...
+
+    @abstractmethod
+    def fetch_ohlcv(self, symbol: str, timeframe: str, since: Optional[int] = None, limit: Optional[int] = None) -> List:
+        ...
+
+    @abstractmethod
+    async def fetch_ohlcv_async(self, symbol: str, timeframe: str, since: Optional[int] = None, limit: Optional[int] = None) -> List:
+        ...
+
+    @abstractmethod
+    def yf_download(self, tickers, **kwargs) -> pd.DataFrame:
+        ...
+
+    @abstractmethod
+    async def yahoo_chart(self, ticker: str, params: Dict) -> Dict:
+        ...
+
+    async def close(self):
+        pass
+
+class LiveDataProvider(MarketDataProvider):
+    """Живые данные: Binance через ccxt, Yahoo Finance через yfinance и chart API"""
+
     def __init__(self):
         self.exchange = ccxt.binance({
             'apiKey': '',
@@ -67,117 +432,1731 @@ class TechnicalAnalyzer:
             'sandbox': False,
             'enableRateLimit': True
         })
+        # Асинхронный слой данных: создаётся лениво внутри event loop бота
+        self._http_session = None
+        self._async_exchange = None
+
+    def load_markets(self, reload: bool = False) -> Dict:
+        return self.exchange.load_markets(reload=reload)
+
+    def fetch_ohlcv(self, symbol: str, timeframe: str, since: Optional[int] = None, limit: Optional[int] = None) -> List:
+        return self.exchange.fetch_ohlcv(symbol, timeframe, since=since, limit=limit)
+
+    async def fetch_ohlcv_async(self, symbol: str, timeframe: str, since: Optional[int] = None, limit: Optional[int] = None) -> List:
+        exchange = await self._get_async_exchange()
+        return await exchange.fetch_ohlcv(symbol, timeframe, since=since, limit=limit)
+
+    def yf_download(self, tickers, **kwargs) -> pd.DataFrame:
+        return yf.download(tickers, progress=False, auto_adjust=False, **kwargs)
+
+    async def yahoo_chart(self, ticker: str, params: Dict) -> Dict:
+        session = await self._get_http_session()
+        async with session.get(YAHOO_CHART_URL.format(ticker=ticker), params=params) as response:
+            # 404 — тикер неизвестен Yahoo, это такой же «пустой» ответ, как у yf.download
+            if response.status == 404:
+                return {}
+            response.raise_for_status()
+            return await response.json()
+
+    async def _get_http_session(self) -> aiohttp.ClientSession:
+        """Общая keep-alive сессия HTTP (создаётся в работающем event loop)"""
+        if self._http_session is None or self._http_session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=DATA_CONFIG['http_pool_size'], ttl_dns_cache=300, keepalive_timeout=30
+            )
+            self._http_session = aiohttp.ClientSession(
+                connector=connector,
+                headers={'User-Agent': 'Mozilla/5.0'},
+                timeout=aiohttp.ClientTimeout(total=DATA_CONFIG['http_timeout'])
+            )
+        return self._http_session
+
+    async def _get_async_exchange(self):
+        """Асинхронный клиент Binance, работающий через общую HTTP-сессию"""
+        if self._async_exchange is None:
+            session = await self._get_http_session()
+            self._async_exchange = ccxt_async.binance({
+                'apiKey': '',
+                'secret': '',
+                'enableRateLimit': True,
+                'session': session
+            })
+        return self._async_exchange
+
+    async def close(self):
+        """Закрытие асинхронного клиента Binance и HTTP-сессии"""
+        if self._async_exchange is not None:
+            await self._async_exchange.close()
+            self._async_exchange = None
+        if self._http_session is not None and not self._http_session.closed:
+            await self._http_session.close()
+        self._http_session = None
+
+def _ohlcv_kwargs(since: Optional[int], limit: Optional[int]) -> Dict:
+    """Аргументы ключа записи fetch_ohlcv: since только у докачки"""
+    return {'limit': limit} if since is None else {'since': since, 'limit': limit}
+
+class RecordingDataProvider(MarketDataProvider):
+    """Запись ответов другого провайдера в файлы для последующего воспроизведения.
+    Каждый ответ пишется под точным ключом со всеми аргументами; полная загрузка
+    дополнительно пишется под ключом запроса без глубины и момента докачки — к нему
+    воспроизведение обращается, если точной записи докачки нет. Ответ докачки этот
+    ключ не трогает, поэтому никогда не затирает запись полной загрузки"""
+
+    TIME_ARGS = ('since', 'start', 'period1', 'period2')
+    # Аргументы, которыми полная загрузка отличается от докачки того же ряда
+    DEPTH_ARGS = ('period', 'range', 'limit')
+
+    def __init__(self, inner: MarketDataProvider, directory: str):
+        self.inner = inner
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def record_path(directory: str, method: str, *args, **kwargs) -> str:
+        """Имя файла записи по методу и аргументам вызова"""
+        key = json.dumps([method, args, kwargs], sort_keys=True, default=str)
+        return os.path.join(directory, f"{method}-{hashlib.sha1(key.encode()).hexdigest()[:16]}.pkl")
+
+    @classmethod
+    def is_incremental(cls, kwargs: Dict) -> bool:
+        params = kwargs.get('params') if isinstance(kwargs.get('params'), dict) else {}
+        return any(kwargs.get(k) is not None or params.get(k) is not None for k in cls.TIME_ARGS)
+
+    @classmethod
+    def series_kwargs(cls, kwargs: Dict) -> Dict:
+        """Аргументы, общие для полной загрузки и докачки одного ряда свечей"""
+        dropped = cls.TIME_ARGS + cls.DEPTH_ARGS
+        stable = {k: v for k, v in kwargs.items() if k not in dropped}
+        if isinstance(stable.get('params'), dict):
+            stable['params'] = {k: v for k, v in stable['params'].items() if k not in dropped}
+        return stable
+
+    def _save(self, method: str, result, *args, **kwargs):
+        paths = [self.record_path(self.directory, method, *args, **kwargs)]
+        if not self.is_incremental(kwargs):
+            paths.append(self.record_path(self.directory, method, *args, **self.series_kwargs(kwargs)))
+        for path in dict.fromkeys(paths):
+            # Запись во временный файл и атомарная замена, чтобы воспроизведение не увидело обрывок
+            tmp_path = f"{path}.tmp{threading.get_ident()}"
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(result, f)
+            os.replace(tmp_path, path)
+        return result
+
+    def load_markets(self, reload: bool = False) -> Dict:
+        return self._save('load_markets', self.inner.load_markets(reload=reload))
+
+    def fetch_ohlcv(self, symbol, timeframe, since=None, limit=None) -> List:
+        result = self.inner.fetch_ohlcv(symbol, timeframe, since=since, limit=limit)
+        return self._save('fetch_ohlcv', result, symbol, timeframe, **_ohlcv_kwargs(since, limit))
+
+    async def fetch_ohlcv_async(self, symbol, timeframe, since=None, limit=None) -> List:
+        result = await self.inner.fetch_ohlcv_async(symbol, timeframe, since=since, limit=limit)
+        return self._save('fetch_ohlcv', result, symbol, timeframe, **_ohlcv_kwargs(since, limit))
+
+    def yf_download(self, tickers, **kwargs) -> pd.DataFrame:
+        return self._save('yf_download', self.inner.yf_download(tickers, **kwargs), tickers, **kwargs)
+
+    async def yahoo_chart(self, ticker: str, params: Dict) -> Dict:
+        return self._save('yahoo_chart', await self.inner.yahoo_chart(ticker, params), ticker, params=params)
+
+    async def close(self):
+        await self.inner.close()
+
+class ReplayDataProvider(MarketDataProvider):
+    """Воспроизведение записанных ответов без сети, с опциональной задержкой.
+    Докачка без точной записи обслуживается из записи полной загрузки того же запроса
+    (для Binance — свечи начиная с since); отсутствующая запись ведёт себя как сетевая ошибка"""
+
+    def __init__(self, directory: str, latency: float = 0.0):
+        self.directory = directory
+        self.latency = latency
+
+    def _load(self, method: str, *args, **kwargs):
+        path = RecordingDataProvider.record_path(self.directory, method, *args, **kwargs)
+        if not os.path.exists(path) and RecordingDataProvider.is_incremental(kwargs):
+            # Ближайшая запись — последняя полная загрузка того же ряда
+            path = RecordingDataProvider.record_path(
+                self.directory, method, *args, **RecordingDataProvider.series_kwargs(kwargs))
+        if not os.path.exists(path):
+            raise LookupError(f"Нет записи {method} для {args}")
+        with open(path, 'rb') as f:
+            result = pickle.load(f)
+        since = kwargs.get('since')
+        if method == 'fetch_ohlcv' and since is not None:
+            result = [row for row in result if row[0] >= since][:kwargs.get('limit')]
+        return result
+
+    def _replay(self, method: str, *args, **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        return self._load(method, *args, **kwargs)
+
+    async def _replay_async(self, method: str, *args, **kwargs):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self._load(method, *args, **kwargs)
+
+    def load_markets(self, reload: bool = False) -> Dict:
+        return self._replay('load_markets')
+
+    def fetch_ohlcv(self, symbol, timeframe, since=None, limit=None) -> List:
+        return self._replay('fetch_ohlcv', symbol, timeframe, **_ohlcv_kwargs(since, limit))
+
+    async def fetch_ohlcv_async(self, symbol, timeframe, since=None, limit=None) -> List:
+        return await self._replay_async('fetch_ohlcv', symbol, timeframe, **_ohlcv_kwargs(since, limit))
+
+    def yf_download(self, tickers, **kwargs) -> pd.DataFrame:
+        return self._replay('yf_download', tickers, **kwargs)
+
+    async def yahoo_chart(self, ticker: str, params: Dict) -> Dict:
+        return await self._replay_async('yahoo_chart', ticker, params=params)
+
+def create_data_provider(mode: str = 'live', directory: str = 'recordings', latency: float = 0.0) -> MarketDataProvider:
+    """Провайдер данных по режиму: live, record (live с записью) или replay"""
+    mode = (mode or 'live').lower()
+    if mode == 'live':
+        return LiveDataProvider()
+    if mode == 'record':
+        return RecordingDataProvider(LiveDataProvider(), directory)
+    if mode == 'replay':
+        return ReplayDataProvider(directory, latency)
+    raise ValueError(f"Неизвестный режим провайдера данных: {mode}")
+
+class CandleStore:
+    """Постоянное хранилище закрытых свечей для тёплого рестарта.
+    На каждый ключ (источник, тикер, таймфрейм) — каталог с колонками в виде сырых
+    массивов фиксированной ширины (timestamp.i8 в нс UTC, остальные .f8), только дозапись"""
+
+    COLUMNS = ('timestamp', 'open', 'high', 'low', 'close', 'volume')
+    DTYPES = {'timestamp': np.dtype('<i8'), 'open': np.dtype('<f8'), 'high': np.dtype('<f8'),
+              'low': np.dtype('<f8'), 'close': np.dtype('<f8'), 'volume': np.dtype('<f8')}
+
+    def __init__(self, root: str):
+        self.root = root
+        self._lock = threading.Lock()
+        self._last = {}
+
+    def _dir(self, key: Tuple) -> str:
+        source, ticker, timeframe = key
+        return os.path.join(self.root, source, re.sub(r'[^A-Za-z0-9=._-]', '_', ticker), timeframe)
+
+    def _file(self, key: Tuple, column: str) -> str:
+        return os.path.join(self._dir(key), f"{column}.{'i8' if column == 'timestamp' else 'f8'}")
+
+    def _rows(self, key: Tuple) -> int:
+        """Число целых строк: после обрыва записи колонки могут иметь разную длину"""
+        sizes = []
+        for column in self.COLUMNS:
+            path = self._file(key, column)
+            sizes.append(os.path.getsize(path) // self.DTYPES[column].itemsize if os.path.exists(path) else 0)
+        return min(sizes)
+
+    def _tz(self, key: Tuple) -> Optional[str]:
+        path = os.path.join(self._dir(key), 'meta.json')
+        if not os.path.exists(path):
+            return None
+        with open(path, encoding='utf-8') as f:
+            return json.load(f).get('tz')
+
+    def read(self, key: Tuple, tail: Optional[int] = None) -> Optional[pd.DataFrame]:
+        """Последние tail свечей ключа (все, если tail не задан) или None, если их нет"""
+        with self._lock:
+            rows = self._rows(key)
+            if rows == 0:
+                return None
+            start = max(rows - tail, 0) if tail else 0
+            arrays = {
+                column: np.fromfile(self._file(key, column), dtype=self.DTYPES[column], count=rows - start,
+                                    offset=start * self.DTYPES[column].itemsize)
+                for column in self.COLUMNS
+            }
+            tz = self._tz(key)
+        index = pd.DatetimeIndex(arrays.pop('timestamp').view('datetime64[ns]'), name='timestamp')
+        if tz:
+            index = index.tz_localize('UTC').tz_convert(tz)
+        return pd.DataFrame(arrays, index=index)
+
+    def arrays(self, key: Tuple) -> Optional[Dict[str, np.memmap]]:
+        """Колонки ключа как read-only np.memmap (только целые строки) или None.
+        Страницы файлов общие в page cache для всех процессов, читающих хранилище"""
+        with self._lock:
+            rows = self._rows(key)
+            if rows == 0:
+                return None
+            return {column: np.memmap(self._file(key, column), dtype=self.DTYPES[column], mode='r', shape=(rows,))
+                    for column in self.COLUMNS}
+
+    def view(self, key: Tuple, start=None, end=None) -> Optional['CandleView']:
+        """Окно [start, end] истории ключа без копирования; границы — метки времени"""
+        arrays = self.arrays(key)
+        if arrays is None:
+            return None
+        stamps = arrays['timestamp']
+        to_ns = lambda ts: pd.Timestamp(ts).tz_convert('UTC').tz_localize(None).value if pd.Timestamp(ts).tz else pd.Timestamp(ts).value
+        lo = int(np.searchsorted(stamps, to_ns(start), side='left')) if start is not None else 0
+        hi = int(np.searchsorted(stamps, to_ns(end), side='right')) if end is not None else len(stamps)
+        return CandleView({column: values[lo:hi] for column, values in arrays.items()}, self._tz(key))
+
+    def append(self, key: Tuple, df: pd.DataFrame, period_seconds: int) -> int:
+        """Дозапись закрытых свечей новее уже сохранённых; возвращает число записанных строк.
+        Если кадр начинается позже конца хранилища (разрыв после полной перезагрузки),
+        ключ перезаписывается, чтобы история оставалась непрерывной, — но только кадром
+        не короче сохранённой истории: короткий ответ не должен затирать глубокую историю"""
+        if df is None or df.empty:
+            return 0
+        index = df.index if df.index.tz is None else df.index.tz_convert('UTC').tz_localize(None)
+        stamps = index.asi8
+        closed = stamps + period_seconds * 1_000_000_000 <= time.time_ns()
+        with self._lock:
+            last = self._last.get(key)
+            if last is None:
+                rows = self._rows(key)
+                last = int(np.fromfile(self._file(key, 'timestamp'), dtype='<i8', count=1,
+                                       offset=(rows - 1) * 8)[0]) if rows else None
+            reset = last is not None and stamps[0] > last + period_seconds * 1_000_000_000
+            if reset and closed.sum() < self._rows(key):
+                logger.info(f"Хранилище свечей {key}: кадр с разрывом короче истории, запись пропущена")
+                self._last[key] = last
+                return 0
+            fresh = closed if last is None or reset else closed & (stamps > last)
+            if not fresh.any():
+                self._last[key] = last
+                return 0
+            os.makedirs(self._dir(key), exist_ok=True)
+            rows = 0 if reset else self._rows(key)
+            with open(os.path.join(self._dir(key), 'meta.json'), 'w', encoding='utf-8') as f:
+                json.dump({'tz': str(df.index.tz) if df.index.tz is not None else None}, f)
+            for column in self.COLUMNS:
+                values = stamps[fresh] if column == 'timestamp' else df[column].to_numpy(dtype=float)[fresh]
+                data = np.ascontiguousarray(values, dtype=self.DTYPES[column]).tobytes()
+                path = self._file(key, column)
+                if reset or not os.path.exists(path):
+                    # Новый файл через замену: открытые memmap-окна продолжают видеть старый
+                    with open(f"{path}.tmp", 'wb') as f:
+                        f.write(data)
+                    os.replace(f"{path}.tmp", path)
+                    continue
+                with open(path, 'r+b') as f:
+                    # Обрезаем недописанный хвост за последней целой строкой и дописываем
+                    f.truncate(rows * self.DTYPES[column].itemsize)
+                    f.seek(0, os.SEEK_END)
+                    f.write(data)
+            self._last[key] = int(stamps[fresh][-1])
+        return int(fresh.sum())
+
+class CandleView:
+    """Окно истории из хранилища без копирования: колонки — pd.Series поверх np.memmap.
+    Поддерживает то, что читают индикаторы, скоринг и бэктест: df[col], index, len, iloc[срез]"""
+
+    def __init__(self, arrays: Dict[str, np.ndarray], tz: Optional[str] = None):
+        self._arrays = arrays
+        index = pd.DatetimeIndex(arrays['timestamp'].view('datetime64[ns]'), name='timestamp')
+        self.index = index.tz_localize('UTC').tz_convert(tz) if tz else index
+        self.columns = pd.Index(CandleStore.COLUMNS[1:])
+        self._series = {}
+
+    def __getitem__(self, column: str) -> pd.Series:
+        if column not in self._series:
+            self._series[column] = pd.Series(self._arrays[column], index=self.index, name=column, copy=False)
+        return self._series[column]
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    @property
+    def empty(self) -> bool:
+        return len(self) == 0
+
+    @property
+    def iloc(self):
+        view = self
+
+        class _Positional:
+            def __getitem__(self, item: slice) -> 'CandleView':
+                if not isinstance(item, slice):
+                    raise TypeError("CandleView.iloc поддерживает только срезы")
+                return CandleView({k: v[item] for k, v in view._arrays.items()}, view._tz)
+        return _Positional()
+
+    @property
+    def _tz(self) -> Optional[str]:
+        return str(self.index.tz) if self.index.tz is not None else None
+
+    def to_frame(self) -> pd.DataFrame:
+        """Обычный DataFrame (с копированием) для кода, которому нужен полный API pandas"""
+        return pd.DataFrame({column: np.array(self[column]) for column in self.columns}, index=self.index)
+
+class SymbolAvailability:
+    """Реестр доступности пар: положительный ответ живёт ttl секунд, отрицательный —
+    с экспоненциальным backoff (retry, 2·retry, ... до max_backoff)"""
+
+    def __init__(self, ttl: float = 1800, retry: float = 60, max_backoff: float = 3600):
+        self.ttl = ttl
+        self.retry = retry
+        self.max_backoff = max_backoff
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def record(self, symbol: str, available: bool, reason: Optional[str] = None):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(symbol)
+            failures = 0 if available else (entry['failures'] + 1 if entry else 1)
+            delay = self.ttl if available else min(self.retry * 2 ** (failures - 1), self.max_backoff)
+            self._entries[symbol] = {'available': available, 'failures': failures, 'reason': reason,
+                                     'checked_at': now, 'expires': now + delay}
+
+    def status(self, symbol: str) -> Optional[bool]:
+        """Последний известный статус (даже просроченный) или None, если пару не проверяли"""
+        with self._lock:
+            entry = self._entries.get(symbol)
+        return None if entry is None else entry['available']
+
+    def stale(self, symbols: List[str]) -> List[str]:
+        """Пары, которые пора проверить: не проверялись, истёк TTL или прошёл backoff"""
+        now = time.time()
+        with self._lock:
+            return [s for s in symbols if s not in self._entries or self._entries[s]['expires'] <= now]
+
+    def reason(self, symbol: str) -> Optional[str]:
+        """Причина последней неудачной проверки"""
+        with self._lock:
+            entry = self._entries.get(symbol)
+        return None if entry is None else entry['reason']
+
+    def retry_in(self, symbol: str) -> Optional[float]:
+        """Через сколько секунд пара будет проверена снова (для недоступных)"""
+        with self._lock:
+            entry = self._entries.get(symbol)
+        return None if entry is None else max(entry['expires'] - time.time(), 0)
+
+class ForecastScheduler:
+    """Единый планировщик проверки прогнозов: min-heap (время истечения, id) и один цикл,
+    который просыпается к ближайшему сроку и отдаёт обработчику все истёкшие id пачкой.
+    Отмена ленивая: id убирается из словаря сроков, запись в куче пропускается при извлечении"""
+
+    def __init__(self, handler: Callable[[List[str]], Awaitable[None]]):
+        self.handler = handler
+        self._heap = []
+        self._due = {}
+        self._wakeup = None
+        self._task = None
+        self._handlers = set()
+        self.fired = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+
+    @property
+    def depth(self) -> int:
+        """Число ожидающих прогнозов"""
+        return len(self._due)
+
+    def stats(self) -> Dict:
+        return {'depth': self.depth, 'heap': len(self._heap), 'fired': self.fired,
+                'last_lag': round(self.last_lag, 3), 'max_lag': round(self.max_lag, 3)}
+
+    def schedule(self, forecast_id: str, due: float):
+        """Поставить проверку прогноза на момент due (unix-время); повтор переносит срок"""
+        self._due[forecast_id] = due
+        heapq.heappush(self._heap, (due, forecast_id))
+        # Будим цикл, только если новый срок раньше текущего ближайшего
+        if self._wakeup is not None and self._heap[0][1] == forecast_id:
+            self._wakeup.set()
+
+    def cancel(self, forecast_id: str) -> bool:
+        """Отмена проверки; True, если прогноз ещё ожидал"""
+        cancelled = self._due.pop(forecast_id, None) is not None
+        # Куча без живых записей сжимается, чтобы память не росла от отмен
+        if cancelled and len(self._heap) > 2 * len(self._due) + 1024:
+            self._heap = [(due, fid) for due, fid in self._heap if self._due.get(fid) == due]
+            heapq.heapify(self._heap)
+        return cancelled
+
+    def start(self):
+        """Запуск цикла в текущем event loop (повторный вызов ничего не делает)"""
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        for task in [self._task, *self._handlers]:
+            if task is not None and not task.done():
+                task.cancel()
+        await asyncio.gather(*[t for t in [self._task, *self._handlers] if t is not None], return_exceptions=True)
+        self._task = None
+
+    def _pop_due(self, now: float) -> List[str]:
+        batch = []
+        while self._heap and self._heap[0][0] <= now:
+            due, forecast_id = heapq.heappop(self._heap)
+            # Пропускаем отменённые и перенесённые записи
+            if self._due.get(forecast_id) != due:
+                continue
+            del self._due[forecast_id]
+            batch.append(forecast_id)
+            self.last_lag = now - due
+            self.max_lag = max(self.max_lag, self.last_lag)
+        return batch
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            now = time.time()
+            batch = self._pop_due(now)
+            if batch:
+                self.fired += len(batch)
+                # Обработчик работает отдельно, чтобы отправка сообщений не задерживала следующие сроки
+                task = asyncio.create_task(self._dispatch(batch))
+                self._handlers.add(task)
+                task.add_done_callback(self._handlers.discard)
+                continue
+            timeout = self._heap[0][0] - now if self._heap else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _dispatch(self, batch: List[str]):
+        try:
+            await self.handler(batch)
+        except Exception as e:
+            logger.error(f"Ошибка обработки {len(batch)} истёкших прогнозов: {e}")
+
+class ForecastLedger:
+    """Постоянный журнал прогнозов в SQLite (WAL) с пакетной записью.
+    Операции копятся в буфере и сбрасываются одной транзакцией; ожидающие прогнозы
+    перечитываются при старте, тексты сводки и подробностей читаются с диска по запросу.
+    Рядом ведётся агрегированная точность по (пара, таймфрейм, тип, корзина силы) —
+    каждая проверка обновляет одну строку за O(1), без пересчёта истории"""
+
+    FIELDS = ('id', 'symbol', 'timeframe', 'trade_type', 'prediction', 'score', 'current_price',
+              'user_id', 'chat_id', 'message_id', 'created_at', 'expires_at', 'details', 'summary')
+    # Поля рабочего набора в памяти: всё, что нужно для проверки и отправки результата
+    COMPACT_FIELDS = ('symbol', 'timeframe', 'trade_type', 'prediction', 'score', 'current_price',
+                      'user_id', 'chat_id', 'message_id', 'expires_at')
+
+    def __init__(self, path: str, flush_batch: int = 200):
+        self.path = path or ':memory:'
+        self.flush_batch = flush_batch
+        self._lock = threading.Lock()
+        self._ops = []
+        # Записи, ещё не сброшенные на диск, чтобы чтение видело их сразу
+        self._unflushed = {}
+        if self.path != ':memory:' and os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS forecasts (
+                id TEXT PRIMARY KEY,
+                symbol TEXT NOT NULL,
+                timeframe TEXT NOT NULL,
+                trade_type TEXT,
+                prediction TEXT,
+                score REAL,
+                current_price REAL,
+                user_id INTEGER,
+                chat_id INTEGER,
+                message_id INTEGER,
+                created_at REAL NOT NULL,
+                expires_at REAL NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                result TEXT,
+                close_price REAL,
+                points REAL,
+                resolved_at REAL,
+                details TEXT,
+                summary TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_forecasts_status_expiry ON forecasts (status, expires_at);
+            CREATE INDEX IF NOT EXISTS idx_forecasts_chat ON forecasts (chat_id, created_at);
+            CREATE TABLE IF NOT EXISTS forecast_stats (
+                symbol TEXT NOT NULL,
+                timeframe TEXT NOT NULL,
+                trade_type TEXT NOT NULL,
+                bucket INTEGER NOT NULL,
+                wins INTEGER NOT NULL,
+                losses INTEGER NOT NULL,
+                win_points REAL NOT NULL,
+                loss_points REAL NOT NULL,
+                recent_win_rate REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (symbol, timeframe, trade_type, bucket)
+            );
+        """)
+        self._conn.commit()
+
+    @staticmethod
+    def compact(record: Dict) -> Dict:
+        """Компактная запись рабочего набора без текстов сводки и подробностей"""
+        forecast = {field: record.get(field) for field in ForecastLedger.COMPACT_FIELDS}
+        forecast['timestamp'] = datetime.fromtimestamp(record['created_at'])
+        forecast['id'] = record.get('id')
+        return forecast
+
+    def _queue(self, sql: str, params: Tuple, row: Optional[Dict] = None):
+        with self._lock:
+            self._ops.append((sql, params))
+            if row is not None:
+                self._unflushed[row['id']] = row
+            overflow = len(self._ops) >= self.flush_batch
+        if overflow:
+            self.flush()
+
+    def add(self, forecast_id: str, record: Dict) -> Dict:
+        """Записать новый ожидающий прогноз (record содержит поля FIELDS, кроме id);
+        возвращает компактную запись для рабочего набора"""
+        row = dict(record, id=forecast_id)
+        self._queue(
+            f"INSERT OR REPLACE INTO forecasts ({', '.join(self.FIELDS)}) VALUES ({', '.join('?' * len(self.FIELDS))})",
+            tuple(row.get(field) for field in self.FIELDS), row
+        )
+        return self.compact(row)
+
+    def resolve(self, forecast_id: str, result: Dict):
+        """Отметить прогноз проверенным и сохранить итог"""
+        self._queue(
+            "UPDATE forecasts SET status = 'resolved', result = ?, close_price = ?, points = ?, resolved_at = ? WHERE id = ?",
+            (result.get('result'), result.get('close_price'), result.get('points'), time.time(), forecast_id)
+        )
+
+    @staticmethod
+    def strength_bucket(score: Optional[float]) -> int:
+        """Корзина силы сигнала: целая часть |score| с общим верхним пределом.
+        Корзины не зависят от SIGNAL_THRESHOLDS и остаются сравнимыми при их настройке"""
+        return min(int(abs(score or 0.0)), FORECAST_CONFIG['stats_max_bucket'])
+
+    def record_outcome(self, forecast: Dict, result: Dict) -> bool:
+        """Учесть итог проверки в статистике; прогнозы без данных не учитываются"""
+        if result.get('close_price') is None:
+            return False
+        win = bool(result.get('prediction_correct'))
+        points = float(result.get('points') or 0.0)
+        alpha = 2.0 / (FORECAST_CONFIG['stats_window'] + 1)
+        self._queue(
+            "INSERT INTO forecast_stats (symbol, timeframe, trade_type, bucket, wins, losses, win_points, "
+            "loss_points, recent_win_rate, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (symbol, timeframe, trade_type, bucket) DO UPDATE SET "
+            "wins = wins + excluded.wins, losses = losses + excluded.losses, "
+            "win_points = win_points + excluded.win_points, loss_points = loss_points + excluded.loss_points, "
+            "recent_win_rate = recent_win_rate + ? * (excluded.recent_win_rate - recent_win_rate), "
+            "updated_at = excluded.updated_at",
+            (forecast['symbol'], forecast['timeframe'], forecast.get('trade_type') or '',
+             self.strength_bucket(forecast.get('score')), int(win), int(not win),
+             points if win else 0.0, 0.0 if win else points, float(win), time.time(), alpha)
+        )
+        return True
+
+    def stats(self, symbol: Optional[str] = None, timeframe: Optional[str] = None) -> List[Dict]:
+        """Агрегированная точность с фильтрами по паре и таймфрейму, самые частые группы первыми"""
+        self.flush()
+        where, params = [], []
+        if symbol:
+            where.append("symbol = ?")
+            params.append(symbol)
+        if timeframe:
+            where.append("timeframe = ?")
+            params.append(timeframe)
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM forecast_stats" + (f" WHERE {' AND '.join(where)}" if where else "") +
+                " ORDER BY wins + losses DESC, symbol, timeframe, trade_type, bucket", params
+            ).fetchall()
+        stats = []
+        for row in rows:
+            row = dict(row)
+            total = row['wins'] + row['losses']
+            row['total'] = total
+            row['win_rate'] = row['wins'] / total if total else 0.0
+            row['avg_win_points'] = row['win_points'] / row['wins'] if row['wins'] else 0.0
+            row['avg_loss_points'] = row['loss_points'] / row['losses'] if row['losses'] else 0.0
+            row['avg_points'] = (row['win_points'] - row['loss_points']) / total if total else 0.0
+            stats.append(row)
+        return stats
+
+    def cancel(self, forecast_id: str):
+        self._queue("UPDATE forecasts SET status = 'cancelled', resolved_at = ? WHERE id = ? AND status = 'pending'",
+                    (time.time(), forecast_id))
+
+    def flush(self) -> int:
+        """Сброс накопленных операций одной транзакцией; возвращает их число"""
+        with self._lock:
+            ops, self._ops = self._ops, []
+            if not ops:
+                return 0
+            try:
+                with self._conn:
+                    for sql, params in ops:
+                        self._conn.execute(sql, params)
+            except sqlite3.Error:
+                # Операции возвращаются в начало буфера и попадут в следующий сброс
+                self._ops = ops + self._ops
+                raise
+            self._unflushed.clear()
+        return len(ops)
+
+    def get(self, forecast_id: str) -> Optional[Dict]:
+        """Полная запись прогноза, включая сводку и подробности"""
+        with self._lock:
+            row = self._unflushed.get(forecast_id)
+            if row is not None:
+                return dict(row)
+            row = self._conn.execute("SELECT * FROM forecasts WHERE id = ?", (forecast_id,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def pending(self) -> List[Dict]:
+        """Ожидающие проверки прогнозы в порядке истечения"""
+        self.flush()
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT id, created_at, {', '.join(self.COMPACT_FIELDS)} FROM forecasts "
+                "WHERE status = 'pending' ORDER BY expires_at"
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def purge(self, older_than: float) -> int:
+        """Удаление закрытых прогнозов, завершённых раньше older_than (unix-время)"""
+        self.flush()
+        with self._lock, self._conn:
+            cursor = self._conn.execute("DELETE FROM forecasts WHERE status != 'pending' AND resolved_at < ?",
+                                        (older_than,))
+        return cursor.rowcount
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            self._conn.close()
+
+class MarketIndex:
+    """Индекс рынков Binance: загружается один раз и обновляется в фоновом потоке"""
+
+    def __init__(self, provider: MarketDataProvider, refresh_interval: float = 3600, retry_interval: float = 60):
+        self.provider = provider
+        self.refresh_interval = refresh_interval
+        self.retry_interval = retry_interval
+        self.loaded_at = None
+        self._symbols = None
+        self._thread = None
+        self._stop_event = threading.Event()
+        self._start_lock = threading.Lock()
+
+    def refresh(self) -> bool:
+        """Перезагрузка списка рынков; при ошибке сохраняется предыдущий индекс"""
+        try:
+            markets = self.provider.load_markets(reload=True)
+            self._symbols = frozenset(markets)
+            self.loaded_at = datetime.now()
+            logger.info(f"Загружено {len(self._symbols)} рынков Binance")
+            return True
+        except Exception as e:
+            logger.warning(f"Не удалось загрузить рынки Binance: {e}")
+            return False
+
+    def start(self):
+        """Запуск фонового обновления (повторный вызов ничего не делает)"""
+        with self._start_lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._refresh_loop, name='market-index', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def _refresh_loop(self):
+        while not self._stop_event.is_set():
+            ok = self.refresh()
+            self._stop_event.wait(self.refresh_interval if ok else self.retry_interval)
+
+    @property
+    def loaded(self) -> bool:
+        return self._symbols is not None
+
+    def lookup(self, symbol: str) -> Optional[bool]:
+        """True/False — есть ли рынок на Binance; None — индекс ещё не загружен"""
+        symbols = self._symbols
+        if symbols is None:
+            self.start()
+            return None
+        return symbol in symbols
+
+def _safe_div(a: float, b: float) -> float:
+    """Деление с семантикой pandas/numpy: x/0 → ±inf, 0/0 → NaN"""
+    if b == 0 or b != b or a != a:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return float(np.float64(a) / np.float64(b))
+    return a / b
+
+class _RollingWindow:
+    """Скользящее окно с суммой и дисперсией за O(1) в семантике pandas rolling:
+    результат NaN, пока в окне меньше min_periods валидных значений"""
+
+    def __init__(self, size: int, min_periods: Optional[int] = None):
+        self.size = size
+        self.min_periods = size if min_periods is None else min_periods
+        self.values = deque()
+        self.nan_count = 0
+        # Суммы ведутся относительно сдвига, чтобы не терять точность на дисперсии
+        self.shift = 0.0
+        self.sum = 0.0
+        self.sumsq = 0.0
+        self.pushes = 0
+        # Длина серии одинаковых значений в конце окна (как в pandas: точный ноль и т.п.)
+        self.run = 0
+
+    def push(self, x: float):
+        if len(self.values) == self.size:
+            old = self.values.popleft()
+            if old != old:
+                self.nan_count -= 1
+            else:
+                d = old - self.shift
+                self.sum -= d
+                self.sumsq -= d * d
+        if x != x:
+            self.nan_count += 1
+            self.run = 0
+        else:
+            d = x - self.shift
+            self.sum += d
+            self.sumsq += d * d
+            self.run = self.run + 1 if self.values and self.values[-1] == x else 1
+        self.values.append(x)
+        self.pushes += 1
+        # Периодический пересчёт убирает накопленную ошибку (амортизированно O(1))
+        if self.pushes % self.size == 0:
+            self._resync()
+
+    def _resync(self):
+        finite = [v for v in self.values if v == v]
+        self.shift = finite[-1] if finite else 0.0
+        self.sum = sum(v - self.shift for v in finite)
+        self.sumsq = sum((v - self.shift) ** 2 for v in finite)
+
+    @property
+    def count(self) -> int:
+        return len(self.values) - self.nan_count
+
+    def mean(self) -> float:
+        n = self.count
+        if n < self.min_periods or n == 0:
+            return np.nan
+        if self.run >= len(self.values):
+            return self.values[-1]
+        return self.shift + self.sum / n
+
+    def std(self) -> float:
+        n = self.count
+        if n < self.min_periods or n < 2:
+            return np.nan
+        if self.run >= len(self.values):
+            return 0.0
+        var = (self.sumsq - self.sum * self.sum / n) / (n - 1)
+        return var ** 0.5 if var > 0 else 0.0
+
+class _RollingExtremum:
+    """Скользящий максимум/минимум на монотонной очереди, O(1) амортизированно"""
+
+    def __init__(self, size: int, is_max: bool):
+        self.size = size
+        self.is_max = is_max
+        self.index = 0
+        self.queue = deque()
+        self.nan_flags = deque()
+        self.nan_count = 0
+
+    def push(self, x: float):
+        is_nan = x != x
+        if len(self.nan_flags) == self.size and self.nan_flags.popleft():
+            self.nan_count -= 1
+        self.nan_flags.append(is_nan)
+        self.nan_count += is_nan
+        while self.queue and self.queue[0][0] <= self.index - self.size:
+            self.queue.popleft()
+        if not is_nan:
+            while self.queue and (self.queue[-1][1] <= x if self.is_max else self.queue[-1][1] >= x):
+                self.queue.pop()
+            self.queue.append((self.index, x))
+        self.index += 1
+
+    def value(self) -> float:
+        if len(self.nan_flags) < self.size or self.nan_count or not self.queue:
+            return np.nan
+        return self.queue[0][1]
+
+class _Ema:
+    """EMA в семантике pandas ewm(span).mean() для adjust=True и adjust=False"""
+
+    def __init__(self, span: int, adjust: bool = True):
+        alpha = 2.0 / (span + 1)
+        self.decay = 1.0 - alpha
+        self.new_weight = 1.0 if adjust else alpha
+        self.adjust = adjust
+        self.weight = 0.0
+        self.value = np.nan
+
+    def push(self, x: float) -> float:
+        if self.value != self.value:
+            self.value = x
+            self.weight = 1.0
+            return self.value
+        self.weight *= self.decay
+        if self.value != x:
+            self.value = (self.weight * self.value + self.new_weight * x) / (self.weight + self.new_weight)
+        self.weight = self.weight + self.new_weight if self.adjust else 1.0
+        return self.value
+
+class StreamingIndicators:
+    """Потоковый расчёт индикаторов одной пары/таймфрейма: каждая свеча обновляет
+    скользящие суммы, EMA и монотонные очереди за O(1) и даёт те же значения
+    последней свечи, что calculate_indicators + _latest_indicator_values"""
+
+    KEY_FIELDS = ['price', 'sma', 'rsi', 'macd_histogram', 'bb_upper', 'bb_lower']
+
+    def __init__(self):
+        cfg = INDICATOR_CONFIG
+        self.count = 0
+        self.last_timestamp = None
+        self.prev = None
+        self.sma = _RollingWindow(cfg['sma_period'])
+        self.sma200 = _RollingWindow(200, min_periods=50)
+        self.ema50 = _Ema(50, adjust=False)
+        self.gain = _RollingWindow(cfg['rsi_period'])
+        self.loss = _RollingWindow(cfg['rsi_period'])
+        self.bb = _RollingWindow(cfg['bb_period'])
+        self.ema_fast = _Ema(cfg['macd_fast'])
+        self.ema_slow = _Ema(cfg['macd_slow'])
+        self.macd_signal = _Ema(cfg['macd_signal'])
+        self.rsi_min = _RollingExtremum(cfg['stoch_period'], is_max=False)
+        self.rsi_max = _RollingExtremum(cfg['stoch_period'], is_max=True)
+        self.high_max = _RollingExtremum(cfg['williams_r_period'], is_max=True)
+        self.low_min = _RollingExtremum(cfg['williams_r_period'], is_max=False)
+        self.typical_price = _RollingWindow(cfg['cci_period'])
+        self.plus_dm = _RollingWindow(cfg['adx_period'])
+        self.minus_dm = _RollingWindow(cfg['adx_period'])
+        self.tr_adx = _RollingWindow(cfg['adx_period'])
+        self.dx = _RollingWindow(cfg['adx_period'])
+        self.tr_atr = _RollingWindow(cfg['atr_period'])
+        self.atr_history = _RollingWindow(20)
+        self.obv_total = 0.0
+        self.obv = _RollingWindow(cfg['obv_period'])
+        self.obv_recent = deque(maxlen=5)
+        self.values = {}
+
+    def update(self, timestamp, open_: float, high: float, low: float, close: float, volume: float):
+        """Добавление одной свечи"""
+        prev = self.prev
+        prev_open, prev_high, prev_low, prev_close = prev if prev else (np.nan,) * 4
+        delta = close - prev_close
+        self.count += 1
+        self.last_timestamp = timestamp
+
+        self.sma.push(close)
+        sma = self.sma.mean()
+        self.sma200.push(close)
+        ema50 = self.ema50.push(close)
+
+        # RSI (простое среднее приростов/потерь, как в calculate_indicators)
+        self.gain.push(delta if delta > 0 else 0.0)
+        self.loss.push(-delta if delta < 0 else 0.0)
+        rsi = 100 - _safe_div(100, 1 + _safe_div(self.gain.mean(), self.loss.mean()))
+
+        # Полосы Боллинджера
+        self.bb.push(close)
+        bb_mid = self.bb.mean()
+        bb_std = self.bb.std()
+
+        # MACD
+        macd = self.ema_fast.push(close) - self.ema_slow.push(close)
+        macd_signal = self.macd_signal.push(macd)
+
+        # Stochastic RSI
+        self.rsi_min.push(rsi)
+        self.rsi_max.push(rsi)
+        rsi_low = self.rsi_min.value()
+        stoch_rsi = _safe_div(rsi - rsi_low, self.rsi_max.value() - rsi_low) * 100
+
+        # Williams %R
+        self.high_max.push(high)
+        self.low_min.push(low)
+        high_max = self.high_max.value()
+        williams_r = -100 * _safe_div(high_max - close, high_max - self.low_min.value())
+
+        # CCI: MAD требует прохода по окну, но окно фиксированной длины cci_period
+        typical_price = (high + low + close) / 3
+        self.typical_price.push(typical_price)
+        window = self.typical_price.values
+        if self.typical_price.count == self.typical_price.size:
+            window_mean = sum(window) / len(window)
+            mad = sum(abs(v - window_mean) for v in window) / len(window)
+            cci = _safe_div(typical_price - self.typical_price.mean(), 0.015 * mad)
+        else:
+            cci = np.nan
+
+        # ADX и ATR
+        high_diff = high - prev_high
+        low_diff = low - prev_low
+        self.plus_dm.push(high_diff if (high_diff > low_diff and high_diff > 0) else 0.0)
+        self.minus_dm.push(-low_diff if (low_diff > high_diff and low_diff > 0) else 0.0)
+        tr = max(high - low, abs(high - prev_close), abs(low - prev_close)) if prev else np.nan
+        self.tr_adx.push(tr)
+        tr_mean = self.tr_adx.mean()
+        plus_di = _safe_div(100 * self.plus_dm.mean(), tr_mean)
+        minus_di = _safe_div(100 * self.minus_dm.mean(), tr_mean)
+        self.dx.push(_safe_div(100 * abs(plus_di - minus_di), plus_di + minus_di))
+        self.tr_atr.push(tr)
+        atr = self.tr_atr.mean()
+        self.atr_history.push(atr)
+
+        # OBV
+        direction = np.sign(delta) if delta == delta else 0.0
+        self.obv_total += direction * volume
+        self.obv.push(self.obv_total)
+        obv = self.obv.mean()
+        self.obv_recent.append(obv)
+
+        # Свечные паттерны последней свечи
+        body = abs(close - open_)
+        range_ = high - low
+        upper_wick = abs(max(open_, close) - high)
+        lower_wick = abs(low - min(open_, close))
+
+        self.values = {
+            'price': close,
+            'sma': sma,
+            'sma200': self.sma200.mean(),
+            'ema50': ema50,
+            'rsi': rsi,
+            'macd_histogram': macd - macd_signal,
+            'bb_upper': bb_mid + bb_std * INDICATOR_CONFIG['bb_std'],
+            'bb_lower': bb_mid - bb_std * INDICATOR_CONFIG['bb_std'],
+            'stoch_rsi': stoch_rsi,
+            'williams_r': williams_r,
+            'cci': cci,
+            'adx': self.dx.mean(),
+            'plus_di': plus_di,
+            'minus_di': minus_di,
+            'atr': atr,
+            'atr_pct': (atr / close) * 100,
+            'obv': obv,
+            'atr_avg': self.atr_history.mean(),
+            'obv_slope': self.obv_recent[-1] - self.obv_recent[0] if self.count > 5 else 0,
+            'bull_engulf': (close > open_) and (prev_close < prev_open) and (close >= prev_open) and (open_ <= prev_close),
+            'bear_engulf': (close < open_) and (prev_close > prev_open) and (close <= prev_open) and (open_ >= prev_close),
+            'is_bull_pin': (lower_wick > body * 2) and (close > open_),
+            'is_bear_pin': (upper_wick > body * 2) and (close < open_),
+            'is_doji': range_ != 0 and (body / range_) < 0.1
+        }
+        self.prev = (open_, high, low, close)
+
+    def ingest(self, df: pd.DataFrame):
+        """Добавление всех свечей кадра по порядку"""
+        columns = [df[c].to_numpy(dtype=float) for c in ['open', 'high', 'low', 'close', 'volume']]
+        for row in zip(df.index, *columns):
+            self.update(*row)
+
+    def snapshot(self) -> 'StreamingIndicators':
+        """Независимая копия состояния (для расчёта по незакрытой свече)"""
+        return copy.deepcopy(self)
+
+    def is_valid(self) -> bool:
+        """Все ключевые значения последней свечи рассчитаны"""
+        return bool(self.values) and not any(pd.isna(self.values[k]) for k in self.KEY_FIELDS)
+
+    def latest(self) -> Dict:
+        return dict(self.values)
+
+# Реестр индикаторов: каждый узел объявляет входы, собственную глубину истории и параметры.
+# Строковые параметры берутся из INDICATOR_CONFIG в момент расчёта
+INDICATOR_REGISTRY: Dict[str, 'IndicatorSpec'] = {}
+OHLCV_COLUMNS = ('open', 'high', 'low', 'close', 'volume')
+# Глубина разогрева EMA в периодах span: вклад отброшенной истории ~exp(-20)
+EWM_WARMUP_SPANS = 10
+
+class IndicatorSpec:
+    """Описание узла графа индикаторов"""
+    
+    def __init__(self, name: str, func, inputs: Tuple[str, ...], lookback, params: Dict):
+        self.name = name
+        self.func = func
+        self.inputs = inputs
+        self.lookback = lookback
+        self.params = params
+    
+    def resolve_params(self) -> Dict:
+        return {key: INDICATOR_CONFIG[value] if isinstance(value, str) else value
+                for key, value in self.params.items()}
+    
+    def own_lookback(self) -> int:
+        """Сколько свечей истории нужно узлу сверх истории его входов"""
+        if callable(self.lookback):
+            return self.lookback(self.resolve_params())
+        return self.lookback
+
+def register_indicator(name: str, inputs: Tuple[str, ...] = (), lookback=0, params: Optional[Dict] = None):
+    """Декоратор регистрации индикатора. Имена с '_' — промежуточные узлы, наружу не отдаются"""
+    def wrap(func):
+        INDICATOR_REGISTRY[name] = IndicatorSpec(name, func, tuple(inputs), lookback, params or {})
+        return func
+    return wrap
+
+def plan_indicators(names) -> List[str]:
+    """Топологический порядок узлов, нужных для расчёта names (каждый узел один раз)"""
+    order = []
+    seen = set()
+    
+    def visit(name: str):
+        if name in seen or name in OHLCV_COLUMNS:
+            return
+        seen.add(name)
+        for dependency in INDICATOR_REGISTRY[name].inputs:
+            visit(dependency)
+        order.append(name)
+    
+    for name in names:
+        visit(name)
+    return order
+
+def indicator_lookback(name: str) -> int:
+    """Полная глубина истории узла с учётом всей цепочки входов"""
+    if name in OHLCV_COLUMNS:
+        return 0
+    spec = INDICATOR_REGISTRY[name]
+    return spec.own_lookback() + max((indicator_lookback(dep) for dep in spec.inputs), default=0)
+
+def _ewm_lookback(span_key: str):
+    return lambda p: EWM_WARMUP_SPANS * p[span_key]
+
+# SMA и EMA
+@register_indicator('sma', inputs=('close',), lookback=lambda p: p['window'], params={'window': 'sma_period'})
+def _ind_sma(ctx, window):
+    return ctx.rolling('close', 'mean', window)
+
+@register_indicator('ema', inputs=('close',), lookback=_ewm_lookback('span'), params={'span': 'ema_period'})
+def _ind_ema(ctx, span):
+    return ctx.ewm('close', span)
+
+# Дополнительные долгосрочные средние как прокси старшего ТФ
+@register_indicator('sma200', inputs=('close',), lookback=lambda p: p['window'], params={'window': 200, 'min_periods': 50})
+def _ind_sma200(ctx, window, min_periods):
+    return ctx.rolling('close', 'mean', window, min_periods)
+
+@register_indicator('ema50', inputs=('close',), lookback=_ewm_lookback('span'), params={'span': 50})
+def _ind_ema50(ctx, span):
+    return ctx.ewm('close', span, adjust=False)
+
+# Общие промежуточные ряды
+@register_indicator('_prev_close', inputs=('close',), lookback=1)
+def _ind_prev_close(ctx):
+    return ctx['close'].shift(1)
+
+@register_indicator('_delta', inputs=('close',), lookback=1)
+def _ind_delta(ctx):
+    return ctx['close'].diff()
+
+@register_indicator('_high_diff', inputs=('high',), lookback=1)
+def _ind_high_diff(ctx):
+    return ctx['high'].diff()
+
+@register_indicator('_low_diff', inputs=('low',), lookback=1)
+def _ind_low_diff(ctx):
+    return ctx['low'].diff()
+
+# True Range — общий для ADX и ATR
+@register_indicator('_tr', inputs=('high', 'low', '_prev_close'))
+def _ind_tr(ctx):
+    high, low, prev_close = ctx['high'], ctx['low'], ctx['_prev_close']
+    return np.maximum(high - low, np.maximum(np.abs(high - prev_close), np.abs(low - prev_close)))
+
+# RSI
+@register_indicator('_gain', inputs=('_delta',))
+def _ind_gain(ctx):
+    delta = ctx['_delta']
+    return delta.where(delta > 0, 0)
+
+@register_indicator('_loss', inputs=('_delta',))
+def _ind_loss(ctx):
+    delta = ctx['_delta']
+    return -delta.where(delta < 0, 0)
+
+@register_indicator('rsi', inputs=('_gain', '_loss'), lookback=lambda p: p['window'], params={'window': 'rsi_period'})
+def _ind_rsi(ctx, window):
+    rs = ctx.rolling('_gain', 'mean', window) / ctx.rolling('_loss', 'mean', window)
+    return 100 - (100 / (1 + rs))
+
+# Bollinger Bands
+@register_indicator('bb_middle', inputs=('close',), lookback=lambda p: p['window'], params={'window': 'bb_period'})
+def _ind_bb_middle(ctx, window):
+    return ctx.rolling('close', 'mean', window)
+
+@register_indicator('_bb_std', inputs=('close',), lookback=lambda p: p['window'], params={'window': 'bb_period'})
+def _ind_bb_std(ctx, window):
+    return ctx.rolling('close', 'std', window)
+
+@register_indicator('bb_upper', inputs=('bb_middle', '_bb_std'), params={'width': 'bb_std'})
+def _ind_bb_upper(ctx, width):
+    return ctx['bb_middle'] + (ctx['_bb_std'] * width)
+
+@register_indicator('bb_lower', inputs=('bb_middle', '_bb_std'), params={'width': 'bb_std'})
+def _ind_bb_lower(ctx, width):
+    return ctx['bb_middle'] - (ctx['_bb_std'] * width)
+
+# MACD
+@register_indicator('macd', inputs=('close',), lookback=_ewm_lookback('slow'), params={'fast': 'macd_fast', 'slow': 'macd_slow'})
+def _ind_macd(ctx, fast, slow):
+    return ctx.ewm('close', fast) - ctx.ewm('close', slow)
+
+@register_indicator('macd_signal', inputs=('macd',), lookback=_ewm_lookback('span'), params={'span': 'macd_signal'})
+def _ind_macd_signal(ctx, span):
+    return ctx.ewm('macd', span)
+
+@register_indicator('macd_histogram', inputs=('macd', 'macd_signal'))
+def _ind_macd_histogram(ctx):
+    return ctx['macd'] - ctx['macd_signal']
+
+# Stochastic RSI
+@register_indicator('stoch_rsi', inputs=('rsi',), lookback=lambda p: p['window'], params={'window': 'stoch_period'})
+def _ind_stoch_rsi(ctx, window):
+    rsi_min = ctx.rolling('rsi', 'min', window)
+    return (ctx['rsi'] - rsi_min) / (ctx.rolling('rsi', 'max', window) - rsi_min) * 100
+
+# Williams %R
+@register_indicator('williams_r', inputs=('high', 'low', 'close'), lookback=lambda p: p['window'], params={'window': 'williams_r_period'})
+def _ind_williams_r(ctx, window):
+    high_max = ctx.rolling('high', 'max', window)
+    low_min = ctx.rolling('low', 'min', window)
+    return -100 * (high_max - ctx['close']) / (high_max - low_min)
+
+# CCI (Commodity Channel Index)
+@register_indicator('_typical_price', inputs=('high', 'low', 'close'))
+def _ind_typical_price(ctx):
+    return (ctx['high'] + ctx['low'] + ctx['close']) / 3
+
+@register_indicator('cci', inputs=('_typical_price',), lookback=lambda p: p['window'], params={'window': 'cci_period'})
+def _ind_cci(ctx, window):
+    typical_price = ctx['_typical_price']
+    mad = pd.Series(_rolling_mean_abs_dev(typical_price.to_numpy(dtype=float), window), index=typical_price.index)
+    return (typical_price - ctx.rolling('_typical_price', 'mean', window)) / (0.015 * mad)
+
+# ADX (Average Directional Index)
+@register_indicator('_plus_dm', inputs=('_high_diff', '_low_diff'))
+def _ind_plus_dm(ctx):
+    high_diff, low_diff = ctx['_high_diff'], ctx['_low_diff']
+    return pd.Series(np.where((high_diff > low_diff) & (high_diff > 0), high_diff, 0), index=high_diff.index)
+
+@register_indicator('_minus_dm', inputs=('_high_diff', '_low_diff'))
+def _ind_minus_dm(ctx):
+    high_diff, low_diff = ctx['_high_diff'], ctx['_low_diff']
+    return pd.Series(np.where((low_diff > high_diff) & (low_diff > 0), -low_diff, 0), index=high_diff.index)
+
+@register_indicator('plus_di', inputs=('_plus_dm', '_tr'), lookback=lambda p: p['window'], params={'window': 'adx_period'})
+def _ind_plus_di(ctx, window):
+    return 100 * ctx.rolling('_plus_dm', 'mean', window) / ctx.rolling('_tr', 'mean', window)
+
+@register_indicator('minus_di', inputs=('_minus_dm', '_tr'), lookback=lambda p: p['window'], params={'window': 'adx_period'})
+def _ind_minus_di(ctx, window):
+    return 100 * ctx.rolling('_minus_dm', 'mean', window) / ctx.rolling('_tr', 'mean', window)
+
+@register_indicator('_dx', inputs=('plus_di', 'minus_di'))
+def _ind_dx(ctx):
+    plus_di, minus_di = ctx['plus_di'], ctx['minus_di']
+    return 100 * np.abs(plus_di - minus_di) / (plus_di + minus_di)
+
+@register_indicator('adx', inputs=('_dx',), lookback=lambda p: p['window'], params={'window': 'adx_period'})
+def _ind_adx(ctx, window):
+    return ctx.rolling('_dx', 'mean', window)
+
+# ATR (Average True Range) и волатильность в % от цены
+@register_indicator('atr', inputs=('_tr',), lookback=lambda p: p['window'], params={'window': 'atr_period'})
+def _ind_atr(ctx, window):
+    return ctx.rolling('_tr', 'mean', window)
+
+@register_indicator('atr_pct', inputs=('atr', 'close'))
+def _ind_atr_pct(ctx):
+    return (ctx['atr'] / ctx['close']) * 100
+
+# OBV (On Balance Volume): уровень зависит от начала истории, наклон — нет
+@register_indicator('_obv_raw', inputs=('_delta', 'volume'))
+def _ind_obv_raw(ctx):
+    return (np.sign(ctx['_delta']) * ctx['volume']).fillna(0).cumsum()
+
+@register_indicator('obv', inputs=('_obv_raw',), lookback=lambda p: p['window'], params={'window': 'obv_period'})
+def _ind_obv(ctx, window):
+    return ctx.rolling('_obv_raw', 'mean', window)
+
+# Свечные паттерны (простые) считаются одной группой
+CANDLE_PATTERNS = ('is_doji', 'is_bull_pin', 'is_bear_pin', 'bull_engulf', 'bear_engulf')
+
+@register_indicator('_patterns', inputs=OHLCV_COLUMNS[:4], lookback=1)
+def _ind_patterns(ctx):
+    open_, high, low, close = ctx['open'], ctx['high'], ctx['low'], ctx['close']
+    try:
+        body = (close - open_).abs()
+        range_ = (high - low).replace(0, np.nan)
+        upper_wick = (np.maximum(open_, close) - high).abs()
+        lower_wick = (low - np.minimum(open_, close)).abs()
+        prev_open = open_.shift(1)
+        prev_close = close.shift(1)
+        return {
+            'is_doji': (body / range_) < 0.1,
+            # Пин-бар: длинный хвост снизу или сверху
+            'is_bull_pin': (lower_wick > body * 2) & (close > open_),
+            'is_bear_pin': (upper_wick > body * 2) & (close < open_),
+            # Поглощение
+            'bull_engulf': (close > open_) & (prev_close < prev_open) & (close >= prev_open) & (open_ <= prev_close),
+            'bear_engulf': (close < open_) & (prev_close > prev_open) & (close <= prev_open) & (open_ >= prev_close)
+        }
+    except Exception:
+        return {name: pd.Series(False, index=close.index) for name in CANDLE_PATTERNS}
+
+def _register_pattern(name: str):
+    register_indicator(name, inputs=('_patterns',))(lambda ctx: ctx['_patterns'][name])
+
+for _pattern in CANDLE_PATTERNS:
+    _register_pattern(_pattern)
+
+class LazyIndicators(Mapping):
+    """Индикаторы пары, вычисляемые по первому обращению и запоминаемые.
+    Граф зависимостей берётся из INDICATOR_REGISTRY, промежуточные ряды
+    (diff, TR, скользящие статистики, EMA) считаются один раз на набор"""
+    
+    NAMES = ()
+    
+    def __init__(self, df: pd.DataFrame):
+        self.df = df
+        self._values = {}
+        self._shared = {}
+    
+    def __getitem__(self, name: str) -> pd.Series:
+        if name in OHLCV_COLUMNS:
+            return self.df[name]
+        if name not in self._values:
+            if name not in INDICATOR_REGISTRY:
+                raise KeyError(name)
+            # Входы считаются в порядке плана, поэтому рекурсия не глубже одного уровня
+            for node in plan_indicators([name]):
+                if node not in self._values:
+                    spec = INDICATOR_REGISTRY[node]
+                    self._values[node] = spec.func(self, **spec.resolve_params())
+        return self._values[name]
+    
+    def __contains__(self, name) -> bool:
+        return name in self.NAMES
     
-    def get_ohlcv_data(self, symbol: str, timeframe: str, limit: int = 200) -> pd.DataFrame:
-        """Получение OHLCV данных с поддержкой Binance и Yahoo Finance"""
+    def __iter__(self):
+        return iter(self.NAMES)
+    
+    def __len__(self) -> int:
+        return len(self.NAMES)
+    
+    def evaluate(self, names=None) -> 'LazyIndicators':
+        """Явный расчёт набора индикаторов (по умолчанию всех) одним проходом по плану"""
+        for name in plan_indicators(self.NAMES if names is None else names):
+            self[name]
+        return self
+    
+    def rolling(self, source: str, stat: str, window: int, min_periods: Optional[int] = None) -> pd.Series:
+        """Скользящая статистика, общая для всех индикаторов набора"""
+        key = ('rolling', source, stat, window, min_periods)
+        if key not in self._shared:
+            self._shared[key] = getattr(self[source].rolling(window=window, min_periods=min_periods), stat)()
+        return self._shared[key]
+    
+    def ewm(self, source: str, span: int, adjust: bool = True) -> pd.Series:
+        """EMA, общая для всех индикаторов набора"""
+        key = ('ewm', source, span, adjust)
+        if key not in self._shared:
+            self._shared[key] = self[source].ewm(span=span, adjust=adjust).mean()
+        return self._shared[key]
+
+LazyIndicators.NAMES = tuple(name for name in INDICATOR_REGISTRY if not name.startswith('_'))
+
+# Индикаторы, значения которых на последней свече нужны скорингу
+SCORING_INDICATORS = (
+    'sma', 'sma200', 'ema50', 'rsi', 'macd_histogram', 'bb_upper', 'bb_lower', 'stoch_rsi',
+    'williams_r', 'cci', 'adx', 'plus_di', 'minus_di', 'atr', 'atr_pct', 'obv'
+)
+
+def scoring_tail_window() -> int:
+    """Минимальный хвост истории, на котором значения скоринга совпадают с полным расчётом:
+    глубина самого длинного индикатора плюс окна среднего ATR (20) и наклона OBV (5)"""
+    deepest = max(indicator_lookback(name) for name in SCORING_INDICATORS + CANDLE_PATTERNS)
+    return max(deepest, indicator_lookback('atr') + 20, indicator_lookback('obv') + 5) + 1
+
+class TechnicalAnalyzer:
+    """Класс для технического анализа"""
+    
+    def __init__(self, provider: Optional[MarketDataProvider] = None, candle_store: Optional[CandleStore] = None):
+        # Все сетевые запросы идут через провайдер (живой, с записью или воспроизведение)
+        self.provider = provider if provider is not None else LiveDataProvider()
+        # Закрытые свечи на диске: после рестарта буферы поднимаются из хранилища и только догружаются
+        if candle_store is None and DATA_CONFIG['candle_store_dir']:
+            candle_store = CandleStore(DATA_CONFIG['candle_store_dir'])
+        self.candle_store = candle_store
+        # Индекс рынков Binance для маршрутизации запросов без сетевых вызовов
+        self.market_index = MarketIndex(
+            self.provider, DATA_CONFIG['markets_refresh_interval'], DATA_CONFIG['markets_retry_interval']
+        )
+        # Кэш OHLCV, общий для всех пользователей бота
+        self.ohlcv_cache = OHLCVCache(DATA_CONFIG['cache_max_entries'], DATA_CONFIG['cache_max_age'])
+        # Кольцевые буферы последних загруженных свечей для инкрементальной докачки
+        self._candle_buffers = {}
+        self._buffers_lock = threading.Lock()
+        # Синтетические кросс-курсы: общий кэш USD-ног и память о парах без прямой котировки
+        self.cross_rates = CrossRateEngine(DATA_CONFIG['cache_max_entries'], DATA_CONFIG['cache_max_age'])
+        self._yahoo_routes = {}
+        # Пары, уже отмеченные в логе как временно идущие через Yahoo до загрузки индекса Binance
+        self._provisional_logged = set()
+        # Потоковые индикаторы по (пара, таймфрейм)
+        self._streams = OrderedDict()
+        self._streams_lock = threading.Lock()
+        # Доступность пар, общая для прогрева, /upd, /search и проверки списка пар
+        self.availability = SymbolAvailability(
+            DATA_CONFIG['availability_ttl'], DATA_CONFIG['availability_retry'], DATA_CONFIG['availability_max_backoff']
+        )
+    
+    def get_ohlcv_data(self, symbol: str, timeframe: str, limit: int = 200, fresh: bool = False) -> pd.DataFrame:
+        """Получение OHLCV данных с поддержкой Binance и Yahoo Finance;
+        fresh=True загружает данные мимо кэша и обновляет его"""
         try:
-            # Преобразуем символ для совместимости с Binance
-            formatted_symbol = self._format_symbol(symbol)
-            logger.info(f"Запрос данных для {formatted_symbol} на {timeframe}")
-            # Проверяем, поддерживается ли пара на Binance
-            if self._is_binance_symbol(formatted_symbol):
-                ohlcv = self.exchange.fetch_ohlcv(formatted_symbol, timeframe, limit=limit)
-                if not ohlcv or len(ohlcv) == 0:
-                    raise Exception(f"Нет данных для {formatted_symbol} на {timeframe}")
-                df = pd.DataFrame(ohlcv, columns=['timestamp', 'open', 'high', 'low', 'close', 'volume'])
-                df['timestamp'] = pd.to_datetime(df['timestamp'], unit='ms')
-                df.set_index('timestamp', inplace=True)
-                logger.info(f"Получено {len(df)} свечей для {formatted_symbol} (Binance)")
-                return df
-            # Если не Binance — пробуем через Yahoo Finance
-            yf_symbol = self._format_yahoo_symbol(symbol)
-            interval = self._yahoo_timeframe_to_interval(timeframe)
-            period = self._yahoo_period_for_interval(interval)
-            data = yf.download(yf_symbol, period=period, interval=interval, progress=False, auto_adjust=False)
-            # Если пусто — пробуем реверсную пару (например, USDUAH вместо UAHUSD)
-            if data.empty:
-                # Пытаемся поменять местами базу и котировку
-                normalized = symbol.upper().replace('/', '').replace(' ', '')
-                if len(normalized) >= 6:
-                    base = normalized[:3]
-                    quote = normalized[3:6]
-                    reversed_symbol = f"{quote}{base}=X"
-                    rev_data = yf.download(reversed_symbol, period=period, interval=interval, progress=False, auto_adjust=False)
-                    if not rev_data.empty:
-                        # Переименуем и инвертируем OHLC
-                        rev = rev_data.rename(columns={'Open':'open','High':'high','Low':'low','Close':'close','Volume':'volume'})
-                        # Привести к float
-                        for c in ['open','high','low','close']:
-                            rev[c] = pd.to_numeric(rev[c], errors='coerce')
-                        inv = pd.DataFrame(index=rev.index)
-                        inv['open'] = 1.0 / rev['open']
-                        inv['high'] = 1.0 / rev['low']
-                        inv['low'] = 1.0 / rev['high']
-                        inv['close'] = 1.0 / rev['close']
-                        inv['volume'] = rev.get('volume', 0)
-                        data = inv
-            # Синтетический кросс через USD, если прямой и обратный отсутствуют
-            if data.empty:
-                normalized = symbol.upper().replace('/', '').replace(' ', '')
-                if len(normalized) >= 6:
-                    base = normalized[:3]
-                    quote = normalized[3:6]
-                    def _yf_load_pair(ticker: str) -> pd.DataFrame:
-                        dfp = yf.download(ticker, period=period, interval=interval, progress=False, auto_adjust=False)
-                        if dfp.empty:
-                            return dfp
-                        if isinstance(dfp.columns, pd.MultiIndex):
-                            dfp.columns = [col[0] for col in dfp.columns]
-                        dfp = dfp.rename(columns={'Open':'open','High':'high','Low':'low','Close':'close','Volume':'volume'})
-                        for c in ['open','high','low','close']:
-                            if c in dfp:
-                                dfp[c] = pd.to_numeric(dfp[c], errors='coerce')
-                        return dfp[['open','high','low','close','volume']].dropna()
-                    def _usd_per(code: str) -> pd.DataFrame:
-                        # Пытаемся получить USD/CODE, иначе CODE/USD и инвертируем
-                        direct = _yf_load_pair(f"USD{code}=X")
-                        if not direct.empty:
-                            return direct
-                        inverse = _yf_load_pair(f"{code}USD=X")
-                        if not inverse.empty:
-                            inv = pd.DataFrame(index=inverse.index)
-                            inv['open'] = 1.0 / inverse['open']
-                            inv['high'] = 1.0 / inverse['low']
-                            inv['low'] = 1.0 / inverse['high']
-                            inv['close'] = 1.0 / inverse['close']
-                            inv['volume'] = inverse.get('volume', 0)
-                            return inv
-                        return pd.DataFrame()
-                    usd_per_base = _usd_per(base)
-                    usd_per_quote = _usd_per(quote) if quote != 'CNH' else (_usd_per('CNY') if _usd_per('CNH').empty else _usd_per('CNH'))
-                    if not usd_per_base.empty and not usd_per_quote.empty:
-                        idx = usd_per_base.index.intersection(usd_per_quote.index)
-                        if len(idx) > 0:
-                            ub = usd_per_base.loc[idx]
-                            uq = usd_per_quote.loc[idx]
-                            syn = pd.DataFrame(index=idx)
-                            # BASE/QUOTE = (USD/QUOTE) / (USD/BASE)
-                            syn['open'] = uq['open'] / ub['open']
-                            syn['high'] = uq['high'] / ub['high']
-                            syn['low'] = uq['low'] / ub['low']
-                            syn['close'] = uq['close'] / ub['close']
-                            syn['volume'] = 0
-                            data = syn.dropna()
+            source, ticker, period_seconds = self._resolve_source(symbol, timeframe)
+            cache_key = (source, ticker, timeframe, limit)
+            cached = None if fresh else self.ohlcv_cache.get(cache_key)
+            if cached is not None:
+                logger.debug(f"Данные {ticker} на {timeframe} взяты из кэша")
+                return cached.copy()
+            logger.info(f"Запрос данных для {ticker} на {timeframe}")
+            if source == 'binance':
+                df = self._fetch_binance_ohlcv(ticker, timeframe, limit)
+            else:
+                df = self._fetch_yahoo_ohlcv(symbol, timeframe, limit)
+            self.ohlcv_cache.put(cache_key, df, period_seconds)
+            return df.copy()
+        except Exception as e:
+            logger.error(f"Ошибка при получении данных для {symbol}: {e}")
+            raise Exception(f"Не удалось получить данные для {symbol}: {str(e)}")
+
+    async def get_ohlcv_data_async(self, symbol: str, timeframe: str, limit: int = 200, fresh: bool = False) -> pd.DataFrame:
+        """Асинхронное получение OHLCV данных: без потоков, через общий пул соединений;
+        fresh=True загружает данные мимо кэша и обновляет его"""
+        try:
+            source, ticker, period_seconds = self._resolve_source(symbol, timeframe)
+            cache_key = (source, ticker, timeframe, limit)
+            cached = None if fresh else self.ohlcv_cache.get(cache_key)
+            if cached is not None:
+                logger.debug(f"Данные {ticker} на {timeframe} взяты из кэша")
+                return cached.copy()
+            logger.info(f"Запрос данных для {ticker} на {timeframe}")
+            if source == 'binance':
+                df = await self._fetch_binance_ohlcv_async(ticker, timeframe, limit)
+            else:
+                df = await self._fetch_yahoo_ohlcv_async(symbol, timeframe, limit)
+            self.ohlcv_cache.put(cache_key, df, period_seconds)
+            return df.copy()
+        except Exception as e:
+            logger.error(f"Ошибка при получении данных для {symbol}: {e}")
+            raise Exception(f"Не удалось получить данные для {symbol}: {str(e)}")
+
+    def _resolve_source(self, symbol: str, timeframe: str) -> Tuple[str, str, int]:
+        """Источник данных, тикер источника и длительность его свечи в секундах"""
+        # Преобразуем символ для совместимости с Binance
+        formatted_symbol = self._format_symbol(symbol)
+        # Проверяем, поддерживается ли пара на Binance
+        if self._is_binance_symbol(formatted_symbol):
+            return 'binance', formatted_symbol, _timeframe_seconds(timeframe)
+        interval = self._yahoo_timeframe_to_interval(timeframe)
+        return 'yahoo', self._format_yahoo_symbol(symbol), _timeframe_seconds(interval)
+
+    def _get_buffer(self, key: Tuple) -> Optional[pd.DataFrame]:
+        with self._buffers_lock:
+            buffered = self._candle_buffers.get(key)
+        if buffered is not None or self.candle_store is None:
+            return buffered
+        # Холодный буфер — поднимаем последние свечи из хранилища
+        try:
+            stored = self.candle_store.read(key, tail=DATA_CONFIG['ring_buffer_size'])
+        except Exception as e:
+            logger.warning(f"Не удалось прочитать хранилище свечей {key}: {e}")
+            return None
+        if stored is None:
+            return None
+        with self._buffers_lock:
+            return self._candle_buffers.setdefault(key, stored)
+
+    def _store_buffer(self, key: Tuple, df: pd.DataFrame, capacity: int):
+        with self._buffers_lock:
+            self._candle_buffers[key] = df.tail(max(capacity, DATA_CONFIG['ring_buffer_size']))
+        if self.candle_store is not None:
+            try:
+                self.candle_store.append(key, df, _timeframe_seconds(key[2]))
+            except Exception as e:
+                logger.warning(f"Не удалось записать свечи {key} в хранилище: {e}")
+
+    def _binance_since(self, formatted_symbol: str, timeframe: str, limit: int) -> Optional[int]:
+        """Метка (мс), с которой нужна докачка Binance, или None для полной загрузки"""
+        if not DATA_CONFIG['incremental']:
+            return None
+        buffered = self._get_buffer(('binance', formatted_symbol, timeframe))
+        if buffered is None or len(buffered) < limit:
+            return None
+        # Последняя сохранённая свеча могла быть незакрытой — запрашиваем её повторно
+        return int(buffered.index[-1].timestamp() * 1000)
+
+    def _binance_absorb(self, formatted_symbol: str, timeframe: str, ohlcv: List, limit: int, incremental: bool,
+                        store: bool = True) -> pd.DataFrame:
+        """Сохранение ответа Binance в буфер (если store); возвращает последние limit свечей"""
+        buffer_key = ('binance', formatted_symbol, timeframe)
+        df = _ohlcv_to_frame(ohlcv)
+        if incremental:
+            df = _merge_candles(self._get_buffer(buffer_key), df)
+            logger.info(f"Догружено {len(ohlcv)} свечей для {formatted_symbol} (Binance)")
+        else:
+            logger.info(f"Получено {len(df)} свечей для {formatted_symbol} (Binance)")
+        if store:
+            self._store_buffer(buffer_key, df, limit)
+        return df.tail(limit)
+
+    def _fetch_binance_ohlcv(self, formatted_symbol: str, timeframe: str, limit: int, store: bool = True) -> pd.DataFrame:
+        """Загрузка свечей с Binance через ccxt (инкрементально, если есть буфер).
+        store=False — только чтение: буфер и хранилище не меняются (проверки доступности)"""
+        since = self._binance_since(formatted_symbol, timeframe, limit)
+        if since is not None:
+            ohlcv = self.provider.fetch_ohlcv(formatted_symbol, timeframe, since=since, limit=limit)
+            page = limit
+            # Полная пачка означает разрыв больше limit свечей (например, после простоя) —
+            # докачиваем его одной большой страницей, чтобы не терять историю буфера и хранилища
+            if ohlcv and len(ohlcv) >= limit and limit < DATA_CONFIG['gap_fill_limit']:
+                page = DATA_CONFIG['gap_fill_limit']
+                ohlcv = self.provider.fetch_ohlcv(formatted_symbol, timeframe, since=since, limit=page)
+            if ohlcv and len(ohlcv) < page:
+                return self._binance_absorb(formatted_symbol, timeframe, ohlcv, limit, incremental=True, store=store)
+        ohlcv = self.provider.fetch_ohlcv(formatted_symbol, timeframe, limit=limit)
+        if not ohlcv or len(ohlcv) == 0:
+            raise Exception(f"Нет данных для {formatted_symbol} на {timeframe}")
+        return self._binance_absorb(formatted_symbol, timeframe, ohlcv, limit, incremental=False, store=store)
+
+    async def _store_io(self, func: Callable, *args, **kwargs):
+        """Вызов из асинхронного пути, который может читать или писать хранилище свечей:
+        при включённом хранилище он идёт в потоке, чтобы диск не блокировал цикл событий"""
+        if self.candle_store is None:
+            return func(*args, **kwargs)
+        return await asyncio.to_thread(func, *args, **kwargs)
+
+    async def _fetch_binance_ohlcv_async(self, formatted_symbol: str, timeframe: str, limit: int) -> pd.DataFrame:
+        """Асинхронная загрузка свечей с Binance через ccxt.async_support"""
+        since = await self._store_io(self._binance_since, formatted_symbol, timeframe, limit)
+        if since is not None:
+            ohlcv = await self.provider.fetch_ohlcv_async(formatted_symbol, timeframe, since=since, limit=limit)
+            page = limit
+            # Полная пачка означает разрыв больше limit свечей (например, после простоя) —
+            # докачиваем его одной большой страницей, чтобы не терять историю буфера и хранилища
+            if ohlcv and len(ohlcv) >= limit and limit < DATA_CONFIG['gap_fill_limit']:
+                page = DATA_CONFIG['gap_fill_limit']
+                ohlcv = await self.provider.fetch_ohlcv_async(formatted_symbol, timeframe, since=since, limit=page)
+            if ohlcv and len(ohlcv) < page:
+                return await self._store_io(self._binance_absorb, formatted_symbol, timeframe, ohlcv, limit,
+                                            incremental=True)
+        ohlcv = await self.provider.fetch_ohlcv_async(formatted_symbol, timeframe, limit=limit)
+        if not ohlcv or len(ohlcv) == 0:
+            raise Exception(f"Нет данных для {formatted_symbol} на {timeframe}")
+        return await self._store_io(self._binance_absorb, formatted_symbol, timeframe, ohlcv, limit, incremental=False)
+
+    def _yahoo_start(self, ticker: str, interval: str, period: str) -> Optional[pd.Timestamp]:
+        """Момент, с которого нужна докачка тикера Yahoo, или None для полной загрузки"""
+        if not DATA_CONFIG['incremental']:
+            return None
+        buffered = self._get_buffer(('yahoo', ticker, interval))
+        if buffered is None or buffered.empty:
+            return None
+        last_ts = buffered.index[-1]
+        # Если буфер старше доступной глубины истории — качаем период целиком
+        max_age = pd.Timedelta(days=365) if period == '1y' else pd.Timedelta(period)
+        if pd.Timestamp.now(tz=last_ts.tz) - last_ts >= max_age:
+            return None
+        return last_ts
+
+    def _yahoo_absorb(self, ticker: str, interval: str, fresh: pd.DataFrame, start: Optional[pd.Timestamp],
+                      store: bool = True) -> pd.DataFrame:
+        """Сохранение ответа Yahoo в буфер (если store); возвращает все известные свечи тикера"""
+        buffer_key = ('yahoo', ticker, interval)
+        if start is None:
+            if store and not fresh.empty:
+                self._store_buffer(buffer_key, fresh, 0)
+            return fresh
+        df = _merge_candles(self._get_buffer(buffer_key), fresh)
+        if store:
+            self._store_buffer(buffer_key, df, 0)
+        logger.info(f"Догружено {len(fresh)} свечей для {ticker} (Yahoo Finance)")
+        return df
+
+    def _yf_download(self, ticker: str, interval: str, period: str) -> pd.DataFrame:
+        """Загрузка одного тикера Yahoo Finance; при наличии буфера — только новые свечи"""
+        start = self._yahoo_start(ticker, interval, period)
+        if start is not None:
+            raw = self.provider.yf_download(ticker, start=start, interval=interval)
+        else:
+            raw = self.provider.yf_download(ticker, period=period, interval=interval)
+        return self._yahoo_absorb(ticker, interval, _normalize_yahoo_frame(raw), start)
+
+    async def _yf_download_async(self, ticker: str, interval: str, period: str) -> pd.DataFrame:
+        """Асинхронная загрузка тикера через chart API Yahoo Finance"""
+        start = await self._store_io(self._yahoo_start, ticker, interval, period)
+        params = {'interval': interval, 'includePrePost': 'false'}
+        if start is not None:
+            params['period1'] = int(start.timestamp())
+            params['period2'] = int(time.time())
+        else:
+            params['range'] = period
+        payload = await self.provider.yahoo_chart(ticker, params)
+        return await self._store_io(self._yahoo_absorb, ticker, interval, _chart_to_frame(payload), start)
+
+    def get_ohlcv_batch(self, symbols: List[str], timeframe: str, limit: int = 200, store: bool = True,
+                        errors: Optional[Dict[str, str]] = None) -> Dict[str, pd.DataFrame]:
+        """Пакетное получение OHLCV для списка пар: все тикеры Yahoo загружаются
+        общими multi-ticker запросами, пары Binance — параллельно.
+        Возвращает кадры только для пар, по которым удалось получить данные; причины
+        неудач пишутся в errors, если он передан. store=False не трогает буферы и хранилище"""
+        frames = {}
+        binance_jobs = {}
+        yahoo_plans = {}
+        interval = self._yahoo_timeframe_to_interval(timeframe)
+        period = self._yahoo_period_for_interval(interval)
+        for symbol in dict.fromkeys(symbols):
+            source, ticker, period_seconds = self._resolve_source(symbol, timeframe)
+            cached = self.ohlcv_cache.get((source, ticker, timeframe, limit))
+            if cached is not None:
+                frames[symbol] = cached.copy()
+            elif source == 'binance':
+                binance_jobs[symbol] = ticker
+            else:
+                yahoo_plans[symbol] = (ticker, self._yahoo_plan(symbol, ticker, interval))
+        logger.info(f"Пакетный запрос {timeframe}: {len(frames)} из кэша, "
+                    f"{len(binance_jobs)} Binance, {len(yahoo_plans)} Yahoo Finance")
+
+        # Binance: ccxt не отдаёт свечи нескольких пар одним запросом — запускаем параллельно
+        if binance_jobs:
+            with ThreadPoolExecutor(max_workers=min(8, len(binance_jobs))) as pool:
+                futures = {
+                    symbol: pool.submit(self._fetch_binance_ohlcv, ticker, timeframe, limit, store)
+                    for symbol, ticker in binance_jobs.items()
+                }
+            for symbol, future in futures.items():
+                try:
+                    df = future.result()
+                    self.ohlcv_cache.put(('binance', binance_jobs[symbol], timeframe, limit), df, _timeframe_seconds(timeframe))
+                    frames[symbol] = df.copy()
+                except Exception as e:
+                    logger.warning(f"Пакетная загрузка {symbol} (Binance) не удалась: {e}")
+                    if errors is not None:
+                        errors[symbol] = f"Binance: {e}"
+
+        # Yahoo: планы всех пар выполняются синхронно по раундам, каждый раунд — один запрос
+        def _finish(symbol: str, yf_symbol: str, data: pd.DataFrame):
             if data.empty:
-                raise Exception(f"Yahoo Finance не вернул данные для {yf_symbol}")
-            # Исправление для MultiIndex (yfinance для форекс)
-            if isinstance(data.columns, pd.MultiIndex):
-                # Берём только значения для тикера (обычно первый уровень)
-                data.columns = [col[0].lower() for col in data.columns]
-            # Исправление: если столбцы имеют shape (N, 1), преобразуем их в Series
-            for col in ['open', 'high', 'low', 'close', 'volume']:
-                if col in data.columns and hasattr(data[col], 'values') and len(data[col].values.shape) > 1:
-                    data[col] = data[col].values.reshape(-1)
-            data = data.rename(columns={
-                'Open': 'open', 'High': 'high', 'Low': 'low', 'Close': 'close', 'Volume': 'volume'
-            })
-            # Очистка NaN и проверка достаточности данных
-            data = data[['open','high','low','close','volume']].dropna()
-            logger.info(f"Получено {len(data)} свечей для {yf_symbol} (Yahoo Finance)")
-            return data.tail(limit)
-        except Exception as e:
-            logger.error(f"Ошибка при получении данных для {symbol}: {e}")
-            raise Exception(f"Не удалось получить данные для {symbol}: {str(e)}")
+                logger.warning(f"Yahoo Finance не вернул данные для {yf_symbol}")
+                if errors is not None:
+                    errors[symbol] = f"Yahoo Finance: нет данных для {yf_symbol}"
+                return
+            df = data.tail(limit)
+            self.ohlcv_cache.put(('yahoo', yf_symbol, timeframe, limit), df, _timeframe_seconds(interval))
+            frames[symbol] = df.copy()
+
+        pending = {}
+        for symbol, (yf_symbol, plan) in yahoo_plans.items():
+            try:
+                pending[symbol] = (yf_symbol, plan, next(plan))
+            except StopIteration as stop:
+                # Всё нужное уже есть в кэше USD-ног
+                _finish(symbol, yf_symbol, stop.value)
+        while pending:
+            tickers = sorted({ticker for _, _, ticker in pending.values()})
+            loaded = self._yf_download_many(tickers, interval, period, store)
+            next_pending = {}
+            for symbol, (yf_symbol, plan, ticker) in pending.items():
+                try:
+                    next_pending[symbol] = (yf_symbol, plan, plan.send(loaded[ticker]))
+                except StopIteration as stop:
+                    _finish(symbol, yf_symbol, stop.value)
+            pending = next_pending
+        return frames
+
+    def _yf_download_many(self, tickers: List[str], interval: str, period: str, store: bool = True) -> Dict[str, pd.DataFrame]:
+        """Загрузка нескольких тикеров Yahoo одним вызовом yf.download (с докачкой по буферам)"""
+        starts = {ticker: self._yahoo_start(ticker, interval, period) for ticker in tickers}
+        incremental = [t for t in tickers if starts[t] is not None]
+        full = [t for t in tickers if starts[t] is None]
+        raw = {}
+        if full:
+            raw.update(_split_yf_download(
+                self.provider.yf_download(full, period=period, interval=interval, group_by='ticker'),
+                full
+            ))
+        if incremental:
+            # Одна общая точка докачки — самая ранняя из нужных
+            start = min(starts[t] for t in incremental)
+            raw.update(_split_yf_download(
+                self.provider.yf_download(incremental, start=start, interval=interval, group_by='ticker'),
+                incremental
+            ))
+        return {
+            ticker: self._yahoo_absorb(ticker, interval, _normalize_yahoo_frame(raw[ticker]), starts[ticker], store)
+            for ticker in tickers
+        }
+
+    def _yahoo_plan(self, symbol: str, yf_symbol: str, interval: str):
+        """План загрузки через Yahoo: генератор отдаёт нужные тикеры, получает их свечи
+        и возвращает итоговый кадр (прямая, обратная или синтетическая пара)"""
+        normalized = symbol.upper().replace('/', '').replace(' ', '')
+        # Пары, недавно собранные синтетически, сразу строим из USD-ног
+        if self._yahoo_routes.get((normalized, interval), 0) > time.time():
+            return (yield from self.cross_rates.cross_plan(normalized[:3], normalized[3:6], interval))
+        data = yield yf_symbol
+        if len(normalized) < 6:
+            return data
+        base = normalized[:3]
+        quote = normalized[3:6]
+        # Если пусто — пробуем реверсную пару (например, USDUAH вместо UAHUSD)
+        if data.empty:
+            data = _invert_ohlc((yield f"{quote}{base}=X"))
+        # Синтетический кросс через USD, если прямой и обратный отсутствуют
+        if data.empty:
+            data = yield from self.cross_rates.cross_plan(base, quote, interval)
+            # Маршрут запоминается только при загруженном индексе: пара может оказаться на Binance
+            if not data.empty and self.market_index.loaded:
+                self._yahoo_routes[(normalized, interval)] = time.time() + DATA_CONFIG['route_memo_ttl']
+        return data
+
+    def _fetch_yahoo_ohlcv(self, symbol: str, timeframe: str, limit: int) -> pd.DataFrame:
+        """Загрузка свечей через Yahoo Finance (прямая, обратная или синтетическая пара)"""
+        yf_symbol = self._format_yahoo_symbol(symbol)
+        interval = self._yahoo_timeframe_to_interval(timeframe)
+        period = self._yahoo_period_for_interval(interval)
+        plan = self._yahoo_plan(symbol, yf_symbol, interval)
+        data = _drive_plan(plan, lambda ticker: self._yf_download(ticker, interval, period))
+        if data.empty:
+            raise Exception(f"Yahoo Finance не вернул данные для {yf_symbol}")
+        logger.info(f"Получено {len(data)} свечей для {yf_symbol} (Yahoo Finance)")
+        return data.tail(limit)
+
+    async def _fetch_yahoo_ohlcv_async(self, symbol: str, timeframe: str, limit: int) -> pd.DataFrame:
+        """Асинхронная загрузка свечей через Yahoo Finance"""
+        yf_symbol = self._format_yahoo_symbol(symbol)
+        interval = self._yahoo_timeframe_to_interval(timeframe)
+        period = self._yahoo_period_for_interval(interval)
+        plan = self._yahoo_plan(symbol, yf_symbol, interval)
+        data = await _drive_plan_async(plan, lambda ticker: self._yf_download_async(ticker, interval, period))
+        if data.empty:
+            raise Exception(f"Yahoo Finance не вернул данные для {yf_symbol}")
+        logger.info(f"Получено {len(data)} свечей для {yf_symbol} (Yahoo Finance)")
+        return data.tail(limit)
+
+    async def close_async(self):
+        """Закрытие асинхронных ресурсов провайдера данных"""
+        await self.provider.close()
     
     def _format_symbol(self, symbol: str) -> str:
         """Форматирование символа для API"""
@@ -265,11 +2244,16 @@ class TechnicalAnalyzer:
         return normalized
     
     def _is_binance_symbol(self, formatted_symbol: str) -> bool:
-        try:
-            markets = self.exchange.load_markets()
-            return formatted_symbol in markets
-        except Exception:
+        listed = self.market_index.lookup(formatted_symbol)
+        if listed is None:
+            # Индекс ещё не загружен — временно идём через Yahoo, не дожидаясь сети.
+            # Такое решение предварительное: оно не запоминается ни в маршрутах, ни в реестре доступности
+            if formatted_symbol not in self._provisional_logged:
+                self._provisional_logged.add(formatted_symbol)
+                logger.info(f"Рынки Binance ещё не загружены, {formatted_symbol} предварительно "
+                            f"запрашивается через Yahoo Finance")
             return False
+        return listed
 
     def _format_yahoo_symbol(self, symbol: str) -> str:
         # Преобразует EUR/USD → EURUSD=X, USDJPY → JPY=X, BTC/USDT → BTC-USD и т.д.
@@ -312,363 +2296,604 @@ class TechnicalAnalyzer:
         return '1y'
     
     def calculate_indicators(self, df: pd.DataFrame) -> Dict:
-        """Расчет технических индикаторов"""
+        """Расчет технических индикаторов: каждый индикатор считается при первом обращении"""
+        return LazyIndicators(df)
+    
+    def calculate_indicators_panel(self, open_: np.ndarray, high: np.ndarray, low: np.ndarray,
+                                   close: np.ndarray, volume: np.ndarray) -> Dict[str, np.ndarray]:
+        """Расчёт всех индикаторов для панели пар за один векторный проход.
+        Входы — выровненные по последней свече массивы формы (пары × время), слева NaN
+        для пар с короткой историей. Результат — словарь имя → массив той же формы"""
+        cfg = INDICATOR_CONFIG
+        open_, high, low, close, volume = (np.asarray(a, dtype=float) for a in (open_, high, low, close, volume))
+        missing = np.isnan(close)
+        prev_close = _panel_shift(close)
+        delta = close - prev_close
         indicators = {}
         
         # SMA и EMA
-        indicators['sma'] = df['close'].rolling(window=INDICATOR_CONFIG['sma_period']).mean()
-        indicators['ema'] = df['close'].ewm(span=INDICATOR_CONFIG['ema_period']).mean()
-        # Дополнительные долгосрочные средние как прокси старшего ТФ
-        indicators['sma200'] = df['close'].rolling(window=200, min_periods=50).mean()
-        indicators['ema50'] = df['close'].ewm(span=50, adjust=False).mean()
+        indicators['sma'] = _panel_rolling_mean(close, cfg['sma_period'])
+        indicators['ema'] = _panel_ewm(close, cfg['ema_period'])
+        indicators['sma200'] = _panel_rolling_mean(close, 200, min_periods=50)
+        indicators['ema50'] = _panel_ewm(close, 50, adjust=False)
         
-        # RSI
-        delta = df['close'].diff()
-        gain = (delta.where(delta > 0, 0)).rolling(window=INDICATOR_CONFIG['rsi_period']).mean()
-        loss = (-delta.where(delta < 0, 0)).rolling(window=INDICATOR_CONFIG['rsi_period']).mean()
-        rs = gain / loss
-        indicators['rsi'] = 100 - (100 / (1 + rs))
+        # RSI (первая свеча пары даёт нулевой прирост, как where() в calculate_indicators)
+        gain = np.where(missing, np.nan, np.where(delta > 0, delta, 0.0))
+        loss = np.where(missing, np.nan, np.where(delta < 0, -delta, 0.0))
+        rs = _panel_div(_panel_rolling_mean(gain, cfg['rsi_period']), _panel_rolling_mean(loss, cfg['rsi_period']))
+        indicators['rsi'] = 100 - _panel_div(100, 1 + rs)
         
         # Bollinger Bands
-        bb_sma = df['close'].rolling(window=INDICATOR_CONFIG['bb_period']).mean()
-        bb_std = df['close'].rolling(window=INDICATOR_CONFIG['bb_period']).std()
-        indicators['bb_upper'] = bb_sma + (bb_std * INDICATOR_CONFIG['bb_std'])
-        indicators['bb_lower'] = bb_sma - (bb_std * INDICATOR_CONFIG['bb_std'])
+        bb_sma = _panel_rolling_mean(close, cfg['bb_period'])
+        bb_std = np.std(_panel_windows(close, cfg['bb_period']), axis=2, ddof=1)
+        indicators['bb_upper'] = bb_sma + bb_std * cfg['bb_std']
+        indicators['bb_lower'] = bb_sma - bb_std * cfg['bb_std']
         indicators['bb_middle'] = bb_sma
         
         # MACD
-        ema_fast = df['close'].ewm(span=INDICATOR_CONFIG['macd_fast']).mean()
-        ema_slow = df['close'].ewm(span=INDICATOR_CONFIG['macd_slow']).mean()
-        indicators['macd'] = ema_fast - ema_slow
-        indicators['macd_signal'] = indicators['macd'].ewm(span=INDICATOR_CONFIG['macd_signal']).mean()
+        indicators['macd'] = _panel_ewm(close, cfg['macd_fast']) - _panel_ewm(close, cfg['macd_slow'])
+        indicators['macd_signal'] = _panel_ewm(indicators['macd'], cfg['macd_signal'])
         indicators['macd_histogram'] = indicators['macd'] - indicators['macd_signal']
         
         # Stochastic RSI
-        rsi = indicators['rsi']
-        stoch_rsi = (rsi - rsi.rolling(window=INDICATOR_CONFIG['stoch_period']).min()) / \
-                   (rsi.rolling(window=INDICATOR_CONFIG['stoch_period']).max() - 
-                    rsi.rolling(window=INDICATOR_CONFIG['stoch_period']).min())
-        indicators['stoch_rsi'] = stoch_rsi * 100
+        rsi_windows = _panel_windows(indicators['rsi'], cfg['stoch_period'])
+        rsi_min = rsi_windows.min(axis=2)
+        indicators['stoch_rsi'] = _panel_div(indicators['rsi'] - rsi_min, rsi_windows.max(axis=2) - rsi_min) * 100
         
         # Williams %R
-        high_max = df['high'].rolling(window=INDICATOR_CONFIG['williams_r_period']).max()
-        low_min = df['low'].rolling(window=INDICATOR_CONFIG['williams_r_period']).min()
-        indicators['williams_r'] = -100 * (high_max - df['close']) / (high_max - low_min)
-        
-        # CCI (Commodity Channel Index)
-        typical_price = (df['high'] + df['low'] + df['close']) / 3
-        sma_tp = typical_price.rolling(window=INDICATOR_CONFIG['cci_period']).mean()
-        mad = typical_price.rolling(window=INDICATOR_CONFIG['cci_period']).apply(lambda x: np.mean(np.abs(x - x.mean())))
-        indicators['cci'] = (typical_price - sma_tp) / (0.015 * mad)
-        
-        # ADX (Average Directional Index)
-        high_diff = df['high'].diff()
-        low_diff = df['low'].diff()
-        
-        plus_dm = np.where((high_diff > low_diff) & (high_diff > 0), high_diff, 0)
-        minus_dm = np.where((low_diff > high_diff) & (low_diff > 0), -low_diff, 0)
-        
-        tr = np.maximum(
-            df['high'] - df['low'],
-            np.maximum(
-                np.abs(df['high'] - df['close'].shift(1)),
-                np.abs(df['low'] - df['close'].shift(1))
-            )
-        )
-        plus_di = 100 * pd.Series(plus_dm).rolling(window=INDICATOR_CONFIG['adx_period']).mean() / \
-                  pd.Series(tr).rolling(window=INDICATOR_CONFIG['adx_period']).mean()
-        minus_di = 100 * pd.Series(minus_dm).rolling(window=INDICATOR_CONFIG['adx_period']).mean() / \
-                   pd.Series(tr).rolling(window=INDICATOR_CONFIG['adx_period']).mean()
-        dx = 100 * np.abs(plus_di - minus_di) / (plus_di + minus_di)
-        indicators['adx'] = pd.Series(dx).rolling(window=INDICATOR_CONFIG['adx_period']).mean()
+        high_max = _panel_windows(high, cfg['williams_r_period']).max(axis=2)
+        low_min = _panel_windows(low, cfg['williams_r_period']).min(axis=2)
+        indicators['williams_r'] = -100 * _panel_div(high_max - close, high_max - low_min)
+        
+        # CCI
+        typical_price = (high + low + close) / 3
+        tp_windows = _panel_windows(typical_price, cfg['cci_period'])
+        mad = np.abs(tp_windows - tp_windows.mean(axis=2, keepdims=True)).mean(axis=2)
+        indicators['cci'] = _panel_div(typical_price - _panel_rolling_mean(typical_price, cfg['cci_period']), 0.015 * mad)
+        
+        # ADX
+        high_diff = high - _panel_shift(high)
+        low_diff = low - _panel_shift(low)
+        plus_dm = np.where(missing, np.nan, np.where((high_diff > low_diff) & (high_diff > 0), high_diff, 0.0))
+        minus_dm = np.where(missing, np.nan, np.where((low_diff > high_diff) & (low_diff > 0), -low_diff, 0.0))
+        tr = np.maximum(high - low, np.maximum(np.abs(high - prev_close), np.abs(low - prev_close)))
+        tr_mean = _panel_rolling_mean(tr, cfg['adx_period'])
+        plus_di = _panel_div(100 * _panel_rolling_mean(plus_dm, cfg['adx_period']), tr_mean)
+        minus_di = _panel_div(100 * _panel_rolling_mean(minus_dm, cfg['adx_period']), tr_mean)
+        dx = _panel_div(100 * np.abs(plus_di - minus_di), plus_di + minus_di)
+        indicators['adx'] = _panel_rolling_mean(dx, cfg['adx_period'])
         indicators['plus_di'] = plus_di
         indicators['minus_di'] = minus_di
         
-        # ATR (Average True Range) и волатильность в % от цены
-        tr2 = np.maximum(
-            df['high'] - df['low'],
-            np.maximum(
-                np.abs(df['high'] - df['close'].shift(1)),
-                np.abs(df['low'] - df['close'].shift(1))
-            )
-        )
-        indicators['atr'] = pd.Series(tr2).rolling(window=INDICATOR_CONFIG['atr_period']).mean()
-        indicators['atr_pct'] = (indicators['atr'] / df['close']) * 100
+        # ATR и волатильность в % от цены
+        indicators['atr'] = _panel_rolling_mean(tr, cfg['atr_period'])
+        indicators['atr_pct'] = (indicators['atr'] / close) * 100
         
-        # OBV (On Balance Volume)
-        obv = (np.sign(df['close'].diff()) * df['volume']).fillna(0).cumsum()
-        indicators['obv'] = obv.rolling(window=INDICATOR_CONFIG['obv_period']).mean()
+        # OBV
+        obv = np.cumsum(np.nan_to_num(np.sign(delta) * volume), axis=1)
+        indicators['obv'] = _panel_rolling_mean(np.where(missing, np.nan, obv), cfg['obv_period'])
         
-        # Уже добавленные ранее индикаторы: Parabolic SAR, Momentum, ROC, MFI, Ichimoku — оставляем как есть
-        # (логика их вычисления находится выше по коду в этом методе)
-        
-        # Свечные паттерны (простые)
-        try:
-            body = (df['close'] - df['open']).abs()
-            range_ = (df['high'] - df['low']).replace(0, np.nan)
-            upper_wick = (df[['open','close']].max(axis=1) - df['high']).abs()
-            lower_wick = (df['low'] - df[['open','close']].min(axis=1)).abs()
+        # Свечные паттерны
+        body = np.abs(close - open_)
+        range_ = np.where(high - low == 0, np.nan, high - low)
+        upper_wick = np.abs(np.maximum(open_, close) - high)
+        lower_wick = np.abs(low - np.minimum(open_, close))
+        prev_open = _panel_shift(open_)
+        with np.errstate(invalid='ignore'):
             indicators['is_doji'] = (body / range_) < 0.1
-            # Пин-бар: длинный хвост снизу или сверху
-            indicators['is_bull_pin'] = (lower_wick > body * 2) & (df['close'] > df['open'])
-            indicators['is_bear_pin'] = (upper_wick > body * 2) & (df['close'] < df['open'])
-            # Поглощение
-            prev_open = df['open'].shift(1)
-            prev_close = df['close'].shift(1)
-            bull_engulf = (df['close'] > df['open']) & (prev_close < prev_open) & (df['close'] >= prev_open) & (df['open'] <= prev_close)
-            bear_engulf = (df['close'] < df['open']) & (prev_close > prev_open) & (df['close'] <= prev_open) & (df['open'] >= prev_close)
-            indicators['bull_engulf'] = bull_engulf
-            indicators['bear_engulf'] = bear_engulf
-        except Exception:
-            indicators['is_doji'] = pd.Series(False, index=df.index)
-            indicators['is_bull_pin'] = pd.Series(False, index=df.index)
-            indicators['is_bear_pin'] = pd.Series(False, index=df.index)
-            indicators['bull_engulf'] = pd.Series(False, index=df.index)
-            indicators['bear_engulf'] = pd.Series(False, index=df.index)
-        
+            indicators['is_bull_pin'] = (lower_wick > body * 2) & (close > open_)
+            indicators['is_bear_pin'] = (upper_wick > body * 2) & (close < open_)
+            indicators['bull_engulf'] = (close > open_) & (prev_close < prev_open) & (close >= prev_open) & (open_ <= prev_close)
+            indicators['bear_engulf'] = (close < open_) & (prev_close > prev_open) & (close <= prev_open) & (open_ >= prev_close)
         return indicators
-    
+
+    def analyze_panel(self, frames: Dict[str, pd.DataFrame], trade_type: Optional[str] = None) -> Dict[str, Dict]:
+        """Анализ нескольких пар одним панельным расчётом индикаторов.
+        Возвращает результаты analyze_signals для пар, которые удалось проанализировать"""
+        frames = {symbol: df for symbol, df in frames.items() if len(df) > 0}
+        if not frames:
+            return {}
+        symbols = list(frames)
+        length = max(len(df) for df in frames.values())
+        # Выравнивание по последней свече: короткие истории дополняются NaN слева
+        columns = {}
+        for col in ['open', 'high', 'low', 'close', 'volume']:
+            panel = np.full((len(symbols), length), np.nan)
+            for row, symbol in enumerate(symbols):
+                values = frames[symbol][col].to_numpy(dtype=float)
+                panel[row, length - len(values):] = values
+            columns[col] = panel
+        arrays = self.calculate_indicators_panel(
+            columns['open'], columns['high'], columns['low'], columns['close'], columns['volume']
+        )
+        results = {}
+        for row, symbol in enumerate(symbols):
+            df = frames[symbol]
+            indicators = {
+                name: pd.Series(values[row, length - len(df):], index=df.index)
+                for name, values in arrays.items()
+            }
+            try:
+                results[symbol] = self.analyze_signals(df, indicators, trade_type)
+            except Exception as e:
+                logger.warning(f"Панельный анализ {symbol} не удался: {e}")
+        return results
+
     def analyze_signals(self, df: pd.DataFrame, indicators: Dict, trade_type: Optional[str] = None) -> Dict:
         """Анализ сигналов и принятие решения"""
         try:
             # Проверяем, что у нас достаточно данных
             if len(df) < 50:
                 raise Exception("Недостаточно данных для анализа (нужно минимум 50 свечей)")
-            
-            # Сформировать таблицу ключевых индикаторов и выбрать последнюю валидную строку
-            key_df = pd.DataFrame({
-                'price': df['close'],
-                'sma': indicators['sma'],
-                'rsi': indicators['rsi'],
-                'macd_histogram': indicators['macd_histogram'],
-                'bb_upper': indicators['bb_upper'],
-                'bb_lower': indicators['bb_lower']
-            })
-            key_df = key_df.dropna()
-            if key_df.empty:
-                raise Exception("Недостаточно валидных данных индикаторов (все NaN). Подождите больше истории или измените таймфрейм.")
-            last_idx = key_df.index[-1]
-            
-            # Текущие значения по последней валидной свече
-            current_price = df.loc[last_idx, 'close']
-            current_sma = indicators['sma'].loc[last_idx]
-            current_sma200 = indicators.get('sma200', pd.Series([np.nan], index=[last_idx])).loc[last_idx]
-            current_ema50 = indicators.get('ema50', pd.Series([np.nan], index=[last_idx])).loc[last_idx]
-            current_rsi = indicators['rsi'].loc[last_idx]
-            current_macd_hist = indicators['macd_histogram'].loc[last_idx]
-            current_bb_upper = indicators['bb_upper'].loc[last_idx]
-            current_bb_lower = indicators['bb_lower'].loc[last_idx]
-            current_stoch_rsi = indicators['stoch_rsi'].loc[last_idx] if 'stoch_rsi' in indicators else np.nan
-            current_williams_r = indicators['williams_r'].loc[last_idx] if 'williams_r' in indicators else np.nan
-            current_cci = indicators['cci'].loc[last_idx] if 'cci' in indicators else np.nan
-            current_adx = indicators['adx'].loc[last_idx] if 'adx' in indicators else np.nan
-            current_plus_di = indicators['plus_di'].loc[last_idx] if 'plus_di' in indicators else np.nan
-            current_minus_di = indicators['minus_di'].loc[last_idx] if 'minus_di' in indicators else np.nan
-            current_atr = indicators['atr'].loc[last_idx] if 'atr' in indicators else np.nan
-            current_atr_pct = indicators.get('atr_pct', pd.Series([np.nan], index=[last_idx])).loc[last_idx]
-            current_obv = indicators['obv'].loc[last_idx] if 'obv' in indicators else np.nan
-            
-            # Проверка NaN ключевых значений
-            if pd.isna(current_price) or pd.isna(current_sma) or pd.isna(current_rsi):
-                raise Exception("Недостаточно валидных данных индикаторов на последней свече. Измените таймфрейм или дождитесь новых данных.")
-            
-            # Адаптивные веса под рынки
-            is_otc = (trade_type or '').lower() == 'otc'
-            w_trend = 2.0 if not is_otc else 1.5
-            w_momentum = 1.5 if is_otc else 1.2
-            w_volatility = 1.0
-            w_patterns = 1.0
-            
-            score = 0.0
-            signals = []
-            
-            # Фильтр низкой волатильности (снижаем уверенность)
-            if not pd.isna(current_atr_pct) and current_atr_pct < 0.05:
-                signals.append("Низкая волатильность ATR% (<0.05%) (-0.5)")
-                score -= 0.5
-            
-            # Старший тренд (SMA200 / EMA50)
-            if not pd.isna(current_sma200):
-                if current_price > current_sma200:
-                    score += w_trend
-                    signals.append(f"Цена > SMA200 (+{w_trend})")
-                else:
-                    score -= w_trend
-                    signals.append(f"Цена < SMA200 (-{w_trend})")
-            if not pd.isna(current_ema50):
-                if current_price > current_ema50:
-                    score += 1.0
-                    signals.append("Цена > EMA50 (+1)")
+            values = self._latest_indicator_values(df, indicators)
+            return self._score_signals(values, trade_type)
+        except Exception as e:
+            logger.error(f"Ошибка при анализе сигналов: {e}")
+            raise Exception(f"Ошибка анализа: {str(e)}")
+
+    def analyze_latest(self, df: pd.DataFrame, trade_type: Optional[str] = None) -> Dict:
+        """Анализ последней свечи по хвосту истории минимальной длины: время расчёта
+        не зависит от объёма загруженной истории"""
+        try:
+            if len(df) < 50:
+                raise Exception("Недостаточно данных для анализа (нужно минимум 50 свечей)")
+            return self._score_signals(self._tail_indicator_values(df), trade_type)
+        except Exception as e:
+            logger.error(f"Ошибка при анализе сигналов: {e}")
+            raise Exception(f"Ошибка анализа: {str(e)}")
+
+    def _tail_indicator_values(self, df: pd.DataFrame) -> Dict:
+        """Скаляры для скоринга по последней свече, посчитанные на хвосте кадра.
+        Уровень OBV зависит от начала истории, поэтому на хвосте совпадает только его наклон"""
+        tail = df.iloc[-scoring_tail_window():]
+        indicators = LazyIndicators(tail)
+        values = {'price': tail['close'].iat[-1]}
+        for name in SCORING_INDICATORS:
+            values[name] = indicators[name].iat[-1]
+        if any(pd.isna(values[k]) for k in StreamingIndicators.KEY_FIELDS):
+            # Последняя свеча без валидных ключевых значений — полный расчёт выберет предыдущую
+            return self._latest_indicator_values(df, self.calculate_indicators(df))
+        obv = indicators['obv']
+        values['atr_avg'] = indicators['atr'].rolling(window=20).mean().iat[-1]
+        values['obv_slope'] = obv.iat[-1] - obv.iat[-5] if len(obv) > 5 else 0
+        for name in CANDLE_PATTERNS:
+            values[name] = bool(indicators[name].iat[-1])
+        return values
+
+    def analyze_streaming(self, symbol: str, timeframe: str, df: pd.DataFrame, trade_type: Optional[str] = None) -> Dict:
+        """Анализ через потоковые индикаторы пары: закрытые свечи добавляются в состояние
+        инкрементально, последняя (незакрытая) свеча считается на копии состояния"""
+        try:
+            if len(df) < 50:
+                raise Exception("Недостаточно данных для анализа (нужно минимум 50 свечей)")
+            key = (symbol, timeframe)
+            closed = df.iloc[:-1]
+            with self._streams_lock:
+                stream = self._streams.get(key)
+                if stream is None or stream.last_timestamp not in closed.index:
+                    # Нет состояния или разрыв в истории — строим заново по кадру
+                    stream = StreamingIndicators()
+                    stream.ingest(closed)
                 else:
-                    score -= 1.0
-                    signals.append("Цена < EMA50 (-1)")
-            
-            # Базовый тренд (SMA50)
-            if current_price > current_sma:
+                    stream.ingest(closed[closed.index > stream.last_timestamp])
+                self._streams[key] = stream
+                self._streams.move_to_end(key)
+                while len(self._streams) > ANALYSIS_CONFIG['max_streams']:
+                    self._streams.popitem(last=False)
+                current = stream.snapshot()
+            last = df.iloc[-1]
+            current.update(df.index[-1], last['open'], last['high'], last['low'], last['close'], last['volume'])
+            if not current.is_valid():
+                # Последняя свеча без валидных ключевых значений — пересчёт по хвосту истории
+                return self._score_signals(self._tail_indicator_values(df), trade_type)
+            return self._score_signals(current.latest(), trade_type)
+        except Exception as e:
+            logger.error(f"Ошибка при анализе сигналов: {e}")
+            raise Exception(f"Ошибка анализа: {str(e)}")
+
+    def _latest_indicator_values(self, df: pd.DataFrame, indicators: Dict) -> Dict:
+        """Значения индикаторов, которые использует скоринг, на последней валидной свече"""
+        # Сформировать таблицу ключевых индикаторов и выбрать последнюю валидную строку
+        key_df = pd.DataFrame({
+            'price': df['close'],
+            'sma': indicators['sma'],
+            'rsi': indicators['rsi'],
+            'macd_histogram': indicators['macd_histogram'],
+            'bb_upper': indicators['bb_upper'],
+            'bb_lower': indicators['bb_lower']
+        })
+        key_df = key_df.dropna()
+        if key_df.empty:
+            raise Exception("Недостаточно валидных данных индикаторов (все NaN). Подождите больше истории или измените таймфрейм.")
+        last_idx = key_df.index[-1]
+        
+        def _at(name: str) -> float:
+            return indicators[name].loc[last_idx] if name in indicators else np.nan
+        
+        def _last_flag(name: str) -> bool:
+            return bool(indicators.get(name, pd.Series([False])).iloc[-1])
+        
+        obv = indicators['obv']
+        return {
+            'price': df['close'].loc[last_idx],
+            'sma': _at('sma'),
+            'sma200': _at('sma200'),
+            'ema50': _at('ema50'),
+            'rsi': _at('rsi'),
+            'macd_histogram': _at('macd_histogram'),
+            'bb_upper': _at('bb_upper'),
+            'bb_lower': _at('bb_lower'),
+            'stoch_rsi': _at('stoch_rsi'),
+            'williams_r': _at('williams_r'),
+            'cci': _at('cci'),
+            'adx': _at('adx'),
+            'plus_di': _at('plus_di'),
+            'minus_di': _at('minus_di'),
+            'atr': _at('atr'),
+            'atr_pct': _at('atr_pct'),
+            'obv': _at('obv'),
+            # Средний ATR и наклон OBV берутся по последней свече кадра
+            'atr_avg': indicators['atr'].rolling(window=20).mean().iloc[-1],
+            'obv_slope': obv.iloc[-1] - obv.iloc[-5] if len(obv) > 5 else 0,
+            'bull_engulf': _last_flag('bull_engulf'),
+            'bear_engulf': _last_flag('bear_engulf'),
+            'is_bull_pin': _last_flag('is_bull_pin'),
+            'is_bear_pin': _last_flag('is_bear_pin'),
+            'is_doji': _last_flag('is_doji')
+        }
+
+    @staticmethod
+    def _signal_weights(trade_type: Optional[str] = None) -> Tuple[float, float, float, float]:
+        """Веса тренда, моментума, волатильности и паттернов под тип рынка"""
+        is_otc = (trade_type or '').lower() == 'otc'
+        w_trend = 2.0 if not is_otc else 1.5
+        w_momentum = 1.5 if is_otc else 1.2
+        return w_trend, w_momentum, 1.0, 1.0
+
+    def _score_signals(self, values: Dict, trade_type: Optional[str] = None) -> Dict:
+        """Скоринг по значениям индикаторов последней свечи"""
+        # Текущие значения по последней валидной свече
+        current_price = values['price']
+        current_sma = values['sma']
+        current_sma200 = values['sma200']
+        current_ema50 = values['ema50']
+        current_rsi = values['rsi']
+        current_macd_hist = values['macd_histogram']
+        current_bb_upper = values['bb_upper']
+        current_bb_lower = values['bb_lower']
+        current_stoch_rsi = values['stoch_rsi']
+        current_williams_r = values['williams_r']
+        current_cci = values['cci']
+        current_adx = values['adx']
+        current_plus_di = values['plus_di']
+        current_minus_di = values['minus_di']
+        current_atr = values['atr']
+        current_atr_pct = values['atr_pct']
+        atr_avg = values['atr_avg']
+        obv_slope = values['obv_slope']
+        
+        # Проверка NaN ключевых значений
+        if pd.isna(current_price) or pd.isna(current_sma) or pd.isna(current_rsi):
+            raise Exception("Недостаточно валидных данных индикаторов на последней свече. Измените таймфрейм или дождитесь новых данных.")
+        
+        # Адаптивные веса под рынки
+        w_trend, w_momentum, w_volatility, w_patterns = self._signal_weights(trade_type)
+        
+        score = 0.0
+        signals = []
+        
+        # Фильтр низкой волатильности (снижаем уверенность)
+        if not pd.isna(current_atr_pct) and current_atr_pct < 0.05:
+            signals.append("Низкая волатильность ATR% (<0.05%) (-0.5)")
+            score -= 0.5
+        
+        # Старший тренд (SMA200 / EMA50)
+        if not pd.isna(current_sma200):
+            if current_price > current_sma200:
                 score += w_trend
-                signals.append(f"Цена > SMA50 (+{w_trend})")
+                signals.append(f"Цена > SMA200 (+{w_trend})")
             else:
                 score -= w_trend
-                signals.append(f"Цена < SMA50 (-{w_trend})")
-            
-            # RSI
-            if 50 < current_rsi < 80:
-                score += w_momentum
-                signals.append(f"RSI: {current_rsi:.1f} (+{w_momentum})")
-            elif 20 < current_rsi < 50:
-                score -= w_momentum
-                signals.append(f"RSI: {current_rsi:.1f} (-{w_momentum})")
-            elif current_rsi >= 80:
-                score -= 1
-                signals.append(f"RSI перекуплен: {current_rsi:.1f} (-1)")
-            elif current_rsi <= 20:
-                score += 1
-                signals.append(f"RSI перепродан: {current_rsi:.1f} (+1)")
-            
-            # MACD
-            if current_macd_hist > 0:
-                score += w_momentum
-                signals.append(f"MACD > 0 (+{w_momentum})")
+                signals.append(f"Цена < SMA200 (-{w_trend})")
+        if not pd.isna(current_ema50):
+            if current_price > current_ema50:
+                score += 1.0
+                signals.append("Цена > EMA50 (+1)")
             else:
-                score -= w_momentum
-                signals.append(f"MACD < 0 (-{w_momentum})")
-            
-            # Полосы Боллинджера
-            if current_price <= current_bb_lower:
-                score += 1
-                signals.append("Цена у нижней BB (+1)")
-            elif current_price >= current_bb_upper:
-                score -= 1
-                signals.append("Цена у верхней BB (-1)")
-            
-            # Stochastic RSI
-            if current_stoch_rsi < 20:
-                score += 1
-                signals.append(f"Stoch RSI: {current_stoch_rsi:.1f} (+1)")
-            elif current_stoch_rsi > 80:
-                score -= 1
-                signals.append(f"Stoch RSI: {current_stoch_rsi:.1f} (-1)")
-            
-            # Williams %R
-            if current_williams_r < -80:
-                score += 1
-                signals.append(f"Williams %R: {current_williams_r:.1f} (+1)")
-            elif current_williams_r > -20:
-                score -= 1
-                signals.append(f"Williams %R: {current_williams_r:.1f} (-1)")
-            
-            # CCI
-            if current_cci > 100:
+                score -= 1.0
+                signals.append("Цена < EMA50 (-1)")
+        
+        # Базовый тренд (SMA50)
+        if current_price > current_sma:
+            score += w_trend
+            signals.append(f"Цена > SMA50 (+{w_trend})")
+        else:
+            score -= w_trend
+            signals.append(f"Цена < SMA50 (-{w_trend})")
+        
+        # RSI
+        if 50 < current_rsi < 80:
+            score += w_momentum
+            signals.append(f"RSI: {current_rsi:.1f} (+{w_momentum})")
+        elif 20 < current_rsi < 50:
+            score -= w_momentum
+            signals.append(f"RSI: {current_rsi:.1f} (-{w_momentum})")
+        elif current_rsi >= 80:
+            score -= 1
+            signals.append(f"RSI перекуплен: {current_rsi:.1f} (-1)")
+        elif current_rsi <= 20:
+            score += 1
+            signals.append(f"RSI перепродан: {current_rsi:.1f} (+1)")
+        
+        # MACD
+        if current_macd_hist > 0:
+            score += w_momentum
+            signals.append(f"MACD > 0 (+{w_momentum})")
+        else:
+            score -= w_momentum
+            signals.append(f"MACD < 0 (-{w_momentum})")
+        
+        # Полосы Боллинджера
+        if current_price <= current_bb_lower:
+            score += 1
+            signals.append("Цена у нижней BB (+1)")
+        elif current_price >= current_bb_upper:
+            score -= 1
+            signals.append("Цена у верхней BB (-1)")
+        
+        # Stochastic RSI
+        if current_stoch_rsi < 20:
+            score += 1
+            signals.append(f"Stoch RSI: {current_stoch_rsi:.1f} (+1)")
+        elif current_stoch_rsi > 80:
+            score -= 1
+            signals.append(f"Stoch RSI: {current_stoch_rsi:.1f} (-1)")
+        
+        # Williams %R
+        if current_williams_r < -80:
+            score += 1
+            signals.append(f"Williams %R: {current_williams_r:.1f} (+1)")
+        elif current_williams_r > -20:
+            score -= 1
+            signals.append(f"Williams %R: {current_williams_r:.1f} (-1)")
+        
+        # CCI
+        if current_cci > 100:
+            score += 1
+            signals.append(f"CCI: {current_cci:.1f} (+1)")
+        elif current_cci < -100:
+            score -= 1
+            signals.append(f"CCI: {current_cci:.1f} (-1)")
+        
+        # ADX тренд
+        if current_adx > 20:
+            if current_plus_di > current_minus_di:
                 score += 1
-                signals.append(f"CCI: {current_cci:.1f} (+1)")
-            elif current_cci < -100:
+                signals.append(f"ADX тренд вверх: {current_adx:.1f} (+1)")
+            else:
                 score -= 1
-                signals.append(f"CCI: {current_cci:.1f} (-1)")
-            
-            # ADX тренд
-            if current_adx > 20:
-                if current_plus_di > current_minus_di:
-                    score += 1
-                    signals.append(f"ADX тренд вверх: {current_adx:.1f} (+1)")
-                else:
-                    score -= 1
-                    signals.append(f"ADX тренд вниз: {current_adx:.1f} (-1)")
-            
-            # ATR волатильность
-            atr_avg = indicators['atr'].rolling(window=20).mean().iloc[-1]
-            if current_atr > atr_avg * 1.2:
-                score += w_volatility * 0.5
-                signals.append(f"Высокая волатильность (+{0.5 * w_volatility})")
-            elif current_atr < atr_avg * 0.8:
-                score -= w_volatility * 0.5
-                signals.append(f"Низкая волатильность (-{0.5 * w_volatility})")
-            
-            # OBV направление (приблизительное)
-            obv_slope = indicators['obv'].iloc[-1] - indicators['obv'].iloc[-5] if len(indicators['obv']) > 5 else 0
-            if obv_slope > 0:
-                score += 0.5
-                signals.append("OBV растет (+0.5)")
-            elif obv_slope < 0:
-                score -= 0.5
-                signals.append("OBV падает (-0.5)")
-            
-            # Паттерны свечей
-            if indicators.get('bull_engulf', pd.Series([False])).iloc[-1]:
-                score += w_patterns
-                signals.append(f"Бычье поглощение (+{w_patterns})")
-            if indicators.get('bear_engulf', pd.Series([False])).iloc[-1]:
-                score -= w_patterns
-                signals.append(f"Медвежье поглощение (-{w_patterns})")
-            if indicators.get('is_bull_pin', pd.Series([False])).iloc[-1]:
-                score += 0.5
-                signals.append("Пин-бар бычий (+0.5)")
-            if indicators.get('is_bear_pin', pd.Series([False])).iloc[-1]:
-                score -= 0.5
-                signals.append("Пин-бар медвежий (-0.5)")
-            if indicators.get('is_doji', pd.Series([False])).iloc[-1]:
-                signals.append("Доджи (нейтрально)")
-            
-            # Результат и сила (убираем нейтральные - всегда выбираем направление)
-            if score >= SIGNAL_THRESHOLDS['strong_bull']:
-                strength = "СИЛЬНЫЙ БЫЧИЙ"
-                sticker = "🟢 ВВЕРХ ▲"
-            elif score >= SIGNAL_THRESHOLDS['weak_bull']:
+                signals.append(f"ADX тренд вниз: {current_adx:.1f} (-1)")
+        
+        # ATR волатильность
+        if current_atr > atr_avg * 1.2:
+            score += w_volatility * 0.5
+            signals.append(f"Высокая волатильность (+{0.5 * w_volatility})")
+        elif current_atr < atr_avg * 0.8:
+            score -= w_volatility * 0.5
+            signals.append(f"Низкая волатильность (-{0.5 * w_volatility})")
+        
+        # OBV направление (приблизительное)
+        if obv_slope > 0:
+            score += 0.5
+            signals.append("OBV растет (+0.5)")
+        elif obv_slope < 0:
+            score -= 0.5
+            signals.append("OBV падает (-0.5)")
+        
+        # Паттерны свечей
+        if values['bull_engulf']:
+            score += w_patterns
+            signals.append(f"Бычье поглощение (+{w_patterns})")
+        if values['bear_engulf']:
+            score -= w_patterns
+            signals.append(f"Медвежье поглощение (-{w_patterns})")
+        if values['is_bull_pin']:
+            score += 0.5
+            signals.append("Пин-бар бычий (+0.5)")
+        if values['is_bear_pin']:
+            score -= 0.5
+            signals.append("Пин-бар медвежий (-0.5)")
+        if values['is_doji']:
+            signals.append("Доджи (нейтрально)")
+        
+        # Результат и сила (убираем нейтральные - всегда выбираем направление)
+        if score >= SIGNAL_THRESHOLDS['strong_bull']:
+            strength = "СИЛЬНЫЙ БЫЧИЙ"
+            sticker = "🟢 ВВЕРХ ▲"
+        elif score >= SIGNAL_THRESHOLDS['weak_bull']:
+            strength = "СЛАБЫЙ БЫЧИЙ"
+            sticker = "🟢 ВВЕРХ ▲"
+        elif score <= SIGNAL_THRESHOLDS['strong_bear']:
+            strength = "СИЛЬНЫЙ МЕДВЕЖИЙ"
+            sticker = "🔴 ВНИЗ ▼"
+        elif score <= SIGNAL_THRESHOLDS['weak_bear']:
+            strength = "СЛАБЫЙ МЕДВЕЖИЙ"
+            sticker = "🔴 ВНИЗ ▼"
+        else:
+            # Если между порогами - выбираем по знаку
+            if score > 0:
                 strength = "СЛАБЫЙ БЫЧИЙ"
                 sticker = "🟢 ВВЕРХ ▲"
-            elif score <= SIGNAL_THRESHOLDS['strong_bear']:
-                strength = "СИЛЬНЫЙ МЕДВЕЖИЙ"
-                sticker = "🔴 ВНИЗ ▼"
-            elif score <= SIGNAL_THRESHOLDS['weak_bear']:
+            else:
                 strength = "СЛАБЫЙ МЕДВЕЖИЙ"
                 sticker = "🔴 ВНИЗ ▼"
-            else:
-                # Если между порогами - выбираем по знаку
-                if score > 0:
-                    strength = "СЛАБЫЙ БЫЧИЙ"
-                    sticker = "🟢 ВВЕРХ ▲"
-                else:
-                    strength = "СЛАБЫЙ МЕДВЕЖИЙ"
-                    sticker = "🔴 ВНИЗ ▼"
-            
-            return {
-                'signal': sticker,
-                'strength': strength,
-                'score': round(float(score), 2),
-                'signals': signals,
-                'current_price': current_price,
-                'values': {
-                    'RSI': round(float(current_rsi), 2),
-                    'MACD_hist': round(float(current_macd_hist), 6),
-                    'Williams %R': round(float(current_williams_r), 1) if not pd.isna(current_williams_r) else None,
-                    'CCI': round(float(current_cci), 1) if not pd.isna(current_cci) else None,
-                    'ADX': round(float(current_adx), 1) if not pd.isna(current_adx) else None,
-                    'ATR': round(float(current_atr), 5) if not pd.isna(current_atr) else None,
-                    'ATR%': round(float(current_atr_pct), 3) if not pd.isna(current_atr_pct) else None,
-                    'SMA200': round(float(current_sma200), 5) if not pd.isna(current_sma200) else None,
-                    'EMA50': round(float(current_ema50), 5) if not pd.isna(current_ema50) else None
-                }
+        
+        return {
+            'signal': sticker,
+            'strength': strength,
+            'score': round(float(score), 2),
+            'signals': signals,
+            'current_price': current_price,
+            'values': {
+                'RSI': round(float(current_rsi), 2),
+                'MACD_hist': round(float(current_macd_hist), 6),
+                'Williams %R': round(float(current_williams_r), 1) if not pd.isna(current_williams_r) else None,
+                'CCI': round(float(current_cci), 1) if not pd.isna(current_cci) else None,
+                'ADX': round(float(current_adx), 1) if not pd.isna(current_adx) else None,
+                'ATR': round(float(current_atr), 5) if not pd.isna(current_atr) else None,
+                'ATR%': round(float(current_atr_pct), 3) if not pd.isna(current_atr_pct) else None,
+                'SMA200': round(float(current_sma200), 5) if not pd.isna(current_sma200) else None,
+                'EMA50': round(float(current_ema50), 5) if not pd.isna(current_ema50) else None
             }
-        except Exception as e:
-            logger.error(f"Ошибка при анализе сигналов: {e}")
-            raise Exception(f"Ошибка анализа: {str(e)}")
+        }
 
-    def check_all_symbols(self):
-        # Список всех валютных пар из клавиатуры и маппинга
-        all_symbols = [
-            'EUR/USD', 'GBP/USD', 'USD/JPY', 'AUD/USD', 'NZD/USD', 'USD/CAD', 'USD/CHF',
-            'AUD/JPY', 'EUR/JPY', 'GBP/JPY', 'CAD/JPY', 'CHF/JPY', 'EUR/GBP', 'AUD/CAD',
-            'NZD/JPY', 'EURAUD', 'GBPAUD', 'AUDNZD', 'EURNZD', 'GBPNZD', 'GBPCHF', 'EURCHF', 'AUDCHF', 'CADCHF', 'NZDCHF',
-            'BTC/USDT', 'ETH/USDT'
-        ]
-        available = []
-        unavailable = []
-        for symbol in all_symbols:
+    def score_history(self, df: pd.DataFrame, trade_type: Optional[str] = None) -> pd.DataFrame:
+        """Скоринг каждой свечи истории теми же правилами, что и _score_signals, но массивами.
+        Свеча t оценивается так, как если бы она была последней в кадре; свечи без валидных
+        ключевых значений или с историей короче 50 свечей помечаются valid=False"""
+        indicators = LazyIndicators(df)
+        v = {name: indicators[name].to_numpy(dtype=float) for name in SCORING_INDICATORS}
+        price = df['close'].to_numpy(dtype=float)
+        flags = {name: indicators[name].to_numpy(dtype=bool) for name in CANDLE_PATTERNS}
+        atr_avg = indicators['atr'].rolling(window=20).mean().to_numpy(dtype=float)
+        obv = v['obv']
+        obv_slope = np.zeros(len(df))
+        obv_slope[5:] = obv[5:] - obv[1:-4]
+        w_trend, w_momentum, w_volatility, w_patterns = self._signal_weights(trade_type)
+        
+        with np.errstate(invalid='ignore'):
+            score = np.where(v['atr_pct'] < 0.05, -0.5, 0.0)
+            # Старший и базовый тренд
+            score += np.where(np.isnan(v['sma200']), 0.0, np.where(price > v['sma200'], w_trend, -w_trend))
+            score += np.where(np.isnan(v['ema50']), 0.0, np.where(price > v['ema50'], 1.0, -1.0))
+            score += np.where(price > v['sma'], w_trend, -w_trend)
+            # Моментум
+            rsi = v['rsi']
+            score += np.select(
+                [(rsi > 50) & (rsi < 80), (rsi > 20) & (rsi < 50), rsi >= 80, rsi <= 20],
+                [w_momentum, -w_momentum, -1.0, 1.0], 0.0
+            )
+            score += np.where(v['macd_histogram'] > 0, w_momentum, -w_momentum)
+            # Осцилляторы
+            score += np.select([price <= v['bb_lower'], price >= v['bb_upper']], [1.0, -1.0], 0.0)
+            score += np.select([v['stoch_rsi'] < 20, v['stoch_rsi'] > 80], [1.0, -1.0], 0.0)
+            score += np.select([v['williams_r'] < -80, v['williams_r'] > -20], [1.0, -1.0], 0.0)
+            score += np.select([v['cci'] > 100, v['cci'] < -100], [1.0, -1.0], 0.0)
+            score += np.where(v['adx'] > 20, np.where(v['plus_di'] > v['minus_di'], 1.0, -1.0), 0.0)
+            # Волатильность, объём и паттерны
+            score += np.select([v['atr'] > atr_avg * 1.2, v['atr'] < atr_avg * 0.8],
+                               [w_volatility * 0.5, -w_volatility * 0.5], 0.0)
+            score += np.sign(np.nan_to_num(obv_slope)) * 0.5
+            score += (flags['bull_engulf'].astype(float) - flags['bear_engulf']) * w_patterns
+            score += (flags['is_bull_pin'].astype(float) - flags['is_bear_pin']) * 0.5
+        
+        valid = ~np.isnan(price) & (np.arange(len(df)) >= 49)
+        for name in StreamingIndicators.KEY_FIELDS[1:]:
+            valid &= ~np.isnan(v[name])
+        # Пороги в том же порядке, что и в _score_signals; между слабыми порогами решает знак
+        levels = [score >= SIGNAL_THRESHOLDS['strong_bull'], score >= SIGNAL_THRESHOLDS['weak_bull'],
+                  score <= SIGNAL_THRESHOLDS['strong_bear'], score <= SIGNAL_THRESHOLDS['weak_bear'], score > 0]
+        strength = np.select(levels, ["СИЛЬНЫЙ БЫЧИЙ", "СЛАБЫЙ БЫЧИЙ", "СИЛЬНЫЙ МЕДВЕЖИЙ", "СЛАБЫЙ МЕДВЕЖИЙ", "СЛАБЫЙ БЫЧИЙ"],
+                             "СЛАБЫЙ МЕДВЕЖИЙ")
+        direction = np.select(levels, [1, 1, -1, -1, 1], -1)
+        return pd.DataFrame({
+            'score': np.where(valid, np.round(score, 2), np.nan),
+            'direction': np.where(valid, direction, 0),
+            'strength': np.where(valid, strength, None),
+            'valid': valid
+        }, index=df.index)
+
+    def backtest(self, df: pd.DataFrame, horizon: int = 1, trade_type: Optional[str] = None) -> Dict:
+        """Доля верных прогнозов на истории: прогноз свечи t сравнивается с закрытием свечи t+horizon
+        по тем же правилам, что и check_forecast_result (ВНИЗ засчитывается, если цена не выросла)"""
+        history = self.score_history(df, trade_type)
+        close = df['close'].to_numpy(dtype=float)
+        if horizon < 1:
+            raise ValueError("horizon должен быть не меньше 1 свечи")
+        entry = close[:-horizon]
+        exit_ = close[horizon:]
+        evaluated = history['valid'].to_numpy()[:len(exit_)] & ~np.isnan(exit_)
+        went_up = exit_ > entry
+        up = history['direction'].to_numpy()[:len(exit_)] > 0
+        hits = np.where(up, went_up, ~went_up) & evaluated
+        strength = history['strength'].to_numpy()[:len(exit_)]
+        
+        def _stats(mask: np.ndarray) -> Dict:
+            trades = int(mask.sum())
+            won = int((hits & mask).sum())
+            return {'trades': trades, 'hits': won, 'hit_rate': round(won / trades * 100, 2) if trades else None}
+        
+        result = _stats(evaluated)
+        result['horizon'] = horizon
+        result['by_strength'] = {label: _stats(evaluated & (strength == label))
+                                 for label in ("СИЛЬНЫЙ БЫЧИЙ", "СЛАБЫЙ БЫЧИЙ", "СЛАБЫЙ МЕДВЕЖИЙ", "СИЛЬНЫЙ МЕДВЕЖИЙ")}
+        return result
+
+    def backtest_universe(self, symbols: List[str], timeframes: List[str], horizon: int = 1,
+                          limit: int = 1000, trade_type: Optional[str] = None) -> Dict[Tuple[str, str], Dict]:
+        """Бэктест по всем парам и таймфреймам; данные загружаются пакетно по таймфрейму"""
+        results = {}
+        for timeframe in timeframes:
+            for symbol, df in self.get_ohlcv_batch(symbols, timeframe, limit=limit).items():
+                try:
+                    results[(symbol, timeframe)] = self.backtest(df, horizon, trade_type)
+                except Exception as e:
+                    logger.warning(f"Бэктест {symbol} {timeframe} не удался: {e}")
+        return results
+
+    def history_view(self, symbol: str, timeframe: str, start=None, end=None) -> Optional[CandleView]:
+        """Окно сохранённой истории пары без копирования (для длинных бэктестов и индикаторов)"""
+        if self.candle_store is None:
+            return None
+        source, ticker, _ = self._resolve_source(symbol, timeframe)
+        key = (source, ticker, timeframe if source == 'binance' else self._yahoo_timeframe_to_interval(timeframe))
+        return self.candle_store.view(key, start, end)
+
+    def probe_symbols(self, symbols: List[str], force: bool = False) -> Dict[str, bool]:
+        """Проверка доступности пар, у которых истёк TTL/backoff (или всех при force).
+        Пары из индекса рынков Binance подтверждаются по метаданным, остальные — одной свечой 1h
+        общим пакетным запросом без записи в буферы. При сбое всего запроса статусы не меняются"""
+        due = list(dict.fromkeys(symbols)) if force else self.availability.stale(symbols)
+        if not due:
+            return {}
+        results = {}
+        candles = []
+        provisional = set()
+        for symbol in due:
+            listed = self.market_index.lookup(self._format_symbol(symbol))
+            if listed:
+                results[symbol] = True
+            else:
+                candles.append(symbol)
+                if listed is None:
+                    provisional.add(symbol)
+        errors = {}
+        if candles:
             try:
-                # Пробуем получить хотя бы одну свечу (1h)
-                self.get_ohlcv_data(symbol, '1h', limit=1)
-                available.append(symbol)
+                frames = self.get_ohlcv_batch(candles, '1h', limit=1, store=False, errors=errors)
             except Exception as e:
-                unavailable.append(f"{symbol} ({e})")
+                logger.warning(f"Проверка доступности пар не удалась: {e}")
+                frames = None
+            if frames is not None:
+                results.update({symbol: symbol in frames for symbol in candles})
+        # Отказ Yahoo до загрузки индекса Binance не окончателен — статус не записывается
+        for symbol in provisional:
+            if results.get(symbol) is False:
+                logger.info(f"{symbol}: отказ Yahoo Finance до загрузки рынков Binance не запоминается")
+                del results[symbol]
+        for symbol, available in results.items():
+            self.availability.record(symbol, available, None if available else errors.get(symbol, "нет данных"))
+        return results
+
+    def available_symbols(self, symbols: List[str]) -> List[str]:
+        """Пары с последним успешным статусом; не проверявшиеся считаются доступными"""
+        return [s for s in symbols if self.availability.status(s) is not False]
+
+    def check_all_symbols(self):
+        # Проверяем пары через общий реестр доступности
+        self.probe_symbols(PO_ALL_SYMBOLS)
+        available = [s for s in PO_ALL_SYMBOLS if self.availability.status(s)]
+        unavailable = [f"{s} ({self.availability.reason(s)})" for s in PO_ALL_SYMBOLS if self.availability.status(s) is False]
         logger.info(f"Доступные пары: {', '.join(available)}")
         if unavailable:
             logger.warning(f"Недоступные пары: {', '.join(unavailable)}")
@@ -694,22 +2919,35 @@ def _normalize_pair_text(pair: str) -> str:
 class TelegramBot:
     """Основной класс Telegram бота"""
     
-    def __init__(self):
-        self.analyzer = TechnicalAnalyzer()
-        self.application = Application.builder().token(TELEGRAM_TOKEN).build()
+    def __init__(self, provider: Optional[MarketDataProvider] = None):
+        self.analyzer = TechnicalAnalyzer(provider)
+        # Список рынков Binance грузится в фоне и не блокирует обработку запросов
+        self.analyzer.market_index.start()
+        self.application = (
+            Application.builder().token(TELEGRAM_TOKEN)
+            .post_init(self.on_startup)
+            .post_shutdown(self.on_shutdown)
+            .build()
+        )
         self.setup_handlers()
-        # Хранилище для прогнозов
+        # Журнал прогнозов на диске и компактный рабочий набор ожидающих проверки в памяти
+        self.ledger = ForecastLedger(FORECAST_CONFIG['db_path'], FORECAST_CONFIG['flush_batch'])
+        self.ledger_task = None
         self.forecasts = {}
-        # Задачи для автоматической проверки
-        self.check_tasks = {}
+        # Единый планировщик автоматической проверки прогнозов
+        self.forecast_scheduler = ForecastScheduler(self.resolve_forecasts)
         # Путь к папке с изображениями
         self.images_path = "images/"
         # Задачи анализа по user_id
         self.analysis_tasks = {}
-        # Доступные пары (динамически)
-        self.available_symbols = set()
-        # Проверка всех валютных пар при старте
-        self.refresh_symbols()
+        # Общие вычисления анализа по (пара, таймфрейм, тип, открытие свечи): одно на свечу
+        self.analysis_flights = {}
+        # Доступные пары: до окончания фонового прогрева — статический список
+        self.available_symbols = set(PO_ALL_SYMBOLS)
+        # Фоновая проверка доступности пар после старта polling
+        self.warmup_task = None
+        self.symbols_refresh_task = None
+        self.warmup_stats = {'state': 'pending', 'checked': 0, 'available': 0, 'total': len(PO_ALL_SYMBOLS), 'duration': None}
     
     def setup_handlers(self):
         """Регистрация всех обработчиков бота"""
@@ -722,6 +2960,7 @@ class TelegramBot:
         self.application.add_handler(CommandHandler('help', self.help_command))
         self.application.add_handler(CommandHandler('upd', self.update_symbols_command))
         self.application.add_handler(CommandHandler('search', self.search_command))
+        self.application.add_handler(CommandHandler('stats', self.stats_command))
         
         # Основной диалог анализа
         conv_handler = ConversationHandler(
@@ -738,19 +2977,25 @@ class TelegramBot:
         self.application.add_handler(conv_handler)
     
     def refresh_symbols(self):
-        available = set()
-        for sym in PO_ALL_SYMBOLS:
-            try:
-                # Пробуем получить хотя бы одну свечу
-                self.analyzer.get_ohlcv_data(sym, '1h', limit=1)
-                available.add(sym)
-            except Exception:
-                continue
-        self.available_symbols = available
+        # Перепроверяются только пары с истёкшим TTL/backoff, остальные берутся из реестра
+        try:
+            self.analyzer.probe_symbols(PO_ALL_SYMBOLS)
+        except Exception as e:
+            logger.error(f"Ошибка при обновлении списка пар: {e}")
+            return
+        self.available_symbols = set(self.analyzer.available_symbols(PO_ALL_SYMBOLS))
+    
+    def _refresh_symbols_in_background(self):
+        """Фоновая перепроверка устаревших пар (не чаще одной одновременно)"""
+        if self.symbols_refresh_task is not None and not self.symbols_refresh_task.done():
+            return
+        if not self.analyzer.availability.stale(PO_ALL_SYMBOLS):
+            return
+        self.symbols_refresh_task = asyncio.create_task(asyncio.to_thread(self.refresh_symbols))
     
     async def update_symbols_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("⏳ Обновляю список доступных пар...")
-        self.refresh_symbols()
+        await asyncio.to_thread(self.refresh_symbols)
         if not self.available_symbols:
             await update.message.reply_text("❌ Не удалось определить доступные пары сейчас. Попробуйте позже.")
             return
@@ -758,12 +3003,41 @@ class TelegramBot:
         text = "✅ Доступные пары (по данным источников):\n" + ", ".join(lst)
         await update.message.reply_text(text[:4000])
 
+    async def stats_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Команда /stats [пара] [таймфрейм] — точность проверенных прогнозов"""
+        args = list(context.args or [])
+        timeframe = args.pop().lower() if args and re.fullmatch(r'\d+[mhdMHD]', args[-1]) else None
+        symbol = None
+        if args:
+            wanted = _normalize_pair_text(args[0])
+            symbol = next((s for s in PO_ALL_SYMBOLS if _normalize_pair_text(s) == wanted), args[0].upper())
+        rows = await asyncio.to_thread(self.ledger.stats, symbol, timeframe)
+        if not rows:
+            await update.message.reply_text("📊 Проверенных прогнозов пока нет.")
+            return
+        await update.message.reply_text(self.format_stats(rows)[:4000])
+    
+    @staticmethod
+    def format_stats(rows: List[Dict], limit: int = 20) -> str:
+        wins = sum(row['wins'] for row in rows)
+        total = sum(row['total'] for row in rows)
+        text = f"📊 Статистика прогнозов\n\nВсего: {total} (✅ {wins} / ❌ {total - wins}), точность {wins / total:.0%}\n\n"
+        max_bucket = FORECAST_CONFIG['stats_max_bucket']
+        for row in rows[:limit]:
+            bucket = f"≥{row['bucket']}" if row['bucket'] >= max_bucket else str(row['bucket'])
+            text += (f"• {row['symbol']} {row['timeframe']} {row['trade_type']} |балл| {bucket}: "
+                     f"{row['wins']}/{row['total']} ({row['win_rate']:.0%}), последние {row['recent_win_rate']:.0%}, "
+                     f"пункты +{row['avg_win_points']:.1f}/-{row['avg_loss_points']:.1f}\n")
+        if len(rows) > limit:
+            text += f"… и ещё {len(rows) - limit} групп\n"
+        return text
+    
     async def search_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Команда для поиска лучшего прогноза среди всех пар"""
-        await update.message.reply_text("🔍 Поиск лучшего прогноза среди всех пар...\n\n⏳ Обновление списка доступных пар...")
+        await update.message.reply_text("🔍 Поиск лучшего прогноза среди всех пар...")
         
-        # Сначала обновляем список символов
-        self.refresh_symbols()
+        # Поиск идёт по последнему известному списку; устаревшие пары перепроверяются в фоне
+        self._refresh_symbols_in_background()
         
         if not self.available_symbols:
             await update.message.reply_text("❌ Не удалось найти доступные пары для анализа.")
@@ -799,34 +3073,65 @@ class TelegramBot:
         analyzed_count = 0
         successful_count = 0
         
-        # Анализируем каждую пару на разных таймфреймах
-        timeframes = ['1m', '5m', '15m', '30m', '1h', '4h', '1d']
+        # Свечи грузятся по каждой паре (параллельность загрузок ограничена семафором),
+        # индикаторы каждого таймфрейма считаются одним панельным расчётом по успевшим парам.
+        # Общий дедлайн действует на загрузку каждой пары: медленная пара выпадает одна,
+        # не унося с собой весь таймфрейм
+        symbols = sorted(self.available_symbols)
+        timeframes = SCAN_CONFIG['timeframes']
+        semaphore = asyncio.Semaphore(SCAN_CONFIG['concurrency'])
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        deadline = started + SCAN_CONFIG['deadline']
         
-        for symbol in list(self.available_symbols)[:10]:  # Ограничиваем для тестирования
-            for timeframe in timeframes:
-                try:
-                    analyzed_count += 1
-                    # Выполняем анализ
-                    result = await self.perform_analysis(symbol, timeframe, "Forex")
-                    
-                    if result and result.get('signal'):
+        async def _fetch(symbol: str, timeframe: str) -> pd.DataFrame:
+            async with semaphore:
+                return await self.analyzer.get_ohlcv_data_async(symbol, timeframe)
+        
+        async def _analyze(timeframe: str):
+            fetches = {asyncio.create_task(_fetch(symbol, timeframe)): symbol for symbol in symbols}
+            try:
+                done, late = await asyncio.wait(fetches, timeout=max(deadline - loop.time(), 0))
+            finally:
+                for task in fetches:
+                    task.cancel()
+            if late:
+                logger.warning(f"Поиск {timeframe}: по таймауту пропущено {len(late)} пар: "
+                               f"{', '.join(sorted(fetches[t] for t in late))}")
+            frames = {}
+            for task in done:
+                if task.exception() is not None:
+                    logger.warning(f"Загрузка {fetches[task]} {timeframe} не удалась: {task.exception()}")
+                elif len(task.result()) >= 50:
+                    frames[fetches[task]] = task.result()
+            try:
+                results = await asyncio.to_thread(self.analyzer.analyze_panel, frames, "Forex") if frames else {}
+            except Exception as e:
+                logger.error(f"Ошибка анализа таймфрейма {timeframe}: {e}")
+                results = {}
+            return timeframe, results, len(done)
+        
+        pending = {asyncio.create_task(_analyze(tf)) for tf in timeframes}
+        try:
+            # Результаты ранжируются по мере готовности таймфреймов
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    timeframe, results, fetched = task.result()
+                    analyzed_count += fetched
+                    for symbol, result in results.items():
+                        if not result or not result.get('signal'):
+                            continue
                         successful_count += 1
                         prediction = result['signal']
-                        
-                        # Рассчитываем общий балл уверенности
                         confidence = result.get('confidence', 0)
-                        score = result.get('total_score', 0)
-                        
-                        # Комбинированный балл: уверенность + общий балл
-                        combined_score = confidence + (score * 0.1)
-                        
-                        # Логируем для отладки
-                        logger.info(f"Анализ {symbol} {timeframe}: {prediction}, confidence={confidence}, score={score}, combined={combined_score}")
-                        
-                        # Выбираем лучший прогноз (только не нейтральные)
+                        score = result.get('score', 0)
+                        # Комбинированный балл: уверенность + сила сигнала (в любую сторону)
+                        combined_score = confidence + (abs(score) * 0.1)
+                        # Бонус за четкий (не нейтральный) прогноз
                         if "НЕЙТРАЛЬНО" not in prediction:
-                            combined_score += 5  # Бонус за четкий прогноз
-                        
+                            combined_score += 5
+                        logger.info(f"Анализ {symbol} {timeframe}: {prediction}, confidence={confidence}, score={score}, combined={combined_score}")
                         if combined_score > best_score:
                             best_score = combined_score
                             best_prediction = {
@@ -835,16 +3140,16 @@ class TelegramBot:
                                 'prediction': prediction,
                                 'confidence': confidence,
                                 'current_price': result.get('current_price', 'N/A'),
-                                'justification': result.get('justification', ''),
+                                'justification': "\n".join(f"• {s}" for s in result.get('signals', [])),
                                 'total_score': score,
                                 'combined_score': combined_score
                             }
-                            
-                except Exception as e:
-                    logger.error(f"Ошибка анализа {symbol} {timeframe}: {e}")
-                    continue
+        finally:
+            for task in pending:
+                task.cancel()
         
-        logger.info(f"Проанализировано {analyzed_count} комбинаций, успешно {successful_count}, лучший балл: {best_score}")
+        logger.info(f"Проанализировано {analyzed_count} комбинаций за {loop.time() - started:.1f} с, "
+                    f"успешно {successful_count}, лучший балл: {best_score}")
         return best_prediction
     
     def _build_symbols_keyboard(self, trade_type_text: str) -> InlineKeyboardMarkup:
@@ -984,7 +3289,7 @@ class TelegramBot:
             if prev_task and not prev_task.done():
                 prev_task.cancel()
             # Запускаем новую задачу анализа
-            analysis_task = asyncio.create_task(self.perform_analysis(symbol, timeframe, context.user_data.get('trade_type')))
+            analysis_task = asyncio.create_task(self.analyze_coalesced(symbol, timeframe, context.user_data.get('trade_type')))
             self.analysis_tasks[user_id] = analysis_task
             result = await analysis_task
             
@@ -997,23 +3302,27 @@ class TelegramBot:
             
             # Если прогноз не нейтральный — сохраняем прогноз и тексты для переключения
             if not is_neutral:
-                forecast_id = f"{symbol}_{timeframe}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+                # id включает пользователя: прогнозы разных пользователей в одну секунду не пересекаются
+                forecast_id = f"{symbol}_{timeframe}_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{update.effective_user.id}"
                 # Формируем краткую сводку и клавиатуру
                 summary_text, reply_markup = self.format_analysis_result(symbol, timeframe, result, trade_type, forecast_id, details)
-                self.forecasts[forecast_id] = {
+                created_at = time.time()
+                # Полная запись уходит в журнал, в памяти остаётся только компактная
+                self.forecasts[forecast_id] = self.ledger.add(forecast_id, {
                     'symbol': symbol,
                     'timeframe': timeframe,
                     'trade_type': trade_type,
                     'prediction': result['signal'],
                     'score': result['score'],
                     'current_price': result['current_price'],
-                    'timestamp': datetime.now(),
                     'user_id': update.effective_user.id,
                     'chat_id': update.effective_chat.id,
                     'message_id': query.message.message_id,
+                    'created_at': created_at,
+                    'expires_at': created_at + self._timeframe_to_seconds(timeframe),
                     'details': details,
                     'summary': summary_text
-                }
+                })
                 await query.edit_message_text(summary_text, parse_mode='Markdown', reply_markup=reply_markup)
                 # Автопроверка только для не нейтральных
                 await self.schedule_forecast_check(forecast_id, timeframe, update.effective_user.id)
@@ -1050,83 +3359,80 @@ class TelegramBot:
         # Конвертируем таймфрейм в секунды
         timeframe_seconds = self._timeframe_to_seconds(timeframe)
         
-        # Создаем задачу для проверки
-        task = asyncio.create_task(self.check_forecast_after_time(forecast_id, timeframe_seconds))
-        self.check_tasks[forecast_id] = task
+        # Срок ставится в общий планировщик — отдельная задача на прогноз не создаётся
+        forecast = self.forecasts.get(forecast_id)
+        if forecast is not None and forecast.get('expires_at'):
+            expires_at = forecast['expires_at']
+        else:
+            expires_at = time.time() + timeframe_seconds
+        self.forecast_scheduler.schedule(forecast_id, expires_at)
         
-        logger.info(f"Запланирована проверка прогноза {forecast_id} через {timeframe}")
+        logger.info(f"Запланирована проверка прогноза {forecast_id} через {timeframe} "
+                    f"(в очереди {self.forecast_scheduler.depth})")
     
-    async def check_forecast_after_time(self, forecast_id: str, delay_seconds: int):
-        """Проверка прогноза через заданное время"""
-        try:
-            # Ждем указанное время
-            await asyncio.sleep(delay_seconds)
-            
-            # Получаем прогноз
-            forecast = self.forecasts.get(forecast_id)
+    def cancel_forecast_check(self, forecast_id: str) -> bool:
+        """Отмена автоматической проверки прогноза"""
+        self.forecasts.pop(forecast_id, None)
+        self.ledger.cancel(forecast_id)
+        return self.forecast_scheduler.cancel(forecast_id)
+    
+    async def resolve_forecasts(self, forecast_ids: List[str]):
+        """Проверка пачки истёкших прогнозов: прогнозы группируются по (пара, таймфрейм),
+        цена берётся одна на группу, результаты рассылаются каждому.
+        Цена общая только внутри пачки: она загружается после истечения всех прогнозов пачки,
+        а прогнозы следующих пачек проверяются по собственной, более поздней загрузке"""
+        stats = self.forecast_scheduler.stats()
+        groups = {}
+        for forecast_id in forecast_ids:
+            # Прогноз удаляется из хранилища до проверки, чтобы ошибка не оставляла его навсегда
+            forecast = self.forecasts.pop(forecast_id, None)
             if not forecast:
-                return
-            
-            # Проверяем результат
-            result = await self.check_forecast_result(forecast)
-            
-            # Отправляем результат пользователю
-            await self.send_forecast_result(forecast, result)
-            
-            # Удаляем прогноз из хранилища
-            if forecast_id in self.forecasts:
-                del self.forecasts[forecast_id]
-            if forecast_id in self.check_tasks:
-                del self.check_tasks[forecast_id]
-                
-        except Exception as e:
-            logger.error(f"Ошибка при проверке прогноза {forecast_id}: {e}")
+                continue
+            groups.setdefault((forecast['symbol'], forecast['timeframe']), []).append(forecast)
+        logger.info(f"Проверка {len(forecast_ids)} прогнозов в {len(groups)} группах: "
+                    f"очередь {stats['depth']}, задержка {stats['last_lag']} с")
+        
+        async def _resolve_group(symbol: str, timeframe: str, forecasts: List[Dict]):
+            try:
+                close_price = await self._fetch_resolution_price(symbol, timeframe)
+            except Exception as e:
+                logger.error(f"Ошибка при получении цены для проверки {symbol} {timeframe}: {e}")
+                close_price = None
+            results = [self._evaluate_forecast(forecast, close_price) for forecast in forecasts]
+            for forecast, result in zip(forecasts, results):
+                self.ledger.resolve(forecast['id'], result)
+                self.ledger.record_outcome(forecast, result)
+            await asyncio.gather(*(
+                self.send_forecast_result(forecast, result) for forecast, result in zip(forecasts, results)
+            ))
+        
+        await asyncio.gather(*(
+            _resolve_group(symbol, timeframe, forecasts)
+            for (symbol, timeframe), forecasts in groups.items()
+        ))
+    
+    async def _fetch_resolution_price(self, symbol: str, timeframe: str) -> float:
+        """Цена закрытия последней валидной свечи на момент проверки.
+        Кэш не используется: запись открытой свечи могла остаться от анализа до истечения"""
+        current_df = await self.analyzer.get_ohlcv_data_async(symbol, timeframe, limit=5, fresh=True)
+        current_df = current_df.dropna()
+        if current_df.empty:
+            raise Exception("Нет валидных данных для проверки")
+        return float(current_df['close'].iloc[-1])
     
     async def check_forecast_result(self, forecast: Dict) -> Dict:
-        """Проверка результата прогноза"""
+        """Проверка результата одного прогноза"""
         try:
-            # Получаем текущие данные (последняя валидная свеча на момент проверки)
-            current_df = self.analyzer.get_ohlcv_data(forecast['symbol'], forecast['timeframe'], limit=5)
-            current_df = current_df.dropna()
-            if current_df.empty:
-                raise Exception("Нет валидных данных для проверки")
-            current_close = current_df['close'].iloc[-1]
-            
-            # Цена открытия из момента прогноза
-            open_price = float(forecast['current_price'])
-            close_price = float(current_close)
-            
-            # Единые правила пунктов без исключений: вычисляем динамически по масштабу цены
-            # Если цена крупная (>= 20), шаг пункта 0.01, иначе 0.0001 (универсально и просто)
-            pip_size = 0.01 if max(open_price, close_price) >= 20 else 0.0001
-            points_abs = abs(close_price - open_price) / pip_size
-            
-            # Определение результата согласно направлению
-            direction_up = "ВВЕРХ" in (forecast['prediction'] or "")
-            direction_down = "ВНИЗ" in (forecast['prediction'] or "")
-            went_up = close_price > open_price
-            
-            if direction_up:
-                prediction_correct = went_up
-            elif direction_down:
-                prediction_correct = not went_up
-            else:
-                # Нейтральный прогноз не оцениваем как плюс/минус
-                prediction_correct = False
-            
-            result = "✅ ПЛЮС" if prediction_correct else ("❌ МИНУС" if (direction_up or direction_down) else "➡️ НЕЙТРАЛЬНО")
-            
-            return {
-                'result': result,
-                'open_price': open_price,
-                'close_price': close_price,
-                'points': round(points_abs, 2),
-                'prediction_correct': prediction_correct
-            }
-            
+            close_price = await self._fetch_resolution_price(forecast['symbol'], forecast['timeframe'])
         except Exception as e:
             logger.error(f"Ошибка при проверке прогноза: {e}")
-            # Возвращаем мягкий результат без падения
+            close_price = None
+        return self._evaluate_forecast(forecast, close_price)
+    
+    @staticmethod
+    def _evaluate_forecast(forecast: Dict, close_price: Optional[float]) -> Dict:
+        """Оценка прогноза по цене закрытия; без цены возвращается мягкий результат"""
+        if close_price is None:
             return {
                 'result': "⚠️ НЕТ ДАННЫХ",
                 'open_price': forecast.get('current_price', None),
@@ -1134,6 +3440,38 @@ class TelegramBot:
                 'points': 0,
                 'prediction_correct': False
             }
+        
+        # Цена открытия из момента прогноза
+        open_price = float(forecast['current_price'])
+        close_price = float(close_price)
+        
+        # Единые правила пунктов без исключений: вычисляем динамически по масштабу цены
+        # Если цена крупная (>= 20), шаг пункта 0.01, иначе 0.0001 (универсально и просто)
+        pip_size = 0.01 if max(open_price, close_price) >= 20 else 0.0001
+        points_abs = abs(close_price - open_price) / pip_size
+        
+        # Определение результата согласно направлению
+        direction_up = "ВВЕРХ" in (forecast['prediction'] or "")
+        direction_down = "ВНИЗ" in (forecast['prediction'] or "")
+        went_up = close_price > open_price
+        
+        if direction_up:
+            prediction_correct = went_up
+        elif direction_down:
+            prediction_correct = not went_up
+        else:
+            # Нейтральный прогноз не оцениваем как плюс/минус
+            prediction_correct = False
+        
+        result = "✅ ПЛЮС" if prediction_correct else ("❌ МИНУС" if (direction_up or direction_down) else "➡️ НЕЙТРАЛЬНО")
+        
+        return {
+            'result': result,
+            'open_price': open_price,
+            'close_price': close_price,
+            'points': round(points_abs, 2),
+            'prediction_correct': prediction_correct
+        }
     
     async def send_forecast_result(self, forecast: Dict, result: Dict):
         """Отправка результата прогноза пользователю"""
@@ -1235,15 +3573,61 @@ class TelegramBot:
         except:
             return None
     
+    async def analyze_coalesced(self, symbol: str, timeframe: str, trade_type: Optional[str] = None) -> Dict:
+        """Анализ с объединением одинаковых запросов: одновременные вызовы в пределах свечи ждут
+        одно вычисление, поздние получают сохранённый результат. Отмена ожидающего пользователя
+        не прерывает общее вычисление (asyncio.shield)"""
+        period = self._timeframe_to_seconds(timeframe)
+        now = time.time()
+        key = (symbol, timeframe, trade_type, int(now // period) * period)
+        task = self.analysis_flights.get(key)
+        if task is None:
+            # Результаты завершившихся свечей больше не нужны
+            for stale in [k for k in self.analysis_flights if k[3] + self._timeframe_to_seconds(k[1]) <= now]:
+                del self.analysis_flights[stale]
+            task = asyncio.create_task(self.perform_analysis(symbol, timeframe, trade_type))
+            self.analysis_flights[key] = task
+            task.add_done_callback(lambda t: self._forget_failed_flight(key, t))
+        else:
+            logger.info(f"Анализ {symbol} на {timeframe} объединён с уже запущенным для этой свечи")
+        result = await asyncio.shield(task)
+        # Каждый вызывающий получает свою копию общего результата
+        return copy.deepcopy(result)
+    
+    def _forget_failed_flight(self, key: Tuple, task: asyncio.Task):
+        """Ошибка или отмена не запоминаются: следующий запрос запустит анализ заново"""
+        if (task.cancelled() or task.exception() is not None) and self.analysis_flights.get(key) is task:
+            del self.analysis_flights[key]
+    
     async def perform_analysis(self, symbol: str, timeframe: str, trade_type: Optional[str] = None) -> Dict:
         """Выполнение технического анализа"""
         try:
-            # Получаем данные с таймаутом
+            # Получаем данные с таймаутом (асинхронно, без занятия потока)
             df = await asyncio.wait_for(
-                asyncio.to_thread(self.analyzer.get_ohlcv_data, symbol, timeframe),
+                self.analyzer.get_ohlcv_data_async(symbol, timeframe),
                 timeout=30.0  # 30 секунд таймаут
             )
             
+            mode = ANALYSIS_CONFIG['mode']
+            if mode == 'streaming':
+                # Потоковые индикаторы: пересчитываются только новые свечи
+                analysis_result = await asyncio.wait_for(
+                    asyncio.to_thread(self.analyzer.analyze_streaming, symbol, timeframe, df, trade_type),
+                    timeout=15.0  # 15 секунд таймаут
+                )
+                return analysis_result
+            
+            if mode == 'tail':
+                # Индикаторы только по хвосту истории, нужному для последней свечи
+                analysis_result = await asyncio.wait_for(
+                    asyncio.to_thread(self.analyzer.analyze_latest, df, trade_type),
+                    timeout=15.0  # 15 секунд таймаут
+                )
+                return analysis_result
+            
+            if mode != 'full':
+                raise ValueError(f"Неизвестный режим анализа: {mode}")
+            
             # Рассчитываем индикаторы с таймаутом
             indicators = await asyncio.wait_for(
                 asyncio.to_thread(self.analyzer.calculate_indicators, df),
@@ -1291,7 +3675,8 @@ class TelegramBot:
         query = update.callback_query
         await query.answer()
         forecast_id = query.data.split(':')[1] if ':' in query.data else None
-        forecast = self.forecasts.get(forecast_id)
+        # Тексты хранятся только в журнале и читаются по запросу
+        forecast = await asyncio.to_thread(self.ledger.get, forecast_id) if forecast_id else None
         if not forecast:
             await query.answer("Детали недоступны", show_alert=True)
             return
@@ -1306,7 +3691,7 @@ class TelegramBot:
         query = update.callback_query
         await query.answer()
         forecast_id = query.data.split(':')[1] if ':' in query.data else None
-        forecast = self.forecasts.get(forecast_id)
+        forecast = await asyncio.to_thread(self.ledger.get, forecast_id) if forecast_id else None
         if not forecast:
             await query.answer("Нет данных", show_alert=True)
             return
@@ -1376,23 +3761,16 @@ class TelegramBot:
         return ConversationHandler.END
     
     async def check_symbols_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        all_symbols = [
-            'EUR/USD', 'GBP/USD', 'USD/JPY', 'AUD/USD', 'NZD/USD', 'USD/CAD', 'USD/CHF',
-            'AUD/JPY', 'EUR/JPY', 'GBP/JPY', 'CAD/JPY', 'CHF/JPY', 'EUR/GBP', 'AUD/CAD',
-            'NZD/JPY', 'EURAUD', 'GBPAUD', 'AUDNZD', 'EURNZD', 'GBPNZD', 'GBPCHF', 'EURCHF', 'AUDCHF', 'CADCHF', 'NZDCHF',
-            'BTC/USDT', 'ETH/USDT'
-        ]
-        available = []
-        unavailable = []
-        for symbol in all_symbols:
-            try:
-                self.analyzer.get_ohlcv_data(symbol, '1h', limit=1)
-                available.append(symbol)
-            except Exception as e:
-                unavailable.append(f"{symbol} ({str(e)[:40]})")
+        await asyncio.to_thread(self.refresh_symbols)
+        availability = self.analyzer.availability
+        available = [s for s in PO_ALL_SYMBOLS if availability.status(s)]
+        unavailable = [s for s in PO_ALL_SYMBOLS if availability.status(s) is False]
         msg = f"✅ Доступные пары ({len(available)}):\n" + ", ".join(available)
         if unavailable:
-            msg += f"\n\n❌ Недоступные пары ({len(unavailable)}):\n" + "\n".join(unavailable)
+            msg += f"\n\n❌ Недоступные пары ({len(unavailable)}):\n" + "\n".join(
+                f"{s} ({(availability.reason(s) or 'нет данных')[:40]}; повтор через {availability.retry_in(s):.0f} с)"
+                for s in unavailable
+            )
         await update.message.reply_text(msg[:4000])
     
     async def help_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -1404,6 +3782,7 @@ class TelegramBot:
             "• /analyze — анализ\n"
             "• /search — найти лучший прогноз среди всех пар\n"
             "• /upd — обновить список доступных пар\n"
+            "• /stats [пара] [таймфрейм] — точность проверенных прогнозов\n"
             "• /cancel — отменить текущий анализ\n\n"
             "Подсказки:\n"
             "— Выберите тип торговли (ОТС/Обычная).\n"
@@ -1439,6 +3818,77 @@ class TelegramBot:
         """Команда /analyze — аналог /start, начинает выбор типа торговли"""
         return await self.start_command(update, context)
     
+    async def on_startup(self, application: Application):
+        """Запуск фонового прогрева и планировщика: polling начинается сразу, не дожидаясь сети"""
+        self.forecast_scheduler.start()
+        await self.restore_forecasts()
+        self.ledger_task = asyncio.create_task(self.maintain_ledger())
+        self.warmup_task = asyncio.create_task(self.warm_up_symbols())
+    
+    async def restore_forecasts(self):
+        """Ожидающие прогнозы из журнала возвращаются в планировщик; просроченные проверятся сразу"""
+        pending = await asyncio.to_thread(self.ledger.pending)
+        for row in pending:
+            self.forecasts[row['id']] = ForecastLedger.compact(row)
+            self.forecast_scheduler.schedule(row['id'], row['expires_at'])
+        if pending:
+            logger.info(f"Восстановлено {len(pending)} ожидающих прогнозов из журнала")
+    
+    async def maintain_ledger(self):
+        """Периодический сброс буфера журнала и очистка старых закрытых прогнозов"""
+        last_purge = 0.0
+        while True:
+            await asyncio.sleep(FORECAST_CONFIG['flush_interval'])
+            try:
+                await asyncio.to_thread(self.ledger.flush)
+                if time.time() - last_purge >= FORECAST_CONFIG['purge_interval']:
+                    last_purge = time.time()
+                    cutoff = last_purge - FORECAST_CONFIG['retention_days'] * 86400
+                    purged = await asyncio.to_thread(self.ledger.purge, cutoff)
+                    if purged:
+                        logger.info(f"Журнал прогнозов: удалено {purged} старых записей")
+            except Exception as e:
+                logger.error(f"Ошибка записи журнала прогнозов: {e}")
+    
+    async def warm_up_symbols(self):
+        """Проверка доступности пар частями в фоне с логированием прогресса и длительности"""
+        started = time.monotonic()
+        chunk_size = DATA_CONFIG['warmup_chunk_size']
+        available = set()
+        self.warmup_stats.update(state='running', checked=0, available=0)
+        logger.info(f"Прогрев: проверка {len(PO_ALL_SYMBOLS)} пар в фоне")
+        try:
+            for i in range(0, len(PO_ALL_SYMBOLS), chunk_size):
+                chunk = PO_ALL_SYMBOLS[i:i + chunk_size]
+                await asyncio.to_thread(self.analyzer.probe_symbols, chunk)
+                available.update(s for s in chunk if self.analyzer.availability.status(s))
+                self.warmup_stats.update(checked=min(i + chunk_size, len(PO_ALL_SYMBOLS)), available=len(available))
+                logger.info(f"Прогрев: проверено {self.warmup_stats['checked']}/{len(PO_ALL_SYMBOLS)}, "
+                            f"доступно {len(available)} ({time.monotonic() - started:.1f} с)")
+        except asyncio.CancelledError:
+            self.warmup_stats.update(state='cancelled', duration=round(time.monotonic() - started, 2))
+            raise
+        # Если источники недоступны целиком, оставляем статический список
+        known = set(self.analyzer.available_symbols(PO_ALL_SYMBOLS))
+        if known:
+            self.available_symbols = known
+        self.warmup_stats.update(state='done', duration=round(time.monotonic() - started, 2))
+        logger.info(f"Прогрев завершён за {self.warmup_stats['duration']} с: доступно {len(available)} "
+                    f"из {len(PO_ALL_SYMBOLS)} пар")
+    
+    async def on_shutdown(self, application: Application):
+        """Освобождение сетевых ресурсов при остановке бота"""
+        if self.warmup_task is not None and not self.warmup_task.done():
+            self.warmup_task.cancel()
+        await self.forecast_scheduler.stop()
+        for task in self.analysis_flights.values():
+            task.cancel()
+        if self.ledger_task is not None and not self.ledger_task.done():
+            self.ledger_task.cancel()
+        await asyncio.to_thread(self.ledger.close)
+        self.analyzer.market_index.stop()
+        await self.analyzer.close_async()
+    
     def run(self):
         """Запуск бота"""
         logger.info("Бот запущен")
@@ -73,7 +73,8 @@ def check_environment():
         'MACD_FAST': '12',
         'MACD_SLOW': '26',
         'MACD_SIGNAL': '9',
-        'STOCH_PERIOD': '14'
+        'STOCH_PERIOD': '14',
+        'DATA_PROVIDER': 'live'
     }
     
     for var, default_value in optional_vars.items():
@@ -96,12 +97,20 @@ def main():
     
     try:
         # Импортируем и запускаем бота
-        from main import TelegramBot
+        from main import TelegramBot, create_data_provider
         
         logger.info("✅ Все проверки пройдены успешно")
+        
+        # Источник рыночных данных: live, record (live с записью ответов) или replay (без сети)
+        provider_mode = os.getenv('DATA_PROVIDER', 'live')
+        provider_dir = os.getenv('DATA_PROVIDER_DIR', 'recordings')
+        provider_latency = float(os.getenv('DATA_PROVIDER_LATENCY_MS', '0')) / 1000
+        provider = create_data_provider(provider_mode, provider_dir, provider_latency)
+        logger.info(f"📡 Провайдер данных: {provider_mode} ({provider_dir})")
+        
         logger.info("🤖 Инициализация Telegram бота...")
         
-        bot = TelegramBot()
+        bot = TelegramBot(provider)
         logger.info("🚀 Бот запущен и готов к работе")
         
         # Запускаем бота
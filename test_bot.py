@@ -4,10 +4,53 @@
 Позволяет протестировать основные функции без запуска Telegram бота
 """
 
+import os
+import time
 import asyncio
+import threading
+import tempfile
 import pandas as pd
 import numpy as np
-from main import TechnicalAnalyzer, INDICATOR_CONFIG, SIGNAL_THRESHOLDS
+from main import TechnicalAnalyzer, TelegramBot, OHLCVCache, ForecastScheduler, ForecastLedger, SymbolAvailability, CandleStore, MarketDataProvider, RecordingDataProvider, ReplayDataProvider, plan_indicators, indicator_lookback, CrossRateEngine, _rolling_mean_abs_dev, _split_yf_download, INDICATOR_CONFIG, SIGNAL_THRESHOLDS, ANALYSIS_CONFIG, SCAN_CONFIG
+
+class SyntheticProvider(MarketDataProvider):
+    """Провайдер без сети: минутные свечи BTCUSDT, заканчивающиеся текущей минутой"""
+    
+    def __init__(self, rows: int = 2001, period_ms: int = 60_000):
+        end = int(time.time() * 1000) // period_ms * period_ms
+        self.rows = [[end - (rows - 1 - i) * period_ms, 1.0 + i, 2.0 + i, 0.5 + i, 1.5 + i, 1.0] for i in range(rows)]
+        self.calls = []
+    
+    def load_markets(self, reload=False):
+        return {'BTCUSDT': {}}
+    
+    def fetch_ohlcv(self, symbol, timeframe, since=None, limit=None):
+        self.calls.append((since, limit))
+        if since is None:
+            return self.rows[-limit:]
+        return [row for row in self.rows if row[0] >= since][:limit]
+    
+    async def fetch_ohlcv_async(self, symbol, timeframe, since=None, limit=None):
+        return self.fetch_ohlcv(symbol, timeframe, since, limit)
+    
+    def yf_download(self, tickers, **kwargs):
+        return pd.DataFrame()
+    
+    async def yahoo_chart(self, ticker, params):
+        return {}
+
+def make_ohlcv(n: int, seed: int, freq: str = '1min') -> pd.DataFrame:
+    """Синтетические OHLCV: логнормальное случайное блуждание, high/low вокруг тела свечи"""
+    rng = np.random.RandomState(seed)
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.002, n)))
+    open_ = np.r_[close[0], close[:-1]]
+    return pd.DataFrame({
+        'open': open_,
+        'high': np.maximum(open_, close) * (1 + np.abs(rng.normal(0, 0.001, n))),
+        'low': np.minimum(open_, close) * (1 - np.abs(rng.normal(0, 0.001, n))),
+        'close': close,
+        'volume': rng.randint(1000, 10000, n).astype(float)
+    }, index=pd.date_range('2024-01-01', periods=n, freq=freq))
 
 def test_technical_analyzer():
     """Тестирование технического анализа"""
@@ -105,6 +148,596 @@ def test_symbol_formatting():
     
     print("✅ Форматирование символов работает корректно")
 
+def test_ohlcv_cache():
+    """Тестирование кэша OHLCV"""
+    print("\n🗄️ Тестирование кэша OHLCV...")
+    
+    cache = OHLCVCache(max_entries=2)
+    df = pd.DataFrame({'close': [1.0, 2.0]})
+    
+    assert cache.get(('yahoo', 'EURUSD=X', '1m', 200)) is None
+    cache.put(('yahoo', 'EURUSD=X', '1m', 200), df, 3600)
+    assert cache.get(('yahoo', 'EURUSD=X', '1m', 200)) is df
+    
+    # LRU: при переполнении вытесняется самая давно использованная запись
+    cache.put(('yahoo', 'GBPUSD=X', '1m', 200), df, 3600)
+    cache.get(('yahoo', 'EURUSD=X', '1m', 200))
+    cache.put(('yahoo', 'USDJPY=X', '1m', 200), df, 3600)
+    assert cache.get(('yahoo', 'GBPUSD=X', '1m', 200)) is None
+    assert cache.get(('yahoo', 'EURUSD=X', '1m', 200)) is df
+    
+    stats = cache.stats()
+    print(f"   • {stats}")
+    assert stats['size'] == 2 and stats['hits'] == 3 and stats['misses'] == 2
+    
+    # Проверка прогноза берёт свежую цену мимо кэша и обновляет его
+    source = SyntheticProvider(rows=300)
+    analyzer = TechnicalAnalyzer(source)
+    analyzer.market_index.refresh()
+    asyncio.run(analyzer.get_ohlcv_data_async('BTC/USDT', '1m', limit=5))
+    asyncio.run(analyzer.get_ohlcv_data_async('BTC/USDT', '1m', limit=5))
+    assert len(source.calls) == 1
+    asyncio.run(analyzer.get_ohlcv_data_async('BTC/USDT', '1m', limit=5, fresh=True))
+    assert len(source.calls) == 2 and analyzer.ohlcv_cache.stats()['hits'] == 1
+    print("✅ Кэш OHLCV работает корректно")
+
+def test_cci_mad():
+    """Сравнение векторного MAD для CCI с прежним rolling().apply"""
+    print("\n📐 Тестирование векторного MAD для CCI...")
+    
+    np.random.seed(7)
+    typical_price = pd.Series(100 + np.random.randn(1000).cumsum())
+    typical_price.iloc[[0, 1, 500]] = np.nan
+    window = INDICATOR_CONFIG['cci_period']
+    
+    expected = typical_price.rolling(window=window).apply(lambda x: np.mean(np.abs(x - x.mean())))
+    actual = _rolling_mean_abs_dev(typical_price.to_numpy(), window)
+    
+    assert np.array_equal(np.isnan(expected.to_numpy()), np.isnan(actual))
+    assert np.allclose(expected.to_numpy(), actual, rtol=1e-12, atol=0, equal_nan=True)
+    assert np.isnan(_rolling_mean_abs_dev(np.arange(5.0), window)).all()
+    print("✅ Векторный MAD совпадает с rolling().apply")
+
+def test_streaming_indicators():
+    """Сравнение потокового анализа с полным пересчётом индикаторов"""
+    print("\n🌊 Тестирование потоковых индикаторов...")
+    
+    n = 300
+    df = make_ohlcv(n, seed=11)
+    
+    analyzer = TechnicalAnalyzer()
+    # Первый вызов строит состояние, второй — догружает свечи инкрементально
+    analyzer.analyze_streaming('TEST', '1m', df.iloc[:250])
+    for end in (260, n):
+        frame = df.iloc[:end]
+        expected = analyzer.analyze_signals(frame, analyzer.calculate_indicators(frame))
+        actual = analyzer.analyze_streaming('TEST', '1m', frame)
+        assert actual['score'] == expected['score'], (actual['score'], expected['score'])
+        assert actual['signals'] == expected['signals']
+        for name, value in expected['values'].items():
+            assert value is None or np.isclose(value, actual['values'][name], rtol=1e-9), name
+    print(f"   • Балл: {actual['score']}, сигнал: {actual['signal']}")
+    print("✅ Потоковые индикаторы совпадают с полным расчётом")
+
+def test_lazy_indicators():
+    """Проверка ленивого расчёта индикаторов: считается только запрошенное и его зависимости"""
+    print("\n💤 Тестирование ленивых индикаторов...")
+    
+    df = make_ohlcv(120, seed=17)
+    
+    indicators = TechnicalAnalyzer().calculate_indicators(df)
+    assert 'stoch_rsi' in indicators and 'unknown' not in indicators
+    stoch_rsi = indicators['stoch_rsi']
+    assert set(name for name in indicators._values if not name.startswith('_')) == {'rsi', 'stoch_rsi'}
+    assert indicators['stoch_rsi'] is stoch_rsi
+    assert len(dict(indicators.items())) == len(indicators)
+    
+    # Общие промежуточные узлы входят в план один раз, глубина истории суммируется по цепочке
+    plan = plan_indicators(['atr', 'adx', 'plus_di'])
+    assert plan.count('_tr') == 1 and plan.index('_tr') < plan.index('atr')
+    plan = plan_indicators(['adx', 'plus_di', 'minus_di'])
+    assert plan.count('_high_diff') == 1 and plan.count('_low_diff') == 1
+    assert plan.index('_high_diff') < plan.index('_plus_dm') and plan.index('_low_diff') < plan.index('_minus_dm')
+    assert indicator_lookback('plus_di') == 1 + INDICATOR_CONFIG['adx_period']
+    assert indicator_lookback('stoch_rsi') == 1 + INDICATOR_CONFIG['rsi_period'] + INDICATOR_CONFIG['stoch_period']
+    print("✅ Индикаторы считаются по требованию")
+
+def test_tail_only_analysis():
+    """Сравнение анализа по хвосту истории с полным расчётом"""
+    print("\n✂️ Тестирование анализа по хвосту истории...")
+    
+    n = 3000
+    df = make_ohlcv(n, seed=19)
+    
+    analyzer = TechnicalAnalyzer()
+    expected = analyzer.analyze_signals(df, analyzer.calculate_indicators(df))
+    actual = analyzer.analyze_latest(df)
+    assert actual['score'] == expected['score'] and actual['signals'] == expected['signals']
+    assert actual['values'] == expected['values']
+    
+    # Каждый режим ANALYSIS_CONFIG['mode'] идёт своим путём и даёт тот же итог
+    bot = TelegramBot.__new__(TelegramBot)
+    bot.analyzer = analyzer
+    
+    async def get_data(symbol, timeframe, limit=200):
+        return df
+    
+    analyzer.get_ohlcv_data_async = get_data
+    mode = ANALYSIS_CONFIG['mode']
+    try:
+        for name in ('streaming', 'tail', 'full'):
+            ANALYSIS_CONFIG['mode'] = name
+            result = asyncio.run(bot.perform_analysis('EUR/USD', '1m'))
+            assert result['score'] == expected['score'], name
+    finally:
+        ANALYSIS_CONFIG['mode'] = mode
+    print("✅ Анализ по хвосту совпадает с полным расчётом")
+
+def test_backtest():
+    """Скоринг истории массивами совпадает с analyze_signals на последней свече"""
+    print("\n📉 Тестирование векторного бэктеста...")
+    
+    n = 1500
+    df = make_ohlcv(n, seed=23)
+    
+    analyzer = TechnicalAnalyzer()
+    for trade_type in (None, 'OTC'):
+        history = analyzer.score_history(df, trade_type)
+        for end in (60, 700, n):
+            frame = df.iloc[:end]
+            expected = analyzer.analyze_signals(frame, analyzer.calculate_indicators(frame), trade_type)
+            assert history['score'].iloc[end - 1] == expected['score'], (end, history['score'].iloc[end - 1], expected['score'])
+            assert history['strength'].iloc[end - 1] == expected['strength']
+    
+    result = analyzer.backtest(df, horizon=3)
+    assert result['trades'] == n - 49 - 3
+    assert sum(bucket['trades'] for bucket in result['by_strength'].values()) == result['trades']
+    print(f"✅ Бэктест: {result['trades']} сделок, hit rate {result['hit_rate']}%")
+
+def test_indicator_panel():
+    """Сравнение панельного расчёта индикаторов с расчётом по каждой паре"""
+    print("\n🧮 Тестирование панельного расчёта индикаторов...")
+    
+    frames = {f'PAIR{i}': make_ohlcv(n, seed=13 + i) for i, n in enumerate((200, 180, 120))}
+    
+    analyzer = TechnicalAnalyzer()
+    results = analyzer.analyze_panel(frames)
+    for symbol, df in frames.items():
+        expected = analyzer.analyze_signals(df, analyzer.calculate_indicators(df))
+        assert results[symbol]['score'] == expected['score'], (symbol, results[symbol]['score'], expected['score'])
+        assert results[symbol]['signals'] == expected['signals']
+    print("✅ Панельный расчёт совпадает с расчётом по парам")
+
+def test_candle_store():
+    """Постоянное хранилище свечей: дозапись без дублей и тёплый старт буферов"""
+    print("\n💾 Тестирование хранилища свечей...")
+    
+    index = pd.date_range('2024-01-01', periods=100, freq='1h', tz='UTC')
+    df = pd.DataFrame(np.random.rand(100, 5), index=index, columns=['open', 'high', 'low', 'close', 'volume'])
+    key = ('yahoo', 'EURUSD=X', '1h')
+    with tempfile.TemporaryDirectory() as directory:
+        store = CandleStore(directory)
+        assert store.append(key, df.iloc[:60], 3600) == 60
+        assert store.append(key, df.iloc[30:], 3600) == 40
+        assert store.append(key, df, 3600) == 0
+        assert store.read(key).equals(df)
+        
+        # Незакрытая свеча не сохраняется
+        live_key = ('binance', 'BTCUSDT', '1m')
+        live_index = pd.date_range(end=pd.Timestamp.now().floor('1min'), periods=5, freq='1min')
+        live = pd.DataFrame(np.random.rand(5, 5), index=live_index, columns=df.columns)
+        assert store.append(live_key, live, 60) == 4
+        
+        # Окно истории через memmap без копирования и с теми же результатами
+        view = store.view(key, index[10], index[89])
+        assert len(view) == 80 and isinstance(view['close'].values, np.memmap)
+        analyzer = TechnicalAnalyzer(candle_store=store)
+        assert analyzer.score_history(view).equals(analyzer.score_history(df.iloc[10:90]))
+        
+        # Новый процесс поднимает буфер из хранилища без сети
+        analyzer = TechnicalAnalyzer(candle_store=CandleStore(directory))
+        assert analyzer._get_buffer(key).equals(df)
+        
+        # Короткий кадр после разрыва не затирает более глубокую историю
+        gapped = df.iloc[-3:].copy()
+        gapped.index = gapped.index + pd.Timedelta(days=30)
+        assert store.append(key, gapped, 3600) == 0 and len(store.read(key)) == 100
+    print("✅ Хранилище свечей работает")
+
+def test_candle_store_gap():
+    """Рестарт после простоя: короткий запрос докачивает разрыв, история хранилища сохраняется"""
+    print("\n🕳️ Тестирование разрыва истории после простоя...")
+    
+    provider = SyntheticProvider()
+    key = ('binance', 'BTCUSDT', '1m')
+    with tempfile.TemporaryDirectory() as directory:
+        # Хранилище из прошлого запуска: 1000 свечей, обрывающихся 30 минут назад
+        history = provider.rows[-1031:-31]
+        frame = pd.DataFrame([row[1:] for row in history], columns=['open', 'high', 'low', 'close', 'volume'],
+                             index=pd.to_datetime([row[0] for row in history], unit='ms'))
+        assert CandleStore(directory).append(key, frame, 60) == 1000
+        
+        analyzer = TechnicalAnalyzer(provider, CandleStore(directory))
+        analyzer.market_index.refresh()
+        df = analyzer.get_ohlcv_data('BTC/USDT', '1m', limit=5)
+        assert len(df) == 5 and df['close'].iloc[-1] == provider.rows[-1][4]
+        # Разрыв докачан одной страницей с конца истории, без полной перезагрузки
+        assert all(since is not None for since, _ in provider.calls)
+        stored = analyzer.candle_store.read(key)
+        assert len(stored) >= 1030 and stored.index[0] == frame.index[0]
+        
+        # Асинхронный путь обращается к хранилищу только из рабочих потоков
+        class ThreadRecordingStore(CandleStore):
+            threads = []
+            
+            def read(self, *args, **kwargs):
+                self.threads.append(threading.get_ident())
+                return super().read(*args, **kwargs)
+            
+            def append(self, *args, **kwargs):
+                self.threads.append(threading.get_ident())
+                return super().append(*args, **kwargs)
+        
+        analyzer = TechnicalAnalyzer(provider, ThreadRecordingStore(directory))
+        analyzer.market_index.refresh()
+        df = asyncio.run(analyzer.get_ohlcv_data_async('BTC/USDT', '1m', limit=5))
+        assert df['close'].iloc[-1] == provider.rows[-1][4]
+        assert len(ThreadRecordingStore.threads) == 2 and threading.get_ident() not in ThreadRecordingStore.threads
+    print(f"✅ Разрыв докачан: в хранилище {len(stored)} свечей")
+
+def test_replay_provider():
+    """Запись ответов провайдера и их воспроизведение без сети"""
+    print("\n📼 Тестирование записи и воспроизведения данных...")
+    
+    # Неполный провайдер не создаётся
+    class PartialProvider(MarketDataProvider):
+        def load_markets(self, reload=False):
+            return {}
+    try:
+        PartialProvider()
+        assert False, "ожидалась ошибка неполного провайдера"
+    except TypeError:
+        pass
+    
+    source = SyntheticProvider(rows=300)
+    with tempfile.TemporaryDirectory() as directory:
+        recorder = TechnicalAnalyzer(RecordingDataProvider(source, directory))
+        recorder.market_index.refresh()
+        recorded = recorder.get_ohlcv_data('BTC/USDT', '1m', limit=200)
+        # Докачка записывается отдельно и не затирает полную загрузку
+        recorder.ohlcv_cache.clear()
+        recorder.get_ohlcv_data('BTC/USDT', '1m', limit=200)
+        assert source.calls[-1][0] is not None
+        
+        # Отдельный анализатор без хранилища: ответы приходят только из записи
+        player = TechnicalAnalyzer(ReplayDataProvider(directory))
+        assert player.market_index.refresh()
+        replayed = player.get_ohlcv_data('BTC/USDT', '1m', limit=200)
+        assert replayed.equals(recorded) and len(replayed) == 200
+        # Докачка при воспроизведении тоже находит запись
+        player.ohlcv_cache.clear()
+        assert player.get_ohlcv_data('BTC/USDT', '1m', limit=200).equals(recorded)
+        
+        # Запроса, которого не было при записи, нет и при воспроизведении
+        try:
+            player.provider.fetch_ohlcv('ETH/USDT', '1h', limit=60)
+            assert False, "ожидалась ошибка отсутствующей записи"
+        except LookupError:
+            pass
+    print("✅ Воспроизведение совпадает с записью")
+
+def test_split_yf_download():
+    """Разбиение ответа yf.download: колонки по тикерам и плоские колонки одного тикера"""
+    print("\n✂️ Тестирование разбиения ответа Yahoo по тикерам...")
+    
+    index = pd.date_range('2024-01-01', periods=3, freq='1h', tz='UTC')
+    flat = pd.DataFrame({'Open': [1.0, 1.1, np.nan], 'High': [1.2, 1.3, np.nan], 'Low': [0.9, 1.0, np.nan],
+                         'Close': [1.1, 1.2, np.nan], 'Volume': [0, 0, np.nan]}, index=index)
+    # Старые версии yfinance: один тикер без уровня тикеров в колонках
+    frames = _split_yf_download(flat, ['EURUSD=X'])
+    assert list(frames) == ['EURUSD=X'] and len(frames['EURUSD=X']) == 2
+    assert list(frames['EURUSD=X'].columns) == list(flat.columns)
+    
+    grouped = pd.concat({'EURUSD=X': flat, 'GBPUSD=X': flat.iloc[:1]}, axis=1)
+    frames = _split_yf_download(grouped, ['EURUSD=X', 'GBPUSD=X', 'USDJPY=X'])
+    assert len(frames['EURUSD=X']) == 2 and len(frames['GBPUSD=X']) == 1 and frames['USDJPY=X'].empty
+    # Плоские колонки нескольких тикеров не приписываются ни одному из них
+    assert all(frame.empty for frame in _split_yf_download(flat, ['EURUSD=X', 'GBPUSD=X']).values())
+    print("✅ Разбиение: плоский ответ одного тикера и ответ по тикерам разобраны")
+
+def test_symbol_availability():
+    """Реестр доступности пар: TTL, негативный кэш и backoff"""
+    print("\n🩺 Тестирование реестра доступности пар...")
+    
+    registry = SymbolAvailability(ttl=100, retry=10, max_backoff=25)
+    assert registry.stale(['EUR/USD']) == ['EUR/USD'] and registry.status('EUR/USD') is None
+    registry.record('EUR/USD', True)
+    registry.record('XAU/USD', False)
+    assert registry.stale(['EUR/USD', 'XAU/USD']) == []
+    assert registry.status('EUR/USD') is True and registry.status('XAU/USD') is False
+    assert 9 < registry.retry_in('XAU/USD') <= 10
+    # Повторные неудачи удваивают паузу до предела
+    registry.record('XAU/USD', False)
+    assert 19 < registry.retry_in('XAU/USD') <= 20
+    registry.record('XAU/USD', False)
+    assert 24 < registry.retry_in('XAU/USD') <= 25
+    # Успех сбрасывает счётчик неудач
+    registry.record('XAU/USD', True)
+    assert registry.status('XAU/USD') is True and 99 < registry.retry_in('XAU/USD') <= 100
+    
+    # Проверка доступности хранит причину отказа и не трогает буферы свечей
+    analyzer = TechnicalAnalyzer(SyntheticProvider())
+    analyzer.market_index.refresh()
+    analyzer.get_ohlcv_data('BTC/USDT', '1m', limit=200)
+    buffers = dict(analyzer._candle_buffers)
+    assert len(analyzer.get_ohlcv_batch(['BTC/USDT'], '1m', limit=1, store=False)['BTC/USDT']) == 1
+    assert analyzer.probe_symbols(['XAU/XYZ', 'BTC/USDT']) == {'BTC/USDT': True, 'XAU/XYZ': False}
+    assert analyzer._candle_buffers == buffers and len(buffers[('binance', 'BTCUSDT', '1m')]) == 200
+    assert 'Yahoo Finance' in analyzer.availability.reason('XAU/XYZ') and analyzer.availability.reason('BTC/USDT') is None
+    
+    # Пока индекс Binance не загружен, отказ Yahoo предварительный и не запоминается
+    class OfflineMarkets(SyntheticProvider):
+        def load_markets(self, reload=False):
+            raise ConnectionError("нет сети")
+    
+    analyzer = TechnicalAnalyzer(OfflineMarkets())
+    try:
+        assert analyzer.probe_symbols(['XAU/XYZ']) == {}
+        assert analyzer.availability.status('XAU/XYZ') is None and not analyzer.market_index.loaded
+        assert 'XAUXYZ' in analyzer._provisional_logged
+    finally:
+        analyzer.market_index.stop()
+    print("✅ Реестр доступности работает")
+
+def test_forecast_scheduler():
+    """Планировщик истечения прогнозов: порядок, пачки, отмена и задержка"""
+    print("\n⏲️ Тестирование планировщика прогнозов...")
+    
+    async def scenario():
+        fired = []
+        
+        async def handler(batch):
+            fired.extend(batch)
+        
+        scheduler = ForecastScheduler(handler)
+        scheduler.start()
+        now = time.time()
+        for i in range(1000):
+            scheduler.schedule(f"f{i}", now + 0.2 + (i % 5) * 0.05)
+        assert scheduler.cancel("f3") and not scheduler.cancel("f3")
+        # Более ранний срок будит цикл
+        scheduler.schedule("early", now + 0.05)
+        await asyncio.sleep(0.6)
+        await scheduler.stop()
+        return fired, scheduler.stats()
+    
+    fired, stats = asyncio.run(scenario())
+    assert fired[0] == "early" and len(fired) == 1000 and "f3" not in fired
+    assert stats['depth'] == 0 and stats['max_lag'] < 0.5
+    print(f"✅ Планировщик: {stats['fired']} проверок, макс. задержка {stats['max_lag']} с")
+
+def test_batched_forecast_resolution():
+    """Пачка истёкших прогнозов: одна загрузка цены на (пара, таймфрейм) внутри пачки"""
+    print("\n📦 Тестирование пакетной проверки прогнозов...")
+    
+    # Бот без Telegram-приложения: нужны только хранилище прогнозов и планировщик
+    bot = TelegramBot.__new__(TelegramBot)
+    bot.forecast_scheduler = ForecastScheduler(None)
+    bot.ledger = ForecastLedger('')
+    fetches, sent = [], []
+    
+    async def fetch_price(symbol, timeframe):
+        fetches.append((symbol, timeframe))
+        return 1.1010
+    
+    async def send_result(forecast, result):
+        sent.append((forecast['user_id'], result['result']))
+    
+    bot._fetch_resolution_price = fetch_price
+    bot.send_forecast_result = send_result
+    expires_at = 1_700_000_030.0
+    bot.forecasts = {}
+    for user_id in range(100):
+        bot.forecasts[f"f{user_id}"] = {
+            'id': f"f{user_id}", 'user_id': user_id, 'symbol': 'EURUSD', 'timeframe': '1m', 'current_price': 1.1000,
+            'prediction': "📈 ВВЕРХ" if user_id % 2 else "📉 ВНИЗ", 'expires_at': expires_at + user_id % 10
+        }
+    bot.forecasts['other'] = dict(bot.forecasts['f0'], id='other', user_id=100, timeframe='5m')
+    
+    asyncio.run(bot.resolve_forecasts(list(bot.forecasts)))
+    assert sorted(fetches) == [('EURUSD', '1m'), ('EURUSD', '5m')]
+    assert len(sent) == 101 and not bot.forecasts
+    assert dict(sent)[1] == "✅ ПЛЮС" and dict(sent)[2] == "❌ МИНУС"
+    
+    # Прогнозы одной свечи из разных пачек не получают цену, загруженную до их истечения
+    provider_calls = []
+    
+    async def get_data(symbol, timeframe, limit=200, fresh=False):
+        assert fresh
+        provider_calls.append((symbol, timeframe))
+        await asyncio.sleep(0.01)
+        return pd.DataFrame({'close': [1.1020]})
+    
+    del bot._fetch_resolution_price
+    bot.analyzer = TechnicalAnalyzer()
+    bot.analyzer.get_ohlcv_data_async = get_data
+    candle_start = time.time() // 60 * 60
+    
+    async def separate_batches():
+        for i, offset in enumerate((1, 4, 9)):
+            bot.forecasts[f"s{i}"] = {
+                'id': f"s{i}", 'user_id': 200 + i, 'symbol': 'GBPUSD', 'timeframe': '1m', 'current_price': 1.1000,
+                'prediction': "📈 ВВЕРХ", 'expires_at': candle_start + offset
+            }
+            await bot.resolve_forecasts([f"s{i}"])
+    
+    sent.clear()
+    asyncio.run(separate_batches())
+    assert provider_calls == [('GBPUSD', '1m')] * 3 and [result for _, result in sent] == ["✅ ПЛЮС"] * 3
+    print(f"✅ Пакетная проверка: 101 прогноз, {len(fetches)} загрузки цены; 3 пачки одной свечи — 3 загрузки")
+
+def test_forecast_ledger():
+    """Журнал прогнозов: пакетная запись, восстановление ожидающих и чтение текстов с диска"""
+    print("\n🗃️ Тестирование журнала прогнозов...")
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'forecasts.db')
+        ledger = ForecastLedger(path, flush_batch=1000)
+        now = time.time()
+        for i in range(3):
+            compact = ledger.add(f"f{i}", {
+                'symbol': 'EUR/USD', 'timeframe': '1m', 'trade_type': 'Forex', 'prediction': "📈 ВВЕРХ",
+                'score': 3.0, 'current_price': 1.1, 'user_id': i, 'chat_id': i, 'message_id': 10 + i,
+                'created_at': now, 'expires_at': now + 60 + i, 'details': f"детали {i}", 'summary': f"сводка {i}"
+            })
+        # В рабочем наборе нет текстов, а чтение видит ещё не сброшенную запись
+        assert 'details' not in compact and compact['id'] == 'f2'
+        assert ledger.get('f2')['details'] == "детали 2"
+        ledger.resolve('f0', {'result': "✅ ПЛЮС", 'close_price': 1.2, 'points': 1000})
+        ledger.cancel('f1')
+        assert ledger.flush() == 5
+        ledger.close()
+        
+        # После рестарта ожидает только f2, тексты читаются с диска
+        ledger = ForecastLedger(path)
+        pending = ledger.pending()
+        assert [row['id'] for row in pending] == ['f2']
+        assert ForecastLedger.compact(pending[0])['expires_at'] == now + 62
+        assert ledger.get('f0')['result'] == "✅ ПЛЮС" and ledger.get('f2')['summary'] == "сводка 2"
+        assert ledger.purge(time.time() + 1) == 2 and ledger.get('f0') is None
+        ledger.close()
+    print("✅ Журнал прогнозов: запись, восстановление и очистка работают")
+
+def test_forecast_stats():
+    """Статистика точности: O(1) обновление на проверку и выборка по паре/таймфрейму"""
+    print("\n🎯 Тестирование статистики прогнозов...")
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'forecasts.db')
+        ledger = ForecastLedger(path)
+        forecast = {'symbol': 'EUR/USD', 'timeframe': '1m', 'trade_type': 'Forex', 'score': 3.4}
+        outcomes = [(True, 10.0), (True, 6.0), (False, 4.0), (True, 2.0)]
+        for win, points in outcomes:
+            assert ledger.record_outcome(forecast, {'prediction_correct': win, 'points': points, 'close_price': 1.1})
+        # Без цены закрытия итог не учитывается
+        assert not ledger.record_outcome(forecast, {'prediction_correct': False, 'points': 0, 'close_price': None})
+        ledger.record_outcome(dict(forecast, timeframe='5m', score=-9.0), {'prediction_correct': False, 'points': 3.0, 'close_price': 1.1})
+        ledger.close()
+        
+        ledger = ForecastLedger(path)
+        rows = ledger.stats()
+        assert [(row['timeframe'], row['bucket']) for row in rows] == [('1m', 3), ('5m', 5)]
+        row = rows[0]
+        assert (row['wins'], row['losses'], row['total']) == (3, 1, 4) and row['win_rate'] == 0.75
+        assert row['avg_win_points'] == 6.0 and row['avg_loss_points'] == 4.0 and row['avg_points'] == 3.5
+        alpha = 2 / 51
+        expected = 1.0
+        for win, _ in outcomes[1:]:
+            expected += alpha * (float(win) - expected)
+        assert abs(row['recent_win_rate'] - expected) < 1e-12
+        assert [r['timeframe'] for r in ledger.stats('EUR/USD', '5m')] == ['5m']
+        assert ledger.stats('GBP/USD') == []
+        ledger.close()
+    print(f"✅ Статистика: точность {row['win_rate']:.0%}, скользящая {row['recent_win_rate']:.0%}")
+
+def test_analysis_coalescing():
+    """Одинаковые анализы в пределах свечи: одно вычисление на всех, отмена ожидающего его не прерывает"""
+    print("\n🔗 Тестирование объединения одинаковых анализов...")
+    
+    bot = TelegramBot.__new__(TelegramBot)
+    bot.analysis_flights = {}
+    calls = []
+    
+    async def perform_analysis(symbol, timeframe, trade_type=None):
+        calls.append((symbol, timeframe, trade_type))
+        await asyncio.sleep(0.05)
+        if symbol == 'BAD':
+            raise RuntimeError("нет данных")
+        return {'signal': "📈 ВВЕРХ", 'signals': [symbol]}
+    
+    bot.perform_analysis = perform_analysis
+    
+    async def scenario():
+        waiters = [asyncio.create_task(bot.analyze_coalesced('GBP/USD', '5m', 'Forex')) for _ in range(20)]
+        await asyncio.sleep(0)
+        # Пользователь отменил свой запрос — остальные всё равно получают результат
+        waiters[0].cancel()
+        results = await asyncio.gather(*waiters[1:])
+        later = await bot.analyze_coalesced('GBP/USD', '5m', 'Forex')
+        other = await bot.analyze_coalesced('GBP/USD', '5m', 'ОТС')
+        failures = 0
+        for _ in range(2):
+            try:
+                await bot.analyze_coalesced('BAD', '5m', 'Forex')
+            except RuntimeError:
+                failures += 1
+        return results, later, other, failures
+    
+    results, later, other, failures = asyncio.run(scenario())
+    assert calls.count(('GBP/USD', '5m', 'Forex')) == 1 and calls.count(('GBP/USD', '5m', 'ОТС')) == 1
+    assert all(r == later for r in results) and results[0] is not results[1]
+    # Ошибка не запоминается: второй запрос запускает анализ заново
+    assert failures == 2 and calls.count(('BAD', '5m', 'Forex')) == 2
+    print(f"✅ Объединение: {len(results) + 1} запросов, {len(calls)} вычислений")
+
+def test_scan_deadline():
+    """Поиск по всем парам: медленная пара выпадает по дедлайну одна, таймфрейм остаётся"""
+    print("\n⏱️ Тестирование дедлайна поиска по парам...")
+    
+    bot = TelegramBot.__new__(TelegramBot)
+    bot.analyzer = TechnicalAnalyzer()
+    bot.available_symbols = {'EUR/USD', 'GBP/USD', 'SLOW/USD'}
+    active, peak = [0], [0]
+    
+    async def get_data(symbol, timeframe, limit=200):
+        active[0] += 1
+        peak[0] = max(peak[0], active[0])
+        try:
+            await asyncio.sleep(10 if symbol == 'SLOW/USD' else 0.01)
+            return make_ohlcv(limit, seed=len(symbol) + len(timeframe))
+        finally:
+            active[0] -= 1
+    
+    bot.analyzer.get_ohlcv_data_async = get_data
+    config = dict(SCAN_CONFIG)
+    SCAN_CONFIG.update(timeframes=['1m', '5m'], concurrency=2, deadline=0.3)
+    try:
+        started = time.perf_counter()
+        best = asyncio.run(bot.analyze_all_pairs())
+        elapsed = time.perf_counter() - started
+    finally:
+        SCAN_CONFIG.clear()
+        SCAN_CONFIG.update(config)
+    assert best is not None and best['symbol'] != 'SLOW/USD'
+    assert elapsed < 2 and peak[0] <= 2
+    print(f"✅ Поиск за {elapsed:.2f} с: лучший {best['symbol']} {best['timeframe']}, без медленной пары")
+
+def test_cross_rates():
+    """Тестирование синтетических кросс-курсов через USD"""
+    print("\n💱 Тестирование синтетических кросс-курсов...")
+    
+    idx = pd.date_range('2024-01-01', periods=5, freq='1H')
+    usd_per_eur = pd.DataFrame({'open': 0.9, 'high': 0.91, 'low': 0.89, 'close': 0.9, 'volume': 0}, index=idx)
+    usd_per_jpy = pd.DataFrame({'open': 150.0, 'high': 151.0, 'low': 149.0, 'close': 150.0, 'volume': 0}, index=idx[1:])
+    
+    eur_jpy = CrossRateEngine.derive(usd_per_eur, usd_per_jpy)
+    jpy_eur = CrossRateEngine.derive(usd_per_jpy, usd_per_eur)
+    eur_usd = CrossRateEngine.derive(usd_per_eur, None)
+    
+    # Кросс строится только на общих свечах обеих ног
+    assert list(eur_jpy.index) == list(idx[1:])
+    assert np.allclose(eur_jpy['close'], 150.0 / 0.9)
+    assert np.allclose(jpy_eur['close'] * eur_jpy['close'], 1.0)
+    assert np.allclose(eur_usd['close'], 1 / 0.9)
+    # Инверсия меняет high и low местами: свечи остаются согласованными во всех путях
+    for df in (eur_jpy, jpy_eur, eur_usd):
+        assert (df['high'] >= df['low']).all()
+        assert (df['high'] >= df[['open', 'close']].max(axis=1)).all()
+        assert (df['low'] <= df[['open', 'close']].min(axis=1)).all()
+    assert np.allclose(eur_usd['high'], 1 / 0.89) and np.allclose(eur_usd['low'], 1 / 0.91)
+    print(f"   • EUR/JPY: {eur_jpy['close'].iloc[-1]:.4f}, JPY/EUR: {jpy_eur['close'].iloc[-1]:.6f}")
+    print("✅ Кросс-курсы рассчитываются корректно")
+
 def test_configuration():
     """Тестирование конфигурации"""
     print("\n⚙️ Тестирование конфигурации...")
@@ -152,6 +785,63 @@ def main():
         # Тестируем валидацию данных
         test_data_validation()
         
+        # Тестируем кэш OHLCV
+        test_ohlcv_cache()
+        
+        # Тестируем векторный MAD для CCI
+        test_cci_mad()
+        
+        # Тестируем потоковые индикаторы
+        test_streaming_indicators()
+        
+        # Тестируем ленивые индикаторы
+        test_lazy_indicators()
+        
+        # Тестируем анализ по хвосту истории
+        test_tail_only_analysis()
+        
+        # Тестируем векторный бэктест
+        test_backtest()
+        
+        # Тестируем панельный расчёт индикаторов
+        test_indicator_panel()
+        
+        # Тестируем дедлайн поиска по парам
+        test_scan_deadline()
+        
+        # Тестируем синтетические кросс-курсы
+        test_cross_rates()
+        
+        # Тестируем разбиение ответа Yahoo по тикерам
+        test_split_yf_download()
+        
+        # Тестируем реестр доступности пар
+        test_symbol_availability()
+        
+        # Тестируем планировщик прогнозов
+        test_forecast_scheduler()
+        
+        # Тестируем пакетную проверку прогнозов
+        test_batched_forecast_resolution()
+        
+        # Тестируем журнал прогнозов
+        test_forecast_ledger()
+        
+        # Тестируем статистику прогнозов
+        test_forecast_stats()
+        
+        # Тестируем объединение одинаковых анализов
+        test_analysis_coalescing()
+        
+        # Тестируем запись и воспроизведение данных
+        test_replay_provider()
+        
+        # Тестируем хранилище свечей
+        test_candle_store()
+        
+        # Тестируем разрыв истории после простоя
+        test_candle_store_gap()
+        
         # Тестируем технический анализ
         success = test_technical_analyzer()
         